@@ -0,0 +1,6 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Offline tooling for the enos_* modules: a simulated ENOS switch
+# (benchmarks.simulator) to run them against without real hardware.
+#
@@ -0,0 +1,8 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# python -m benchmarks --help
+#
+from benchmarks.bench import main
+
+main()
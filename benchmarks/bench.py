@@ -0,0 +1,270 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Latency and throughput benchmarks of the enos_* modules
+#
+# Every module is run, as Ansible runs a task, in a process of its own
+# (benchmarks.run_module) against simulated switches
+# (benchmarks.simulator), so the numbers cover the whole task: interpreter
+# start and imports, the persistent session broker, get_shell(), the
+# module logic and its error checks.  Each task is timed from the outside
+# ("task") and its phases come from the timings the module returns: TCP
+# connect, SSH auth, invoke_shell and the broker start or the attach to a
+# persistent session, enable, terminal-length, each command round trip,
+# the error scan of the replies, the running-config fetch and the output
+# file write.  Each scenario runs for several output sizes and
+# switch counts, the switches of a run being worked on concurrently as
+# parallel Ansible forks would.  Results are written as JSON:
+#
+#   python -m benchmarks --sizes 1024,1048576 --hosts 1,16 --output baseline.json
+#
+# The simulated switches listen on 127.0.0.2, 127.0.0.3, ... so each one
+# has its own address, as the controller-side caches are keyed on it.
+#
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import paramiko
+
+from benchmarks.simulator import Simulator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Keep the controller-side state and the persistent session brokers of
+# the runs out of ~/.ansible
+STATE_DIR = tempfile.mkdtemp(prefix='enos-bench-')
+os.environ['ANSIBLE_ENOS_STATE_DIR'] = STATE_DIR
+PERSIST_DIR = tempfile.mkdtemp(prefix='enos-bench-pc-')
+os.environ['ANSIBLE_ENOS_PERSIST_DIR'] = PERSIST_DIR
+
+USERNAME = 'admin'
+PASSWORD = 'admin'
+
+MODULES = ('enos_command', 'enos_multi_command', 'enos_save', 'enos_vlan', 'enos_interface')
+DEFAULT_SIZES = (1024, 64 * 1024, 1024 * 1024)
+DEFAULT_HOSTS = (1, 8)
+DEFAULT_PERSIST_TIMEOUT = 30
+
+
+class Timings(object):
+    """Durations of the phases of tasks, in seconds."""
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name, seconds):
+        self.phases.setdefault(name, []).append(seconds)
+
+
+#
+# One function per module, returning its arguments for the iteration-th
+# task of a case.  The names pushed change with iteration so that the
+# configuration modules have something to change every time
+#
+def enos_command(iteration):
+    # Read-only: runs from the enable prompt, streamed to the output file
+    return dict(clicommand='show tech')
+
+
+def enos_multi_command(iteration):
+    commands = ['show version', 'show vlan']
+    for vlan in range(100, 105):
+        commands.extend(['vlan %d' % vlan, 'name "bench-%d-%d"' % (vlan, iteration), 'exit'])
+    return dict(commands=commands)
+
+
+def enos_save(iteration):
+    # Compares the running and startup config digests first: the first
+    # task of a case writes memory, the others find nothing to save
+    return dict()
+
+
+def enos_vlan(iteration):
+    return dict(aggregate=[dict(vlan_id=vlan, name='bench-%d-%d' % (vlan, iteration))
+                           for vlan in range(200, 220)])
+
+
+def enos_interface(iteration):
+    return dict(interfaceOption='ethernet', interfaceRange='1/1-1/48',
+                interfaceArg1='description', interfaceArg2='"bench-%d"' % iteration)
+
+
+SCENARIOS = {
+    'enos_command': enos_command,
+    'enos_multi_command': enos_multi_command,
+    'enos_save': enos_save,
+    'enos_vlan': enos_vlan,
+    'enos_interface': enos_interface,
+}
+
+
+def run_task(module, simulator, iteration, outdir, persist_timeout):
+    """Run one module task against simulator and return its Timings."""
+    name = '%s_%s' % (module, simulator.host)
+    params = dict(host=simulator.host, port=simulator.port, username=USERNAME, password=PASSWORD,
+                  outputfile=os.path.join(outdir, name + '.txt'), persistTimeout=persist_timeout)
+    params.update(SCENARIOS[module](iteration))
+    path = os.path.join(outdir, name + '.json')
+    with open(path, 'w') as f:
+        json.dump(dict(ANSIBLE_MODULE_ARGS=params), f)
+
+    started = time.time()
+    process = subprocess.Popen([sys.executable, '-m', 'benchmarks.run_module', module, path], cwd=ROOT,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    elapsed = time.time() - started
+
+    result = _module_result(stdout)
+    if result is None:
+        raise RuntimeError('%s returned no result: %s' % (module, stderr.decode('utf-8', 'replace')[-300:].strip()))
+    if result.get('failed'):
+        raise RuntimeError(result.get('msg'))
+
+    timings = Timings()
+    timings.add('task', elapsed)
+    for phase, seconds in result.get('timings', {}).items():
+        if phase == 'commands':
+            for command in seconds:
+                timings.add('command', command['seconds'])
+        else:
+            timings.add(phase, seconds)
+    return timings
+
+
+def _module_result(stdout):
+    # The JSON result is the last line the module prints
+    for line in reversed(stdout.decode('utf-8', 'replace').splitlines()):
+        if line.startswith('{'):
+            try:
+                return json.loads(line)
+            except ValueError:
+                return None
+    return None
+
+
+def run_case(module, simulators, repeat, outdir, persist_timeout):
+    """Run repeat rounds of one task per simulator, concurrently, and
+    return the summary of the case."""
+    samples = Timings()
+    errors = []
+    started = time.time()
+    for iteration in range(repeat):
+        threads = []
+        for simulator in simulators:
+            thread = threading.Thread(target=_run_into, args=(module, simulator, iteration, outdir,
+                                                              persist_timeout, samples, errors))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    wall = time.time() - started
+
+    tasks = repeat * len(simulators)
+    return dict(module=module, hosts=len(simulators), repeat=repeat, tasks=tasks,
+                failed=len(errors), errors=sorted(set(errors))[:5],
+                wall_seconds=round(wall, 4), tasks_per_second=round(tasks / wall, 2),
+                phases=dict((name, summarize(values)) for name, values in samples.phases.items()))
+
+
+def _run_into(module, simulator, iteration, outdir, persist_timeout, samples, errors):
+    try:
+        timings = run_task(module, simulator, iteration, outdir, persist_timeout)
+    except Exception as e:
+        errors.append('%s: %s' % (type(e).__name__, e))
+        return
+    for name, values in timings.phases.items():
+        for value in values:
+            samples.add(name, value)
+
+
+def summarize(values):
+    """count, mean, p50, p95 and max of values (seconds), in milliseconds."""
+    values = sorted(values)
+    return dict(count=len(values),
+                mean_ms=round(1000.0 * sum(values) / len(values), 3),
+                p50_ms=round(1000.0 * _percentile(values, 50), 3),
+                p95_ms=round(1000.0 * _percentile(values, 95), 3),
+                max_ms=round(1000.0 * values[-1], 3))
+
+
+def _percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+def start_simulators(count, size, latency):
+    simulators = []
+    for index in range(count):
+        address = '127.0.%d.%d' % ((index + 2) // 256, (index + 2) % 256)
+        simulators.append(Simulator(address, latency=latency, sizes={'show': size},
+                                    tech_size=size).start())
+    return simulators
+
+
+def _int_list(text):
+    return [int(item) for item in text.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the enos_* modules against simulated switches')
+    parser.add_argument('--modules', default=','.join(MODULES),
+                        help='comma separated modules to run (default: all)')
+    parser.add_argument('--sizes', type=_int_list, default=list(DEFAULT_SIZES),
+                        help='comma separated output sizes in bytes of the show commands')
+    parser.add_argument('--hosts', type=_int_list, default=list(DEFAULT_HOSTS),
+                        help='comma separated numbers of switches worked on concurrently')
+    parser.add_argument('--repeat', type=int, default=5, help='tasks per switch and case')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='simulated switch delay before each reply, in seconds')
+    parser.add_argument('--persist-timeout', type=int, default=DEFAULT_PERSIST_TIMEOUT,
+                        help='persistTimeout of the tasks; 0 logs in for every task')
+    parser.add_argument('--output', default='benchmark.json', help='JSON results file')
+    args = parser.parse_args()
+
+    modules = [module for module in args.modules.split(',') if module]
+    for module in modules:
+        if module not in SCENARIOS:
+            parser.error('unknown module %s' % module)
+
+    outdir = tempfile.mkdtemp(prefix='enos-bench-out-')
+    cases = []
+    try:
+        for size in args.sizes:
+            for hosts in args.hosts:
+                simulators = start_simulators(hosts, size, args.latency)
+                try:
+                    for module in modules:
+                        case = run_case(module, simulators, args.repeat, outdir, args.persist_timeout)
+                        case['output_size'] = size
+                        cases.append(case)
+                        print('%-20s size=%-8d hosts=%-4d task p50=%9.3fms  %7.2f tasks/s%s' % (
+                            module, size, hosts, case['phases'].get('task', {}).get('p50_ms', 0),
+                            case['tasks_per_second'], '  (%d failed)' % case['failed'] if case['failed'] else ''))
+                finally:
+                    for simulator in simulators:
+                        simulator.stop()
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+        shutil.rmtree(STATE_DIR, ignore_errors=True)
+        # Brokers left idle exit on their own after --persist-timeout
+        shutil.rmtree(PERSIST_DIR, ignore_errors=True)
+
+    results = dict(created=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   python=platform.python_version(),
+                   paramiko=paramiko.__version__,
+                   platform=platform.platform(),
+                   latency=args.latency,
+                   persist_timeout=args.persist_timeout,
+                   repeat=args.repeat,
+                   cases=cases)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print('Results written to %s' % args.output)
@@ -0,0 +1,30 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Run one module of library/ in a process of its own, as Ansible runs a
+# task, with module_utils/ served as ansible.module_utils:
+#
+#   python -m benchmarks.run_module enos_command args.json
+#
+# args.json holds {"ANSIBLE_MODULE_ARGS": {...}} and the module prints its
+# JSON result on stdout.
+#
+import os
+import runpy
+import sys
+
+import ansible.module_utils
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    module, args = sys.argv[1:3]
+    ansible.module_utils.__path__.append(os.path.join(ROOT, 'module_utils'))
+    # AnsibleModule reads its arguments from the file named by argv[1]
+    sys.argv = [module, args]
+    runpy.run_path(os.path.join(ROOT, 'library', module + '.py'), run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()
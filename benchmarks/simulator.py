@@ -0,0 +1,614 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Simulated Lenovo ENOS switch, reachable over SSH on the local host
+#
+# The enos_* modules can be run against it without a real switch, from
+# Python (Simulator(...).start()) or by hand:
+#
+#   python -m benchmarks.simulator --port 2222 --latency 0.01
+#
+# It speaks just enough of the ENOS CLI for the modules: the login banner,
+# the user/privileged/configure prompts, enable with or without a
+# password, terminal-length, show running-config/startup-config/tech/
+# version/vlan/interface status/lldp remote-device/mac-address-table/arp,
+# write memory, VLAN and interface contexts (ranges
+# included) and "% Invalid input" replies. Each command can be given a
+# latency and an output size.
+#
+import argparse
+import logging
+import re
+import socket
+import threading
+import time
+
+import paramiko
+
+BANNER = 'Lenovo RackSwitch G8272.\r\n\r\nEnterprise Networking Operating System (ENOS)\r\n\r\n'
+INVALID = "% Invalid input detected at '^' marker.\r\n"
+DEFAULT_TECH_SIZE = 256 * 1024
+# Bytes handed to the SSH channel per write
+SEND_SIZE = 256 * 1024
+
+PROMPTS = {
+    'user': '>',
+    'exec': '#',
+    'config': '(config)#',
+    'vlan': '(config-vlan)#',
+    'interface': '(config-if)#',
+}
+
+# Clients dropping the connection without a goodbye is routine here
+logging.getLogger('paramiko').addHandler(logging.NullHandler())
+
+_HOST_KEY = []
+_HOST_KEY_LOCK = threading.Lock()
+
+
+def host_key():
+    """Return the RSA host key shared by all simulators of the process."""
+    with _HOST_KEY_LOCK:
+        if not _HOST_KEY:
+            _HOST_KEY.append(paramiko.RSAKey.generate(2048))
+        return _HOST_KEY[0]
+
+
+class Device(object):
+    """Configuration state of the simulated switch, shared by its sessions."""
+
+    def __init__(self, hostname='G8272', enable_password=None):
+        self.hostname = hostname
+        self.enable_password = enable_password
+        self.lock = threading.Lock()
+        self.globals = []
+        self.contexts = {}
+        self.order = []
+        self.add_context('vlan 1', ['name "Default VLAN"'])
+        self.startup = self.render()
+
+    def add_context(self, context, lines=None):
+        if context not in self.contexts:
+            self.contexts[context] = []
+            self.order.append(context)
+        for line in lines or []:
+            self.set_line(context, line)
+
+    def remove_context(self, context):
+        if self.contexts.pop(context, None) is not None:
+            self.order.remove(context)
+
+    def set_line(self, context, line):
+        # A setting replaces the one with the same keyword, "no <key>"
+        # removes every line starting with key.  "member <ports>" adds to
+        # the port list of the VLAN and "no member <ports>" takes from it
+        lines = self.contexts[context] if context else self.globals
+        words = line.split()
+        if words[0] == 'member' or words[:2] == ['no', 'member']:
+            self._set_members(lines, words[-1], words[0] == 'no')
+            return
+        if line.startswith('no '):
+            key = line[3:]
+            lines[:] = [old for old in lines if old != key and not old.startswith(key + ' ')]
+            return
+        keyword = line.split()[0]
+        for index, old in enumerate(lines):
+            if old.split()[0] == keyword:
+                lines[index] = line
+                return
+        lines.append(line)
+
+    @staticmethod
+    def _set_members(lines, ports, remove):
+        members = []
+        for old in lines:
+            if old.startswith('member '):
+                members = _expand(old.split()[1])
+        ports = _expand(ports)
+        if remove:
+            members = [port for port in members if port not in ports]
+        else:
+            members.extend(port for port in ports if port not in members)
+        lines[:] = [old for old in lines if not old.startswith('member ')]
+        if members:
+            lines.append('member %s' % ','.join(members))
+
+    def vlans(self):
+        return sorted(int(context.split()[1]) for context in self.order
+                      if context.startswith('vlan ') and context.split()[1].isdigit())
+
+    def render(self, filler=0):
+        out = ['version "8.4.8"', 'switch-type "Lenovo RackSwitch G8272"', '!',
+               'hostname "%s"' % self.hostname, '!']
+        out.extend(self.globals)
+        for context in self.order:
+            out.append('!')
+            out.append(context)
+            out.extend('\t%s' % line for line in self.contexts[context])
+            out.append('\texit')
+        # Pad with generated port descriptions up to the requested size,
+        # on a slot the modules are not pointed at
+        size = sum(len(line) + 2 for line in out)
+        port = 1
+        while size < filler:
+            block = ['!', 'interface port 9/%d' % port, '\tdescription "generated %d"' % port, '\texit']
+            out.extend(block)
+            size += sum(len(line) + 2 for line in block)
+            port += 1
+        return '\r\n'.join(out) + '\r\n'
+
+
+class Session(object):
+    """One CLI session: the prompt mode, the current contexts and the
+    reply to each line typed."""
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.device = simulator.device
+        self.mode = 'user'
+        self.contexts = []
+        self.awaiting_password = False
+        self.closed = False
+
+    def prompt(self):
+        return self.device.hostname + PROMPTS[self.mode]
+
+    def handle(self, line):
+        """Return the reply to line, prompt excluded."""
+        if self.awaiting_password:
+            self.awaiting_password = False
+            if line == self.device.enable_password:
+                self.mode = 'exec'
+                return '\r\n'
+            return '\r\n% Bad password\r\n'
+
+        command = ' '.join(line.split())
+        self.simulator.commands.append(command)
+        time.sleep(self.simulator.latency_for(command))
+        if not command:
+            return ''
+        if self.simulator.fails(command):
+            return self._invalid(line)
+        with self.device.lock:
+            reply = self._dispatch(command)
+        if reply is None:
+            return self._invalid(line)
+        return reply
+
+    def _invalid(self, line):
+        # "^" under the last word of the line, as ENOS marks the word it
+        # could not parse
+        column = len(self.prompt()) + len(line.rstrip()) - len(line.split()[-1])
+        return ' ' * column + '^\r\n' + INVALID
+
+    def _dispatch(self, command):
+        words = command.split()
+        if words[0] in ('show', 'sh'):
+            return self._show(' '.join(words[1:]), command)
+        if command in ('exit', 'logout', 'quit') and self.mode in ('user', 'exec'):
+            self.closed = True
+            return ''
+        if words[0] in ('terminal-length', 'ping', 'traceroute') or command.startswith('terminal '):
+            return self.simulator.output_for(command, '')
+        if self.mode == 'user':
+            if command == 'enable':
+                if self.device.enable_password:
+                    self.awaiting_password = True
+                    return 'Enter password: '
+                self.mode = 'exec'
+                return ''
+            return None
+        if command == 'enable':
+            return ''
+        if command == 'disable':
+            self.mode = 'user'
+            self.contexts = []
+            return ''
+        if command == 'end':
+            self.mode = 'exec'
+            self.contexts = []
+            return ''
+        if self.mode == 'exec':
+            if words[0] in ('configure', 'conf', 'config') and (len(words) == 1 or 'terminal'.startswith(words[1])):
+                self.mode = 'config'
+                return 'Enter configuration commands, one per line.  End with Ctrl/Z.\r\n'
+            if command in ('write', 'write memory', 'copy running-config startup-config', 'save'):
+                self.device.startup = self.device.render()
+                return 'Copy running configuration to startup configuration\r\n'
+            return None
+        return self._configure(command, words)
+
+    def _configure(self, command, words):
+        if command == 'exit':
+            if self.mode == 'config':
+                self.mode = 'exec'
+            else:
+                self.mode = 'config'
+                self.contexts = []
+            return ''
+        negate = words[0] == 'no'
+        head = words[1:] if negate else words
+        if head and head[0] in ('vlan', 'interface'):
+            contexts = _contexts(head)
+            if contexts is None:
+                return None
+            if negate:
+                for context in contexts:
+                    self.device.remove_context(context)
+                return ''
+            for context in contexts:
+                self.device.add_context(context)
+            self.mode = head[0]
+            self.contexts = contexts
+            return ''
+        if words[0] == 'hostname' and len(words) == 2:
+            self.device.hostname = words[1].strip('"')
+            return ''
+        if negate and not head:
+            return None
+        for context in self.contexts or [None]:
+            self.device.set_line(context, command)
+        return ''
+
+    def _show(self, what, command):
+        if what and 'running-config'.startswith(what.split()[0]):
+            return self.device.render(self.simulator.size_for(command))
+        if what.startswith('startup'):
+            return self.device.startup
+        if what.startswith('tech'):
+            size = self.simulator.size_for(command)
+            return _filler('tech-support', size if size else self.simulator.tech_size)
+        if what.startswith('version'):
+            return self.simulator.output_for(command, (
+                'System Information at  0:00:00 Mon Jan  2, 2017\r\n'
+                'Time zone: No timezone configured\r\n\r\n'
+                'Lenovo RackSwitch G8272\r\n\r\n'
+                'Switch has been up for 1 day, 0 hours, 0 minutes and 0 seconds.\r\n'
+                'Last boot: 0:00:00 Sun Jan  1, 2017 (reset from console)\r\n\r\n'
+                'MAC address: a4:8c:db:33:bc:00    IP (If 1) address: 10.0.0.1\r\n'
+                'Hardware Revision: 0\r\n'
+                'Hardware Part No: 00CJ066\r\n'
+                'Switch Serial No: Y052MV59Y052\r\n\r\n'
+                'MTM Value: 7159-HCV\r\n\r\n'
+                'Software Version 8.4.8.0 (FLASH image1), active configuration.\r\n'))
+        if what.startswith('interface status') or what.startswith('int status'):
+            rows = ['------------------------------------------------------------------',
+                    'Alias   Port   Speed    Duplex     Flow Ctrl      Link      Description',
+                    '------- ----   -----   --------  --TX-----RX--   ------    -------------']
+            for port in range(1, self.simulator.ports + 1):
+                description = ''
+                for line in self.device.contexts.get('interface port %d' % port, []):
+                    if line.startswith('description '):
+                        description = line[12:].strip('"')
+                rows.append('%-7d %-4d   %-6s   %-8s  %-6s %-6s   %-6s    %s' % (
+                    port, port, '10000', 'full', 'no', 'no', 'up' if port % 2 else 'down', description))
+            return self.simulator.output_for(command, '\r\n'.join(rows) + '\r\n')
+        if what.startswith('lldp remote-device'):
+            rows = ['LLDP Remote Devices Information',
+                    'Legend(possible values in DMAC column) :',
+                    'NB   - Nearest Bridge          - 01-80-C2-00-00-0E',
+                    '',
+                    'Total number of current entries: 2',
+                    '',
+                    'LocalPort | Index | Remote Chassis ID   | Remote Port  | Remote System Name  | DMAC',
+                    '----------|-------|---------------------|--------------|---------------------|---------',
+                    '1         | 1     | 08 17 f4 33 9d 00   | 23           | G8272-peer          | NB',
+                    '2         | 2     | 08 17 f4 33 9d 00   | 24           | G8272-peer          | NB']
+            return self.simulator.output_for(command, '\r\n'.join(rows) + '\r\n')
+        if what.startswith('mac-address-table'):
+            return self.simulator.mac_table()
+        if what.startswith('arp') or what.startswith('ip arp'):
+            return self.simulator.arp_table()
+        if what.startswith('vlan'):
+            rows = ['VLAN                Name                Status            Ports',
+                    '----  --------------------------------  ------  -------------------------']
+            for vlan in self.device.vlans():
+                name = 'VLAN %d' % vlan
+                for line in self.device.contexts['vlan %d' % vlan]:
+                    if line.startswith('name '):
+                        name = line[5:].strip('"')
+                rows.append('%-4d  %-32s  ena     ' % (vlan, name))
+            return self.simulator.output_for(command, '\r\n'.join(rows) + '\r\n')
+        return self.simulator.output_for(command, '')
+
+
+class Simulator(object):
+    """SSH server emulating an ENOS switch on host:port.
+
+    latency is the default delay, in seconds, before each reply and
+    command_latency maps command prefixes to their own delay.  sizes maps
+    command prefixes to the number of bytes their output is padded to,
+    outputs gives canned replies, errors lists command prefixes answered
+    with "% Invalid input".  port 0 picks a free port, see .port.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, username='admin', password='admin',
+                 enable_password=None, hostname='G8272', latency=0.0, command_latency=None,
+                 sizes=None, outputs=None, errors=(), tech_size=DEFAULT_TECH_SIZE, key=None,
+                 ports=48, mac_entries=16, arp_entries=16):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.device = Device(hostname, enable_password)
+        self.latency = latency
+        self.command_latency = command_latency or {}
+        self.sizes = sizes or {}
+        self.outputs = outputs or {}
+        self.errors = tuple(errors)
+        self.tech_size = tech_size
+        self.key = key
+        self.ports = ports
+        self.mac_entries = mac_entries
+        self.arp_entries = arp_entries
+        self.commands = []
+        self.connections = 0
+        self._socket = None
+        self._thread = None
+        self._transports = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        if self.key is None:
+            self.key = host_key()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, self.port))
+        self._socket.listen(128)
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._accept)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        for transport in self._transports:
+            transport.close()
+        self._transports = []
+
+    def serve_forever(self):
+        self.start()
+        print('ENOS simulator listening on %s:%d' % (self.host, self.port))
+        try:
+            while True:
+                time.sleep(3600)
+        finally:
+            self.stop()
+
+    def latency_for(self, command):
+        return _lookup(self.command_latency, command, self.latency)
+
+    def size_for(self, command):
+        return _lookup(self.sizes, command, 0)
+
+    def output_for(self, command, default):
+        output = _lookup(self.outputs, command, default)
+        return _filler(output, self.size_for(command)) if self.size_for(command) else output
+
+    def mac_table(self):
+        lines = ['Mac address Aging Time: 300', '',
+                 'Total number of FDB entries : %d' % self.mac_entries,
+                 '     MAC address       VLAN     Port    Trnk  State  Permanent  Openflow',
+                 '  -----------------  --------  -------  ----  -----  ---------  --------']
+        for entry in range(self.mac_entries):
+            mac = '02:00:%02x:%02x:%02x:%02x' % (entry >> 24 & 255, entry >> 16 & 255, entry >> 8 & 255, entry & 255)
+            lines.append('  %s  %6d    %-7d        FWD               No' % (mac, 1 + entry % 100, 1 + entry % self.ports))
+        return '\r\n'.join(lines) + '\r\n'
+
+    def arp_table(self):
+        lines = ['Total number of arp entries : %d' % self.arp_entries, '',
+                 '    IP address     Flags    MAC address    VLAN Age Port',
+                 ' --------------- ----- ----------------- ---- --- ----']
+        for entry in range(self.arp_entries):
+            ip = '10.%d.%d.%d' % (entry >> 16 & 255, entry >> 8 & 255, entry & 255)
+            mac = '02:01:%02x:%02x:%02x:%02x' % (entry >> 24 & 255, entry >> 16 & 255, entry >> 8 & 255, entry & 255)
+            lines.append(' %-15s       %s %4d %3d %-4d' % (ip, mac, 1 + entry % 100, entry % 10, 1 + entry % self.ports))
+        return '\r\n'.join(lines) + '\r\n'
+
+    def fails(self, command):
+        return any(command.startswith(prefix) for prefix in self.errors)
+
+    def _accept(self):
+        while self._socket is not None:
+            try:
+                sock, address = self._socket.accept()
+            except (OSError, socket.error):
+                return
+            thread = threading.Thread(target=self._connection, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _connection(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(self.key)
+        server = _Server(self)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError, socket.error):
+            return
+        self._transports.append(transport)
+        self.connections += 1
+        # Every session channel of the connection gets its own CLI session
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is None:
+                continue
+            thread = threading.Thread(target=self._channel, args=(server, channel))
+            thread.daemon = True
+            thread.start()
+
+    def _channel(self, server, channel):
+        if not server.shell_event(channel).wait(10):
+            channel.close()
+            return
+        session = Session(self)
+        try:
+            channel.sendall(BANNER + session.prompt())
+            pending = ''
+            while not session.closed:
+                data = channel.recv(65535)
+                if not data:
+                    break
+                pending += data.decode('utf-8', 'replace')
+                while not session.closed:
+                    match = re.search(r'\r\n|\r|\n', pending)
+                    if match is None:
+                        break
+                    line, pending = pending[:match.start()], pending[match.end():]
+                    echo = '' if session.awaiting_password else line
+                    reply = session.handle(line)
+                    if session.closed:
+                        break
+                    if reply.endswith('Enter password: '):
+                        _send(channel, echo + '\r\n' + reply)
+                    else:
+                        _send(channel, echo + '\r\n' + reply + session.prompt())
+        except (EOFError, socket.error, paramiko.SSHException):
+            pass
+        try:
+            channel.close()
+        except (EOFError, socket.error, paramiko.SSHException):
+            pass
+
+
+class _Server(paramiko.ServerInterface):
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def shell_event(self, channel):
+        with self._lock:
+            return self._events.setdefault(channel.get_id(), threading.Event())
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if username == self.simulator.username and password == self.simulator.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_event(channel).set()
+        return True
+
+
+def _lookup(table, command, default):
+    # Value of the longest prefix of command in table
+    best = None
+    for prefix in table:
+        if command.startswith(prefix) and (best is None or len(prefix) > len(best)):
+            best = prefix
+    return default if best is None else table[best]
+
+
+def _send(channel, text):
+    # channel.sendall() copies what is left after each write, slow for a
+    # large show tech: hand it a bounded piece at a time
+    data = text.encode('utf-8')
+    for start in range(0, len(data), SEND_SIZE):
+        channel.sendall(data[start:start + SEND_SIZE])
+
+
+def _filler(output, size):
+    # Pad output with numbered lines up to size bytes
+    parts = [output]
+    total = len(output)
+    if output and not output.endswith('\n'):
+        parts.append('\r\n')
+    number = 1
+    while total < size:
+        line = '%8d %s\r\n' % (number, 'x' * 70)
+        parts.append(line)
+        total += len(line)
+        number += 1
+    return ''.join(parts)
+
+
+def _contexts(words):
+    # Contexts entered by "vlan <range>" or "interface <type> <range>"
+    try:
+        if words[0] == 'vlan' and len(words) == 2:
+            return ['vlan %d' % vlan for vlan in _expand(words[1], vlans=True)]
+        if words[0] == 'interface' and len(words) == 3:
+            return ['interface %s %s' % (words[1], name) for name in _expand(words[2])]
+    except ValueError:
+        return None
+    return None
+
+
+def _expand(text, vlans=False):
+    # Names of a "1-4,9" / "1/1-1/48" range
+    names = []
+    for part in text.split(','):
+        first, sep, last = part.partition('-')
+        prefix, _, start = first.rpartition('/')
+        if not sep:
+            end = start
+        else:
+            end = last.rpartition('/')[2]
+        start, end = int(start), int(end)
+        if end < start or (vlans and not 1 <= start <= end <= 4094):
+            raise ValueError(part)
+        for number in range(start, end + 1):
+            names.append(number if vlans else ('%s/%d' % (prefix, number) if prefix else str(number)))
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated ENOS switch over SSH')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2222)
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='admin')
+    parser.add_argument('--enable-password')
+    parser.add_argument('--hostname', default='G8272')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds before each reply')
+    parser.add_argument('--tech-size', type=int, default=DEFAULT_TECH_SIZE,
+                        help='bytes of show tech output')
+    parser.add_argument('--mac-entries', type=int, default=16,
+                        help='rows of show mac-address-table')
+    parser.add_argument('--arp-entries', type=int, default=16,
+                        help='rows of show arp')
+    parser.add_argument('--size', action='append', default=[], metavar='COMMAND=BYTES',
+                        help='pad the output of COMMAND to BYTES')
+    parser.add_argument('--error', action='append', default=[], metavar='COMMAND',
+                        help='answer COMMAND with %% Invalid input')
+    args = parser.parse_args()
+
+    sizes = {}
+    for item in args.size:
+        command, _, size = item.rpartition('=')
+        sizes[command] = int(size)
+    simulator = Simulator(args.host, args.port, args.username, args.password, args.enable_password,
+                          args.hostname, args.latency, sizes=sizes, errors=args.error,
+                          tech_size=args.tech_size, mac_entries=args.mac_entries,
+                          arp_entries=args.arp_entries)
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Lenovo, Inc.
+
+# This module is distributed WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details <http://www.gnu.org/licenses/>.
+#
+# Module to back up the running config of Lenovo Switches
+# Lenovo Networking
+#
+#---- Documentation Start ----------------------------------------------------#
+DOCUMENTATION = '''
+---
+version_added: "1.7"
+module: enos_backup
+short_description: Back up the running config of Devices to content-addressed storage.
+description:
+    - Streams the output of "show running-config" to the controller, hashing it (sha256) as it arrives.
+    Backups are stored once per content under backupDir/objects, optionally compressed, and
+    backupDir/hosts/<host> records the hash of the latest backup of each switch. When the running config
+    has not changed since the previous backup nothing is written and the task reports changed=False.
+options:
+# Options are as given below
+    backupDir:
+        description:
+            - Directory holding the backups. Created when missing.
+        required: true
+        default: null
+        choices: []
+    compress:
+        description:
+            - Compression of the stored backups. zstd needs the zstandard Python package on the controller.
+        required: false
+        default: gzip
+        choices: [none, gzip, zstd]
+    host:
+        description:
+            - This is the variable which used to look into /etc/ansible/hosts file so that device IP addresses
+            - on which this template has to be applied is identified. Usually we specify the ansible keyword
+            - {{ inventory_hostname }} which we specify in the playbook which is an abstraction to the group of
+            - network elements that need to be configured.
+        required: true
+        default: null
+        choices: []
+    username:
+        description:
+            - Configures the username to use to authenticate the connection to the remote device. The value of
+            - username is used to authenticate the SSH session. The value has to come from inventory file ideally,
+            - you can even enter it as variable.
+        required: true
+        default:
+        choices: []
+    password:
+        description:
+            - Configures the password to use to authenticate the connection to the remote device.
+            - The value of password is used to authenticate the SSH session.The value has to come from inventory file ideally,
+            - you can even enter it as variable.
+        required: true
+        default:
+        choices: []
+    enablePassword:
+        description:
+            - Inputs the enable password, in case its enables in the device. This get ignored if the device is not demanding an enable password.
+            - The value of password is used to enter the config mode.The default value is empty string. The value has to come from inventory file ideally,
+            - you can even enter it as variable.
+        required: false
+        default:
+        choices: []
+    port:
+        description:
+            - SSH port of the switch.
+        required: false
+        default: 22
+        choices: []
+    persistTimeout:
+        description:
+            - Number of seconds an idle SSH session to the switch is kept open so later tasks can reuse it
+            instead of logging in again. Set to 0 to open and close a new session for every task.
+            Can also be set with the ANSIBLE_ENOS_PERSIST_TIMEOUT environment variable.
+        required: false
+        default: 30
+        choices: []
+    commandTimeout:
+        description:
+            - Maximum number of seconds to wait for the switch prompt after each command. Commands return as soon
+            as the prompt shows, this is only the deadline after which the task fails. When not set, each command
+            gets a deadline learnt from the earlier reply times of the switch for that kind of command, 120
+            seconds until enough of them are known.
+        required: false
+        default: null
+        choices: []
+    metricsSink:
+        description:
+            - Where to also send the timings of the task, "udp://host:port" for a statsd server or the path of a
+            JSON-lines file to append to. Can also be set with the ANSIBLE_ENOS_METRICS_SINK environment variable.
+        required: false
+        default: null
+        choices: []
+notes:
+    - The backups hold the switch configuration, passwords included. Directories are created readable by the
+    controller user only.
+'''
+EXAMPLES = '''
+Inside tasks/main.yml
+---
+- name: Nightly backup
+  enos_backup:
+    host: "{{ inventory_hostname }}"
+    username: "{{ hostvars[inventory_hostname]['username'] }}"
+    password: "{{ hostvars[inventory_hostname]['password'] }}"
+    backupDir: ./backups
+    compress: gzip
+'''
+
+RETURN = '''
+sha256:
+    description: Hash of the running config, line ends normalised to \\n.
+    returned: success
+    type: string
+    sample: "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+backup:
+    description: Path of the stored backup.
+    returned: success
+    type: string
+    sample: "./backups/objects/9f/9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08.gz"
+previous:
+    description: Hash of the previous backup of the switch, null for the first one.
+    returned: success
+    type: string
+size:
+    description: Size of the running config in bytes, before compression.
+    returned: success
+    type: int
+timings:
+    description: Seconds spent in each phase of the task (tcp_connect, ssh_auth, invoke_shell and
+      broker_spawn, or attach; enable, terminal_length, get_config, error_scan, file_write), the reply time of
+      each command and the total.
+    returned: always
+    type: dict
+    sample: {"tcp_connect": 0.01, "ssh_auth": 0.4, "invoke_shell": 0.05, "enable": 0.01, "terminal_length": 0.01,
+             "error_scan": 0.001, "commands": [{"command": "show version", "seconds": 0.01}], "total": 0.6}
+'''
+#---- Documentation Ends ----------------------------------------------------#
+#---- Logic Start ------------------------------------------------------------#
+
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import time
+try:
+    from ansible.module_utils import enos
+    HAS_LIB = True
+except ImportError as e:
+    HAS_LIB = False
+    LIB_IMPORT_ERROR = str(e)
+try:
+    import zstandard
+    HAS_ZSTD = True
+except ImportError:
+    HAS_ZSTD = False
+
+#
+# load Ansible module
+#
+from ansible.module_utils import basic
+from ansible.module_utils.basic import AnsibleModule
+
+# Running configs up to this size are spooled in memory, larger ones to a
+# temporary file, until it is known whether they need storing
+SPOOL_SIZE = 4 * 1024 * 1024
+
+EXTENSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def object_path(backupDir, digest, compress):
+    return os.path.join(backupDir, 'objects', digest[:2], digest + EXTENSIONS[compress])
+
+
+def host_path(backupDir, host):
+    return os.path.join(backupDir, 'hosts', re.sub(r'[^\w.\-]', '_', host))
+
+
+def read_latest(path):
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+def atomic_write(path, write):
+    #
+    # Call write with a temporary file next to path, then rename it over
+    # path so a backup is never seen half written
+    #
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def store_object(spool, path, compress):
+    spool.seek(0)
+
+    def write(f):
+        if compress == 'gzip':
+            # mtime=0 so the same config always compresses to the same bytes
+            with gzip.GzipFile(fileobj=f, mode='wb', mtime=0) as out:
+                shutil.copyfileobj(spool, out)
+        elif compress == 'zstd':
+            zstandard.ZstdCompressor().copy_stream(spool, f)
+        else:
+            shutil.copyfileobj(spool, f)
+    atomic_write(path, write)
+
+
+def record_backup(path, digest):
+    atomic_write(path, lambda f: f.write(('%s\n' % digest).encode('ascii')))
+    with open(path + '.log', 'a') as f:
+        f.write('%s %s\n' % (time.strftime('%Y-%m-%dT%H:%M:%S'), digest))
+
+
+#
+def  main():
+    if not HAS_LIB:
+        # The option specs come from enos: take whatever was passed, kept
+        # out of the logs, to report why it did not load
+        params = basic._load_params()
+        AnsibleModule(argument_spec=dict((name, dict(no_log=True)) for name in params)).fail_json(
+            msg="enos module_utils could not be imported: %s" % LIB_IMPORT_ERROR)
+    #
+    # Define parameters for backup entry
+    #
+    argument_spec = dict(
+        backupDir=dict(required=True, type='path'),
+        compress=dict(required=False, default='gzip', choices=['none', 'gzip', 'zstd']),
+        host=dict(required=True),
+        username=dict(required=True),
+        password=dict(required=True, no_log=True),
+        enablePassword=dict(required=False, no_log=True),
+        deviceType=dict(required=False))
+    argument_spec.update(enos.enos_session_spec)
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
+
+    enablePassword = module.params['enablePassword']
+    backupDir = module.params['backupDir']
+    compress = module.params['compress']
+    hostIP = module.params['host']
+    timeout = module.params['commandTimeout']
+    if compress == 'zstd' and not HAS_ZSTD:
+        module.fail_json(msg='compress=zstd needs the zstandard Python package')
+
+    # Attach to a persistent shell for this switch, only logging in when
+    # no live session is available
+    remote_conn = enos.get_shell(module)
+
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    try:
+        # Enable and terminal length = 0, written at once
+        enos.bootstrap(remote_conn, enablePassword, timeout)
+
+        # Hash the running config as it streams in, spooling a copy
+        digest = enos.digest_command(remote_conn, "show running-config", timeout, copy=spool)
+    except enos.EnosError as e:
+        spool.close()
+        remote_conn.close()
+        module.fail_json(msg=str(e))
+    remote_conn.close()
+
+    sha256 = digest.hexdigest()
+    backup = object_path(backupDir, sha256, compress)
+    latest = host_path(backupDir, hostIP)
+    previous = read_latest(latest)
+    if previous == sha256 and os.path.exists(backup):
+        spool.close()
+        module.exit_json(changed=False, sha256=sha256, backup=backup, previous=previous, size=digest.size,
+                         msg="Running config unchanged since the previous backup")
+
+    # Identical configs of other switches are stored once
+    if not os.path.exists(backup):
+        store_object(spool, backup, compress)
+    spool.close()
+    record_backup(latest, sha256)
+    module.exit_json(changed=True, sha256=sha256, backup=backup, previous=previous, size=digest.size,
+                     msg="Running config backed up")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Lenovo, Inc.
+
+# This module is distributed WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details <http://www.gnu.org/licenses/>.
+#
+# Module to collect the MAC address and ARP tables of Lenovo Switches
+# Lenovo Networking
+#
+#---- Documentation Start ----------------------------------------------------#
+DOCUMENTATION = '''
+---
+version_added: "1.7"
+module: enos_collect
+short_description: Collect the MAC address or ARP table of Devices into a CSV, JSON-lines or Parquet file.
+description:
+    - Sends "show mac-address-table" or "show arp" and parses the reply row by row as it streams in, each
+    row being written to outputfile straight away. Neither the reply nor the table is held in memory, so tables
+    of hundreds of thousands of entries are collected with flat memory use.
+options:
+# Options are as given below
+    table:
+        description:
+            - Table to collect.
+        required: false
+        default: mac
+        choices: [mac, arp]
+    outputfile:
+        description:
+            - This specifies the file path where the table is written.
+        required: true
+        default: null
+        choices: []
+    format:
+        description:
+            - Format of outputfile. csv has a header line with the column names, jsonl one JSON object per entry.
+            parquet needs the pyarrow Python package on the controller.
+        required: false
+        default: csv
+        choices: [csv, jsonl, parquet]
+    host:
+        description:
+            - This is the variable which used to look into /etc/ansible/hosts file so that device IP addresses
+            - on which this template has to be applied is identified. Usually we specify the ansible keyword
+            - {{ inventory_hostname }} which we specify in the playbook which is an abstraction to the group of
+            - network elements that need to be configured.
+        required: true
+        default: null
+        choices: []
+    username:
+        description:
+            - Configures the username to use to authenticate the connection to the remote device. The value of
+            - username is used to authenticate the SSH session. The value has to come from inventory file ideally,
+            - you can even enter it as variable.
+        required: true
+        default:
+        choices: []
+    password:
+        description:
+            - Configures the password to use to authenticate the connection to the remote device.
+            - The value of password is used to authenticate the SSH session.The value has to come from inventory file ideally,
+            - you can even enter it as variable.
+        required: true
+        default:
+        choices: []
+    enablePassword:
+        description:
+            - Inputs the enable password, in case its enables in the device. This get ignored if the device is not demanding an enable password.
+            - The value of password is used to enter the config mode.The default value is empty string. The value has to come from inventory file ideally,
+            - you can even enter it as variable.
+        required: false
+        default:
+        choices: []
+    port:
+        description:
+            - SSH port of the switch.
+        required: false
+        default: 22
+        choices: []
+    persistTimeout:
+        description:
+            - Number of seconds an idle SSH session to the switch is kept open so later tasks can reuse it
+            instead of logging in again. Set to 0 to open and close a new session for every task.
+            Can also be set with the ANSIBLE_ENOS_PERSIST_TIMEOUT environment variable.
+        required: false
+        default: 30
+        choices: []
+    commandTimeout:
+        description:
+            - Maximum number of seconds to wait for the switch prompt after each command. Commands return as soon
+            as the prompt shows, this is only the deadline after which the task fails. When not set, each command
+            gets a deadline learnt from the earlier reply times of the switch for that kind of command, 120
+            seconds until enough of them are known.
+        required: false
+        default: null
+        choices: []
+    metricsSink:
+        description:
+            - Where to also send the timings of the task, "udp://host:port" for a statsd server or the path of a
+            JSON-lines file to append to. Can also be set with the ANSIBLE_ENOS_METRICS_SINK environment variable.
+        required: false
+        default: null
+        choices: []
+'''
+EXAMPLES = '''
+Inside tasks/main.yml
+---
+- name: Collect the MAC address tables
+  enos_collect:
+    host: "{{ inventory_hostname }}"
+    username: "{{ hostvars[inventory_hostname]['username'] }}"
+    password: "{{ hostvars[inventory_hostname]['password'] }}"
+    table: mac
+    format: csv
+    outputfile: "./results/mac_{{ inventory_hostname }}.csv"
+
+- name: Collect the ARP tables
+  enos_collect:
+    host: "{{ inventory_hostname }}"
+    username: "{{ hostvars[inventory_hostname]['username'] }}"
+    password: "{{ hostvars[inventory_hostname]['password'] }}"
+    table: arp
+    format: parquet
+    outputfile: "./results/arp_{{ inventory_hostname }}.parquet"
+'''
+
+RETURN = '''
+rows:
+    description: Number of table entries written to outputfile.
+    returned: success
+    type: int
+    sample: 100000
+fields:
+    description: Column names of the table, in outputfile order.
+    returned: success
+    type: list
+    sample: ["mac_address", "vlan", "port", "trunk", "state", "permanent", "openflow"]
+timings:
+    description: Seconds spent in each phase of the task (tcp_connect, ssh_auth, invoke_shell and
+      broker_spawn, or attach; enable, terminal_length, error_scan, file_write), the reply time of each command
+      and the total.
+    returned: always
+    type: dict
+    sample: {"tcp_connect": 0.01, "ssh_auth": 0.4, "invoke_shell": 0.05, "enable": 0.01, "terminal_length": 0.01,
+             "error_scan": 0.001, "commands": [{"command": "show version", "seconds": 0.01}], "total": 0.6}
+'''
+#---- Documentation Ends ----------------------------------------------------#
+#---- Logic Start ------------------------------------------------------------#
+
+import csv
+import json
+import os
+from collections import OrderedDict
+try:
+    from ansible.module_utils import enos
+    from ansible.module_utils import enos_parsers
+    HAS_LIB = True
+except ImportError as e:
+    HAS_LIB = False
+    LIB_IMPORT_ERROR = str(e)
+try:
+    import pyarrow
+    import pyarrow.parquet
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+#
+# load Ansible module
+#
+from ansible.module_utils import basic
+from ansible.module_utils.basic import AnsibleModule
+
+COMMANDS = {'mac': 'show mac-address-table', 'arp': 'show arp'}
+
+# Parquet rows are buffered and written a row group of this size at a time
+ROW_GROUP_SIZE = 64 * 1024
+
+
+class TableWriter(object):
+    """Writes the rows (tuples) of a table to path as parser returns
+    them.  The column names are those of parser, known once it has read
+    the table header."""
+
+    def __init__(self, path, parser):
+        self.path = path
+        self.parser = parser
+        self.rows = 0
+
+    @property
+    def fields(self):
+        return self.parser.fields or []
+
+    def write(self, row):
+        self.rows += 1
+
+    def close(self):
+        pass
+
+
+class CsvWriter(TableWriter):
+
+    def __init__(self, path, parser):
+        TableWriter.__init__(self, path, parser)
+        self._file = open(path, 'w')
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        self._header = False
+
+    def write(self, row):
+        if not self._header:
+            self._writer.writerow(self.fields)
+            self._header = True
+        self._writer.writerow(row)
+        self.rows += 1
+
+    def close(self):
+        if not self._header and self.fields:
+            self._writer.writerow(self.fields)
+        self._file.close()
+
+
+class JsonLinesWriter(TableWriter):
+
+    def __init__(self, path, parser):
+        TableWriter.__init__(self, path, parser)
+        self._file = open(path, 'w')
+        self._encode = json.JSONEncoder().encode
+
+    def write(self, row):
+        self._file.write(self._encode(OrderedDict(zip(self.fields, row))) + '\n')
+        self.rows += 1
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter(TableWriter):
+
+    def __init__(self, path, parser):
+        TableWriter.__init__(self, path, parser)
+        self._buffer = []
+        self._writer = None
+
+    def write(self, row):
+        self._buffer.append(row)
+        self.rows += 1
+        if len(self._buffer) >= ROW_GROUP_SIZE:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        if self._writer is None:
+            # Empty table, still leave a file with the columns
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, self._schema())
+        self._writer.close()
+
+    def _schema(self):
+        return pyarrow.schema([(name, pyarrow.string()) for name in self.fields])
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        if self._writer is None:
+            self._writer = pyarrow.parquet.ParquetWriter(self.path, self._schema())
+        columns = [pyarrow.array(column, pyarrow.string()) for column in zip(*self._buffer)]
+        self._writer.write_table(pyarrow.Table.from_arrays(columns, schema=self._schema()))
+        self._buffer = []
+
+
+WRITERS = {'csv': CsvWriter, 'jsonl': JsonLinesWriter, 'parquet': ParquetWriter}
+
+
+#
+def  main():
+    if not HAS_LIB:
+        # The option specs come from enos: take whatever was passed, kept
+        # out of the logs, to report why it did not load
+        params = basic._load_params()
+        AnsibleModule(argument_spec=dict((name, dict(no_log=True)) for name in params)).fail_json(
+            msg="enos module_utils could not be imported: %s" % LIB_IMPORT_ERROR)
+    #
+    # Define parameters for table collection
+    #
+    argument_spec = dict(
+        table=dict(required=False, default='mac', choices=['mac', 'arp']),
+        outputfile=dict(required=True),
+        format=dict(required=False, default='csv', choices=['csv', 'jsonl', 'parquet']),
+        host=dict(required=True),
+        username=dict(required=True),
+        password=dict(required=True, no_log=True),
+        enablePassword=dict(required=False, no_log=True),
+        deviceType=dict(required=False))
+    argument_spec.update(enos.enos_session_spec)
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
+
+    enablePassword = module.params['enablePassword']
+    outputfile = module.params['outputfile']
+    outputformat = module.params['format']
+    timeout = module.params['commandTimeout']
+    command = COMMANDS[module.params['table']]
+    if outputformat == 'parquet' and not HAS_PYARROW:
+        module.fail_json(msg='format=parquet needs the pyarrow Python package')
+
+    # Attach to a persistent shell for this switch, only logging in when
+    # no live session is available
+    remote_conn = enos.get_shell(module)
+
+    directory = os.path.dirname(outputfile)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    parser = enos_parsers.get_parser(command)
+    writer = WRITERS[outputformat](outputfile, parser)
+
+    try:
+        # Enable and terminal length = 0, written at once
+        enos.bootstrap(remote_conn, enablePassword, timeout)
+
+        # Each row goes to the writer as soon as its line has come in
+        sink = enos.stream_command(remote_conn, command, enos.OutputParser(parser, emit=writer.write), timeout)
+        sink.close()
+    except enos.EnosError as e:
+        writer.close()
+        remote_conn.close()
+        module.fail_json(msg=str(e))
+    remote_conn.close()
+
+    writer.close()
+    module.exit_json(changed=True, rows=writer.rows, fields=writer.fields,
+                     msg="%d table entries saved in file" % writer.rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -31,11 +31,19 @@ options:
         required: true
         default: null
         choices: []
+    mode:
+        description:
+            - Mode the command runs in. exec runs it from the enable prompt, config between "configure t" and "end".
+            auto picks exec for show, display, dir, ping and traceroute and config for anything else.
+        required: false
+        default: auto
+        choices: [auto, exec, config]
     outputfile:
         description:
             - This specifies the file path to which the output of each command excection is persisted.
              Response from the device saved here. Usually the location is the results folder.
              But your user can choose which ever path he has write permission.
+             Output is written as it arrives. If the path ends in .gz it is gzip-compressed.
         required: true
         default: null
         choices: []
@@ -72,6 +80,45 @@ options:
         required: false
         default:
         choices: []
+    port:
+        description:
+            - SSH port of the switch.
+        required: false
+        default: 22
+        choices: []
+    persistTimeout:
+        description:
+            - Number of seconds an idle SSH session to the switch is kept open so later tasks can reuse it
+            instead of logging in again. Set to 0 to open and close a new session for every task.
+            Can also be set with the ANSIBLE_ENOS_PERSIST_TIMEOUT environment variable.
+        required: false
+        default: 30
+        choices: []
+    commandTimeout:
+        description:
+            - Maximum number of seconds to wait for the switch prompt after each command. Commands return as soon
+            as the prompt shows, this is only the deadline after which the task fails. When not set, each command
+            gets a deadline learnt from the earlier reply times of the switch for that kind of command, 120
+            seconds until enough of them are known.
+        required: false
+        default: null
+        choices: []
+    metricsSink:
+        description:
+            - Where to also send the timings of the task, "udp://host:port" for a statsd server or the path of a
+            JSON-lines file to append to. Can also be set with the ANSIBLE_ENOS_METRICS_SINK environment variable.
+        required: false
+        default: null
+        choices: []
+    commandCacheTtl:
+        description:
+            - Number of seconds the output of a read-only (exec mode) command is kept on the controller and
+            returned to later tasks running the same command on the switch, without logging in. Configuration
+            changes and saves made with the enos_* modules invalidate it. 0 disables the cache.
+            Can also be set with the ANSIBLE_ENOS_COMMAND_CACHE_TTL environment variable.
+        required: false
+        default: 0
+        choices: []
     deviceType:
         description:
             - This specifies the type of device against which the image is downloaded. The value has to come from inventory file ideally,
@@ -83,8 +130,7 @@ notes:
     - For help in developing on modules, should you be so inclined, please read
     Community Information & Contributing, Helping Testing PRs and Developing Modules.
     Module Dependency :
-    1. cnos_command.py
-    2. cnos_utility.py
+    1. enos.py (module_utils)
 '''
 EXAMPLES = '''
 Inside tasks/main.yml
@@ -108,106 +154,150 @@ In the inventory file u specify as
 RETURN = '''
 On successful execution, the method returns and empty string with a message "Command Applied" in json format.
 But upon any failure, the output will be the error display string.
+mode:
+    description: Mode the command ran in, exec or config.
+    returned: success
+    type: string
+    sample: exec
+cached:
+    description: Whether the output came from the command cache (see commandCacheTtl) rather than the switch.
+    returned: success
+    type: bool
+    sample: false
+parsed:
+    description: Output of the command as a list of rows, for the show commands enos_parsers knows (show vlan,
+      show interface status, show lldp remote-device, show mac-address-table and show version).
+    returned: when the command has a parser
+    type: list
+    sample: [{"vlan_id": "1", "name": "Default VLAN", "status": "ena", "ports": "1-64"}]
+timings:
+    description: Seconds spent in each phase of the task (tcp_connect, ssh_auth, invoke_shell and
+      broker_spawn, or attach; enable, terminal_length, get_config, error_scan, file_write), the reply time of
+      each command and the total.
+    returned: always
+    type: dict
+    sample: {"tcp_connect": 0.01, "ssh_auth": 0.4, "invoke_shell": 0.05, "enable": 0.01, "terminal_length": 0.01,
+             "error_scan": 0.001, "commands": [{"command": "show version", "seconds": 0.01}], "total": 0.6}
 '''
 #---- Documentation Ends ----------------------------------------------------#
 #---- Logic Start ------------------------------------------------------------#
 
-import sys
-import paramiko
-import time
-import argparse
-import socket
-import array
-import json
-import time
-import re
 try:
-    from ansible.module_utils import cnos
+    from ansible.module_utils import enos
+    from ansible.module_utils import enos_parsers
     HAS_LIB = True
-except:
+except ImportError as e:
     HAS_LIB = False
-#try:
-#    import cnos_utility
-#    HAS_LIB=True
-#except:
-#    HAS_LIB=False
+    LIB_IMPORT_ERROR = str(e)
+
 #
 # load Ansible module
 #
-from ansible.module_utils.basic import *
-from collections import defaultdict
+from ansible.module_utils import basic
+from ansible.module_utils.basic import AnsibleModule
 
 #
 def  main():
+    if not HAS_LIB:
+        # The option specs come from enos: take whatever was passed, kept
+        # out of the logs, to report why it did not load
+        params = basic._load_params()
+        AnsibleModule(argument_spec=dict((name, dict(no_log=True)) for name in params)).fail_json(
+            msg="enos module_utils could not be imported: %s" % LIB_IMPORT_ERROR)
     #
     # Define parameters for commandline entry
     #
-    module = AnsibleModule(
-        argument_spec=dict(
-            clicommand=dict(required=True),
-            outputfile=dict(required=True),
-            host=dict(required=True),
-            # deviceType=dict(required=True),
-            deviceType=dict(required=False),
-            username=dict(required=True),
-            password=dict(required=True, no_log=True),
-            enablePassword=dict(required=False, no_log=True),),
-        supports_check_mode=False)
-
-    username = module.params['username']
-    password = module.params['password']
+    argument_spec = dict(
+        clicommand=dict(required=True),
+        mode=dict(required=False, default='auto', choices=['auto', 'exec', 'config']),
+        outputfile=dict(required=True),
+        host=dict(required=True),
+        # deviceType=dict(required=True),
+        deviceType=dict(required=False),
+        username=dict(required=True),
+        password=dict(required=True, no_log=True),
+        enablePassword=dict(required=False, no_log=True))
+    argument_spec.update(enos.enos_session_spec)
+    argument_spec.update(enos.enos_command_cache_spec)
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
+
     enablePassword = module.params['enablePassword']
     cliCommand= module.params['clicommand']
-    # deviceType = module.params['deviceType']
-    deviceType = "g8272_cnos" 
+    mode = module.params['mode']
+    if mode == 'auto':
+        mode = enos.command_mode(cliCommand)
     outputfile =  module.params['outputfile']
     hostIP = module.params['host']
-    output = ""
-
-    # Create instance of SSHClient object
-    remote_conn_pre = paramiko.SSHClient()
-
-    # Automatically add untrusted hosts (make sure okay for security policy in your environment)
-    remote_conn_pre.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    # initiate SSH connection with the switch
-    remote_conn_pre.connect(hostIP, username=username, password=password, look_for_keys=False)
-    time.sleep(2)
-
-    # Use invoke_shell to establish an 'interactive session'
-    remote_conn = remote_conn_pre.invoke_shell()
-    time.sleep(2)
+    timeout = module.params['commandTimeout']
+    parsed = None
 
-    # Enable and enter configure terminal then send command
-    output = output + cnos.waitForDeviceResponse("\n",">", 2, remote_conn)
+    # A show command run by an earlier task needs no login
+    cache = enos.CommandCache(module.params)
+    timings = enos.Timings()
+    outputs = cache.get([cliCommand], timings) if mode == 'exec' else None
+    if outputs is not None:
+        enos.report_timings(module, timings)
+        outfile = enos.open_output(outputfile)
+        outfile.write(enos.to_bytes('%s\n%s\n' % (cliCommand, outputs[0])))
+        outfile.close()
+        parsed = enos_parsers.parse_output(cliCommand, outputs[0])
+        if parsed is not None:
+            module.exit_json(changed=False, mode=mode, cached=True, parsed=parsed,
+                             msg="CLI command executed and results saved in file ")
+        module.exit_json(changed=False, mode=mode, cached=True, msg="CLI command executed and results saved in file ")
 
-    output = output + cnos.enterEnableModeForDevice(enablePassword, 3, remote_conn)
+    # Attach to a persistent shell for this switch, only logging in when
+    # no live session is available
+    remote_conn = enos.get_shell(module)
 
-    #Make terminal length = 0
-    output = output + cnos.waitForDeviceResponse("terminal-length 0\n","#", 2, remote_conn)
+    # Stream everything the switch sends to the output file as it arrives
+    outfile = enos.open_output(outputfile)
+    remote_conn.sink = outfile
 
+    try:
+        # Enable and terminal length = 0, written at once
+        enos.bootstrap(remote_conn, enablePassword, timeout)
 
-    #Go to config mode
-    output = output + cnos.waitForDeviceResponse("configure t\n","#", 2, remote_conn)
 
-    #Send the CLi command
-    output = output + cnos.waitForDeviceResponse(cliCommand +"\n","#", 2, remote_conn)
+        #Go to config mode, show commands run from the enable prompt
+        if mode == 'config':
+            enos.bump_config_generation(hostIP)
+            enos.send_command(remote_conn, "configure t", timeout)
 
-    # End config mode
-    output = output + cnos.waitForDeviceResponse("end\n","#", 2, remote_conn)
+        #Send the CLi command, only the head of its output is kept in memory
+        #for the error check, the whole of it goes to the output file.
+        #Show commands with a parser are parsed line by line as they stream
+        #A copy of the output is kept for the command cache, when enabled
+        parser = enos_parsers.get_parser(cliCommand)
+        copy = cache.buffer() if mode == 'exec' else None
+        if parser is not None:
+            sink = enos.stream_command(remote_conn, cliCommand, enos.OutputParser(parser, copy, outfile), timeout)
+            sink.close()
+            parsed = enos_parsers.rows_to_dicts(parser, sink.rows)
+        elif copy is not None:
+            enos.stream_command(remote_conn, cliCommand, enos.OutputSink(copy, outfile), timeout)
+        else:
+            enos.send_command(remote_conn, cliCommand, timeout, limit=enos.OUTPUT_HEAD_SIZE)
 
+        # End config mode
+        if mode == 'config':
+            enos.send_command(remote_conn, "end", timeout)
+    except enos.EnosError as e:
+        outfile.close()
+        remote_conn.close()
+        module.fail_json(msg=str(e))
 
-    #Save it into the file
-    file = open(outputfile, "a")
-    file.write(output)
-    file.close()
+    outfile.close()
+    remote_conn.close()
+    if copy is not None:
+        cache.put([cliCommand], [copy.value()])
 
-    # Logic to check when changes occur or not
-    errorMsg = cnos.checkOutputForError(output)
-    if(errorMsg == None):
-        module.exit_json(changed=True, msg="CLI command executed and results saved in file ")
-    else:
-        module.fail_json(msg=errorMsg)
+    # CLI rejections were caught as the reply to each command came in
+    if parsed is not None:
+        module.exit_json(changed=(mode == 'config'), mode=mode, cached=False, parsed=parsed,
+                         msg="CLI command executed and results saved in file ")
+    module.exit_json(changed=(mode == 'config'), mode=mode, cached=False,
+                     msg="CLI command executed and results saved in file ")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Lenovo, Inc.
+
+# This module is distributed WITHOUT ANY WARRANTY; without even the implied
+# warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+#
+# See the GNU General Public License for more details <http://www.gnu.org/licenses/>.
+#
+# Module to send the same CLI commands to many Lenovo Switches at once
+# Lenovo Networking
+#
+#---- Documentation Start ----------------------------------------------------#
+DOCUMENTATION = '''
+---
+version_added: "1.7"
+module: enos_fleet_command
+short_description: Run ENOS Commands on many Devices in parallel from one task.
+description:
+    - Runs a list of CLI commands against a list of switches from a single process. The switches are worked
+    on by a pool of threads, so a change can be pushed to hundreds of switches without one Ansible fork and
+    one login handshake per switch and task. Run it once, for example on localhost or with run_once.
+    The commands are sent from the enable prompt, include "configure t" and "end" for configuration changes.
+options:
+# Options are as given below
+    hosts:
+        description:
+            - List of switch addresses to run the commands on.
+        required: true
+        default: null
+        choices: []
+    commands:
+        description:
+            - List of CLI commands to run on every switch, in order.
+        required: true
+        default: null
+        choices: []
+    concurrency:
+        description:
+            - Maximum number of switches worked on at the same time.
+        required: false
+        default: 20
+        choices: []
+    hostTimeout:
+        description:
+            - Number of seconds a switch has for the login and all of its commands; one that has not finished
+            by then is reported as failed. Every step on that switch only waits for what is left of it.
+        required: false
+        default: 60
+        choices: []
+    commandTimeout:
+        description:
+            - Number of seconds to wait for the reply to each command, cut down to what is left of hostTimeout.
+            Defaults to hostTimeout.
+        required: false
+        default: null
+        choices: []
+    port:
+        description:
+            - SSH port of the switches.
+        required: false
+        default: 22
+        choices: []
+    metricsSink:
+        description:
+            - Where to also send the timings of each switch, "udp://host:port" for a statsd server or the path of
+            a JSON-lines file to append to. Can also be set with the ANSIBLE_ENOS_METRICS_SINK environment variable.
+        required: false
+        default: null
+        choices: []
+    commandCacheTtl:
+        description:
+            - Number of seconds the output of read-only commands is kept on the controller. A switch whose
+            commands are all cached is answered without logging in to it. Configuration changes and saves
+            made with the enos_* modules invalidate it. 0 disables the cache.
+            Can also be set with the ANSIBLE_ENOS_COMMAND_CACHE_TTL environment variable.
+        required: false
+        default: 0
+        choices: []
+    username:
+        description:
+            - Configures the username to use to authenticate the connection to the switches.
+        required: true
+        default:
+        choices: []
+    password:
+        description:
+            - Configures the password to use to authenticate the connection to the switches.
+        required: true
+        default:
+        choices: []
+    enablePassword:
+        description:
+            - Inputs the enable password, in case its enables in the devices. This get ignored if a device is not demanding an enable password.
+        required: false
+        default:
+        choices: []
+notes:
+    - Sessions opened by this module are not kept by the persistent session broker, every run logs in to each
+    switch once and runs all commands over that session. persistTimeout is ignored.
+    - The task reports changed only when the commands include configuration commands, show and the other
+    read-only commands leave it unchanged.
+'''
+EXAMPLES = '''
+- name: Add VLAN 11 on every switch of the rack
+  enos_fleet_command:
+    hosts: "{{ groups['enos'] }}"
+    username: admin
+    password: admin
+    concurrency: 50
+    commands:
+      - configure t
+      - vlan 11
+      - name "servers"
+      - end
+  run_once: true
+  delegate_to: localhost
+'''
+
+RETURN = '''
+results:
+    description: Per switch outcome, keyed by address.
+    returned: always
+    type: dict
+    sample: {"10.240.178.74": {"failed": false, "elapsed": 1.2, "stdout": ["", "", "", ""], "timings": {"tcp_connect": 0.01, "ssh_auth": 0.8, "total": 1.2}},
+             "10.240.178.75": {"failed": true, "elapsed": 60.0, "msg": "timed out after 60 seconds"}}
+failed_hosts:
+    description: Addresses of the switches the commands could not be run on.
+    returned: always
+    type: list
+'''
+#---- Documentation Ends ----------------------------------------------------#
+#---- Logic Start ------------------------------------------------------------#
+
+import threading
+import time
+try:
+    from ansible.module_utils import enos
+    HAS_LIB = True
+except ImportError as e:
+    HAS_LIB = False
+    LIB_IMPORT_ERROR = str(e)
+
+#
+# load Ansible module
+#
+from ansible.module_utils import basic
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.six.moves import queue
+
+
+def run_host(module, host, commands, results, started):
+    started[host] = time.time()
+    timings = enos.Timings()
+    try:
+        stdout = enos.run_commands(module, commands, check_rc=False, host=host, timings=timings,
+                                   total_timeout=module.params['hostTimeout'])
+        result = dict(failed=False, stdout=stdout)
+    except Exception as e:
+        # Anything escaping here would be lost with the thread
+        result = dict(failed=True, msg=str(e))
+    result['elapsed'] = round(time.time() - started[host], 3)
+    result['timings'] = timings.result()
+    if module.params['metricsSink']:
+        enos.emit_timings(module.params['metricsSink'], 'enos_fleet_command', host,
+                          result['timings'], result['failed'])
+    results.setdefault(host, result)
+
+
+def worker(module, pending, commands, results, started):
+    while True:
+        try:
+            host = pending.get_nowait()
+        except queue.Empty:
+            return
+        run_host(module, host, commands, results, started)
+
+
+#
+def  main():
+    if not HAS_LIB:
+        # The option specs come from enos: take whatever was passed, kept
+        # out of the logs, to report why it did not load
+        params = basic._load_params()
+        AnsibleModule(argument_spec=dict((name, dict(no_log=True)) for name in params)).fail_json(
+            msg="enos module_utils could not be imported: %s" % LIB_IMPORT_ERROR)
+    #
+    # Define parameters for fleet command entry
+    #
+    argument_spec = dict(
+        hosts=dict(required=True, type='list'),
+        commands=dict(required=True, type='list'),
+        concurrency=dict(required=False, type='int', default=20),
+        hostTimeout=dict(required=False, type='int', default=60),
+        username=dict(required=True),
+        password=dict(required=True, no_log=True),
+        enablePassword=dict(required=False, no_log=True),)
+    argument_spec.update(enos.enos_session_spec)
+    argument_spec.update(enos.enos_command_cache_spec)
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
+
+    hosts = module.params['hosts']
+    commands = module.params['commands']
+    hostTimeout = module.params['hostTimeout']
+
+    # The sessions live in this process only: forking session brokers from
+    # a threaded process is not safe
+    module.params['persistTimeout'] = 0
+    if module.params['commandTimeout'] is None:
+        module.params['commandTimeout'] = hostTimeout
+
+    pending = queue.Queue()
+    for host in hosts:
+        pending.put(host)
+    results = {}
+    started = {}
+
+    threads = []
+    for i in range(max(1, min(module.params['concurrency'], len(hosts)))):
+        thread = threading.Thread(target=worker, args=(module, pending, commands, results, started))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    # Wait for every switch, giving up on the ones running past hostTimeout.
+    # A switch given up on keeps its worker busy only until its session
+    # reaches the same deadline and times out.
+    while len(results) < len(hosts):
+        now = time.time()
+        for host, start in list(started.items()):
+            if host not in results and now - start > hostTimeout:
+                results.setdefault(host, dict(failed=True, elapsed=round(now - start, 3),
+                                              msg='timed out after %s seconds' % hostTimeout))
+        if not any(thread.is_alive() for thread in threads):
+            break
+        time.sleep(0.05)
+
+    failed = [host for host in hosts if results[host]['failed']]
+    if failed:
+        module.fail_json(msg='%d of %d switches failed' % (len(failed), len(hosts)),
+                         results=results, failed_hosts=failed)
+    # Only configuration commands change the switches
+    changed = any(enos.command_mode(command) == 'config' for command in commands)
+    module.exit_json(changed=changed, results=results, failed_hosts=failed,
+                     msg="CLI commands executed on %d switches" % len(hosts))
+
+
+if __name__ == '__main__':
+        main()
@@ -38,7 +38,8 @@ options:
         description:
             - This specifies the file path to which the output of each command excecution is persisted. 
              Response from the device saved here. Usually the location is the results folder. 
-             But your user can choose which ever path he has write permission. 
+             But your user can choose which ever path he has write permission.
+             Output is written as it arrives. If the path ends in .gz it is gzip-compressed. 
         required: true
         default: null
         choices: []
@@ -74,6 +75,44 @@ options:
         required: false
         default: 
         choices: []
+    port:
+        description:
+            - SSH port of the switch.
+        required: false
+        default: 22
+        choices: []
+    persistTimeout:
+        description:
+            - Number of seconds an idle SSH session to the switch is kept open so later tasks can reuse it
+            instead of logging in again. Set to 0 to open and close a new session for every task.
+            Can also be set with the ANSIBLE_ENOS_PERSIST_TIMEOUT environment variable.
+        required: false
+        default: 30
+        choices: []
+    commandTimeout:
+        description:
+            - Maximum number of seconds to wait for the switch prompt after each command. Commands return as soon
+            as the prompt shows, this is only the deadline after which the task fails. When not set, each command
+            gets a deadline learnt from the earlier reply times of the switch for that kind of command, 120
+            seconds until enough of them are known.
+        required: false
+        default: null
+        choices: []
+    metricsSink:
+        description:
+            - Where to also send the timings of the task, "udp://host:port" for a statsd server or the path of a
+            JSON-lines file to append to. Can also be set with the ANSIBLE_ENOS_METRICS_SINK environment variable.
+        required: false
+        default: null
+        choices: []
+    configCacheTtl:
+        description:
+            - Number of seconds the switch running-config, used to skip configuration that is already present,
+            is cached on the controller between tasks. 0 fetches it once per task.
+            Can also be set with the ANSIBLE_ENOS_CONFIG_CACHE_TTL environment variable.
+        required: false
+        default: 0
+        choices: []
     deviceType:
         description:
             - This specifies the type of device against which the image is downloaded. 
@@ -82,7 +121,9 @@ options:
         choices: []
     interfaceRange:
         description:
-            - This specifies the interface range in which the port aggregation is envisaged
+            - This specifies the interface range in which the port aggregation is envisaged. Ports are given as
+            port numbers or slot/port, e.g. "1/1-1/48,1/50". Only the interfaces that need the change are
+            configured, contiguous ports and port channels needing the same lines in one range.
         required: Yes
         default: null
         choices: []
@@ -91,7 +132,7 @@ options:
             - This specifies the attribute you specify subsequent to interface command
         required: Yes
         default: null
-        choices: [None, ethernet, loopback, mgmt, port-aggregation, vlan]
+        choices: [None, port, portchannel, ethernet, loopback, mgmt, port-aggregation, vlan]
     interfaceArg1:
         description:
             - This is an overloaded portCh first argument. Usage of these overloaded variables are described in the table below.
@@ -217,8 +258,7 @@ Please find below the table with option how the overloaded variables are used in
     - For help in developing on modules, should you be so inclined, please read 
     Community Information & Contributing, Helping Testing PRs and Developing Modules.
     Module Dependency :
-    1. cnos_interface.py
-    2. cnos_utility.py 
+    1. enos.py (module_utils)
 '''
 EXAMPLES = '''
 The task/main.yml will look like this
@@ -344,62 +384,93 @@ On successful execution, the method returns and empty string with a message "Int
 accomplished" in json format. But upon any failure, the output will be the error display string. 
 You may have to rectify the error and try again.
 
+commands:
+    description: Configuration commands pushed, empty when the requested state was already in place. Forms that are
+      not compared against the running-config are always pushed.
+    returned: success
+    type: list
+    sample: ["interface port 1/1-1/48", "mtu 9000", "exit"]
+timings:
+    description: Seconds spent in each phase of the task (tcp_connect, ssh_auth, invoke_shell and
+      broker_spawn, or attach; enable, terminal_length, get_config, error_scan, file_write), the reply time of
+      each command and the total.
+    returned: always
+    type: dict
+    sample: {"tcp_connect": 0.01, "ssh_auth": 0.4, "invoke_shell": 0.05, "enable": 0.01, "terminal_length": 0.01,
+             "error_scan": 0.001, "commands": [{"command": "show version", "seconds": 0.01}], "total": 0.6}
 '''
 #---- Documentation Ends ----------------------------------------------------#
 #---- Logic Start ------------------------------------------------------------###
 #
 
-import sys
-import paramiko
-import time
-import argparse
-import socket
-import array
-import json
-import time
-import re
 try:
-    import cnos
-    HAS_LIB=True
-except:
-    HAS_LIB=False
-#try:
-#    import cnos_utility
-#    HAS_LIB=True
-#except:
-#    HAS_LIB=False
+    from ansible.module_utils import enos
+    HAS_LIB = True
+except ImportError as e:
+    HAS_LIB = False
+    LIB_IMPORT_ERROR = str(e)
+
 #
 # load Ansible module
 #
-from ansible.module_utils.basic import *
-from collections import defaultdict
+from ansible.module_utils import basic
+from ansible.module_utils.basic import AnsibleModule
+
+
+def interface_settings(interfaceOption, interfaceRange, interfaceArgs):
+    #
+    # Desired state (see enos.plan_interfaces) of every interface of the
+    # range, None when the range cannot be expanded. The last argument is
+    # the value of the setting named by the ones before it ("mtu" "9000"),
+    # a lone argument is a flag ("shutdown") and a leading "no" removes it.
+    #
+    if not interfaceOption or not interfaceRange:
+        return None
+    try:
+        names = enos.expand_interfaces(str(interfaceRange))
+    except ValueError:
+        return None
+    args = [str(arg) for arg in interfaceArgs if arg is not None]
+    if args[0] == "no" and len(args) > 1:
+        settings = {" ".join(args[1:]): None}
+    elif len(args) == 1:
+        settings = {args[0]: True}
+    else:
+        settings = {" ".join(args[:-1]): args[-1]}
+    option = enos.INTERFACE_TYPES.get(interfaceOption, interfaceOption)
+    return [(option, name, settings) for name in names]
 
 #
 def  main():
+    if not HAS_LIB:
+        # The option specs come from enos: take whatever was passed, kept
+        # out of the logs, to report why it did not load
+        params = basic._load_params()
+        AnsibleModule(argument_spec=dict((name, dict(no_log=True)) for name in params)).fail_json(
+            msg="enos module_utils could not be imported: %s" % LIB_IMPORT_ERROR)
     #
     # Define parameters for portChannel creation entry
     #
-    module = AnsibleModule(
-        argument_spec=dict(
-            outputfile=dict(required=True),
-            host=dict(required=True),
-            username=dict(required=True),
-            password=dict(required=True, no_log=True),
-            enablePassword=dict(required=False, no_log=True),
-            deviceType=dict(required=False),
-            interfaceRange=dict(required=False),
-            interfaceOption=dict(required=False),
-            interfaceArg1=dict(required=True),
-            interfaceArg2=dict(required=False),
-            interfaceArg3=dict(required=False),
-            interfaceArg4=dict(required=False),
-            interfaceArg5=dict(required=False),
-            interfaceArg6=dict(required=False),
-            interfaceArg7=dict(required=False),),
-        supports_check_mode=False)
-
-    username = module.params['username']
-    password = module.params['password']
+    argument_spec = dict(
+        outputfile=dict(required=True),
+        host=dict(required=True),
+        username=dict(required=True),
+        password=dict(required=True, no_log=True),
+        enablePassword=dict(required=False, no_log=True),
+        deviceType=dict(required=False),
+        interfaceRange=dict(required=False),
+        interfaceOption=dict(required=False),
+        interfaceArg1=dict(required=True),
+        interfaceArg2=dict(required=False),
+        interfaceArg3=dict(required=False),
+        interfaceArg4=dict(required=False),
+        interfaceArg5=dict(required=False),
+        interfaceArg6=dict(required=False),
+        interfaceArg7=dict(required=False))
+    argument_spec.update(enos.enos_session_spec)
+    argument_spec.update(enos.enos_config_spec)
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
+
     enablePassword = module.params['enablePassword']
     interfaceRange = module.params['interfaceRange']
     interfaceOption = module.params['interfaceOption']
@@ -411,69 +482,47 @@ def  main():
     interfaceArg6 = module.params['interfaceArg6']
     interfaceArg7 = module.params['interfaceArg7']
     outputfile =  module.params['outputfile']
-    hostIP = module.params['host']
-    # deviceType = module.params['deviceType']
-    deviceType = "g8272_cnos" 
-
-    output = ""
-
-    # Create instance of SSHClient object
-    remote_conn_pre = paramiko.SSHClient()
-
-    # Automatically add untrusted hosts (make sure okay for security policy in your environment)
-    remote_conn_pre.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    # initiate SSH connection with the switch
-    remote_conn_pre.connect(hostIP, username=username, password=password, look_for_keys=False)
-    time.sleep(2)
-    
-    # Use invoke_shell to establish an 'interactive session'
-    remote_conn = remote_conn_pre.invoke_shell()
-    time.sleep(2)
-    
-    # Enable and enter configure terminal then send command
-    output = output + cnos.waitForDeviceResponse("\n",">", 2, remote_conn)
-    
-    output = output + cnos.enterEnableModeForDevice(enablePassword, 3, remote_conn)
-        
-    #Make terminal length = 0
-    output = output + cnos.waitForDeviceResponse("terminal-length 0\n","#", 2, remote_conn)
-        
-    #Go to config mode
-    output = output + cnos.waitForDeviceResponse("configure t\n","(config)#", 2, remote_conn)
-    
-    #Send the CLi command
-    if(interfaceOption == None or interfaceOption == ""):
-        output = output + cnos_utility.interfaceConfig(remote_conn, deviceType, "(config)#", 2, None, interfaceRange, 
-                                                     interfaceArg1, interfaceArg2, interfaceArg3, interfaceArg4, interfaceArg5,interfaceArg6, interfaceArg7)
-    elif(interfaceOption == "port"):
-        output = output + cnos_utility.interfaceConfig(remote_conn, deviceType, "(config)#", 2, "port", interfaceRange, 
-                                                     interfaceArg1, interfaceArg2, interfaceArg3, interfaceArg4, interfaceArg5,interfaceArg6, interfaceArg7)
-    elif(interfaceOption == "loopback"):
-        output = output + cnos_utility.interfaceConfig(remote_conn, deviceType, "(config)#", 2, "loopback", interfaceRange, 
-                                                     interfaceArg1, interfaceArg2, interfaceArg3, interfaceArg4, interfaceArg5,interfaceArg6, interfaceArg7)
-    elif(interfaceOption == "mgmt"):
-        output = output + cnos_utility.interfaceConfig(remote_conn, deviceType, "(config)#", 2, "mgmt", interfaceRange, 
-                                                     interfaceArg1, interfaceArg2, interfaceArg3, interfaceArg4, interfaceArg5,interfaceArg6, interfaceArg7)
-    elif(interfaceOption == "port-aggregation"):
-        output = output + cnos_utility.interfaceConfig(remote_conn, deviceType, "(config)#", 2, "port-aggregation", interfaceRange, 
-                                                     interfaceArg1, interfaceArg2, interfaceArg3, interfaceArg4, interfaceArg5,interfaceArg6, interfaceArg7)
-    elif(interfaceOption == "vlan"):
-        output = output + cnos_utility.interfaceConfig(remote_conn, deviceType, "(config)#", 2, "vlan", interfaceRange, 
-                                                     interfaceArg1, interfaceArg2, interfaceArg3, interfaceArg4, interfaceArg5,interfaceArg6, interfaceArg7)
-    else:
-        output = "Invalid interface option \n"
-    #Save it into the file
-    file = open(outputfile, "a")
-    file.write(output)
-    file.close()
-    
-    # Logic to check when changes occur or not
-    errorMsg = cnos_utility.checkOutputForError(output)
-    if(errorMsg == None):
-        module.exit_json(changed=True, msg="Interface Configuration is done")
-    else:
-        module.fail_json(msg=errorMsg)
+    timeout = module.params['commandTimeout']
+
+    # Attach to a persistent shell for this switch, only logging in when
+    # no live session is available
+    remote_conn = enos.get_shell(module)
+
+    # Stream everything the switch sends to the output file as it arrives
+    outfile = enos.open_output(outputfile)
+    remote_conn.sink = outfile
+
+    try:
+        # Enable and terminal length = 0, written at once
+        enos.bootstrap(remote_conn, enablePassword, timeout)
+
+        # Push only what the running-config is missing, in one batch
+        wanted = interface_settings(interfaceOption, interfaceRange, [interfaceArg1, interfaceArg2, interfaceArg3,
+                                                                      interfaceArg4, interfaceArg5, interfaceArg6, interfaceArg7])
+        if wanted is not None:
+            commands = enos.plan_interfaces(wanted, enos.get_config(module, remote_conn))
+            if commands:
+                enos.push_config(module, remote_conn, commands, timeout)
+            outfile.close()
+            remote_conn.close()
+            if commands:
+                module.exit_json(changed=True, commands=commands, msg="Interface Configuration is done")
+            module.exit_json(changed=False, commands=commands, msg="Interface Configuration is already present")
+
+        # Other forms are sent as they are, in config mode
+        commands = enos.interface_commands(interfaceOption, interfaceRange, interfaceArg1, interfaceArg2, interfaceArg3,
+                                           interfaceArg4, interfaceArg5, interfaceArg6, interfaceArg7)
+        enos.push_config(module, remote_conn, commands, timeout)
+    except enos.EnosError as e:
+        outfile.close()
+        remote_conn.close()
+        module.fail_json(msg=str(e))
+
+    outfile.close()
+    remote_conn.close()
+
+    # CLI rejections stopped the batch as soon as they came in
+    module.exit_json(changed=True, commands=commands, msg="Interface Configuration is done")
     
 
 if __name__ == '__main__':
@@ -16,19 +16,36 @@ DOCUMENTATION = '''
 ---
 version_added: "1.7"
 module: enos_multi_command
-short_description: Run two ENOS Commands on Devices.
+short_description: Run a list of ENOS Commands on Devices.
 description:
     - Manages network device configurations over SSH. This module allows implementors to work with the device
-    running-config. It provides a way to push two ENOS command onto a network device by evaluating the current
-    running-config and only pushing configuration commands that are not already configured. The command is
-    passed as an argument to the method
+    running-config. It provides a way to push a list of ENOS commands onto a network device in configuration
+    mode. The commands are written to the switch in one go and the replies are split back per command, so
+    a long block costs about one round trip instead of one per line.
 options:
 # Options are as given below
+    commands:
+        description:
+            - List of CLI commands to run in configuration mode, in order. Any number of lines can be given.
+            When every command is read-only (show, display, dir, ping, traceroute) they run from the enable prompt
+            instead. Mutually exclusive with clicommand and clicommand2.
+        required: false
+        default: null
+        choices: []
+    channels:
+        description:
+            - Number of CLI channels, opened on the one SSH session, over which read-only commands run at the same
+            time. With more than 1, a list of show commands takes about as long as the slowest of them. Ignored
+            when any command is a configuration command, those always run in order on one channel.
+        required: false
+        default: 1
+        choices: []
     clicommand:
         description:
             - Specify the CLI command as an attribute to this method. Pass on the command in double quotes.
             The variables can also be placed directly on to CLIs or can come from the vars folder.
-        required: true
+            Either clicommand or commands is required.
+        required: false
         default: null
         choices: []
     clicommand2:
@@ -44,6 +61,7 @@ options:
             - This specifies the file path to which the output of each command excection is persisted.
              Response from the device saved here. Usually the location is the results folder.
              But your user can choose which ever path he has write permission.
+             Output is written as it arrives. If the path ends in .gz it is gzip-compressed.
         required: true
         default: null
         choices: []
@@ -80,6 +98,45 @@ options:
         required: false
         default:
         choices: []
+    port:
+        description:
+            - SSH port of the switch.
+        required: false
+        default: 22
+        choices: []
+    persistTimeout:
+        description:
+            - Number of seconds an idle SSH session to the switch is kept open so later tasks can reuse it
+            instead of logging in again. Set to 0 to open and close a new session for every task.
+            Can also be set with the ANSIBLE_ENOS_PERSIST_TIMEOUT environment variable.
+        required: false
+        default: 30
+        choices: []
+    commandTimeout:
+        description:
+            - Maximum number of seconds to wait for the switch prompt after each command. Commands return as soon
+            as the prompt shows, this is only the deadline after which the task fails. When not set, each command
+            gets a deadline learnt from the earlier reply times of the switch for that kind of command, 120
+            seconds until enough of them are known.
+        required: false
+        default: null
+        choices: []
+    metricsSink:
+        description:
+            - Where to also send the timings of the task, "udp://host:port" for a statsd server or the path of a
+            JSON-lines file to append to. Can also be set with the ANSIBLE_ENOS_METRICS_SINK environment variable.
+        required: false
+        default: null
+        choices: []
+    commandCacheTtl:
+        description:
+            - Number of seconds the output of read-only commands is kept on the controller. When every command
+            of the list is cached the outputs are returned without logging in to the switch. Configuration
+            changes and saves made with the enos_* modules invalidate it. 0 disables the cache.
+            Can also be set with the ANSIBLE_ENOS_COMMAND_CACHE_TTL environment variable.
+        required: false
+        default: 0
+        choices: []
     deviceType:
         description:
             - This specifies the type of device against which the image is downloaded. The value has to come from inventory file ideally,
@@ -91,8 +148,7 @@ notes:
     - For help in developing on modules, should you be so inclined, please read
     Community Information & Contributing, Helping Testing PRs and Developing Modules.
     Module Dependency :
-    1. enos_multi_command.py
-    2. cnos_utility.py
+    1. enos.py (module_utils)
 '''
 EXAMPLES = '''
 Inside tasks/main.yml
@@ -111,119 +167,187 @@ test_runcommand_data1:
 In the inventory file u specify as
 [cnos_command_sample]
 10.240.178.74  username=<username> password=<password>
+
+Pushing a block of configuration in one task
+---
+- name: Create VLANs 11 and 12
+  enos_multi_command:
+    host: "{{ inventory_hostname }}"
+    username: admin
+    password: admin
+    outputfile: "./results/{{ inventory_hostname }}.vlans.txt"
+    commands:
+      - vlan 11
+      - name "servers"
+      - exit
+      - vlan 12
+      - name "storage"
+      - exit
+
+Gathering facts over parallel channels
+---
+- name: Inventory
+  enos_multi_command:
+    host: "{{ inventory_hostname }}"
+    username: admin
+    password: admin
+    outputfile: "./results/{{ inventory_hostname }}.facts.txt"
+    channels: 4
+    commands:
+      - show version
+      - show vlan
+      - show interface status
+      - show lldp remote-device
 '''
 
 RETURN = '''
 On successful execution, the method returns and empty string with a message "Command Applied" in json format.
 But upon any failure, the output will be the error display string.
+results:
+    description: One entry per command with the command sent and the switch output for it. Show commands
+      enos_parsers knows also get their output as a list of rows in parsed.
+    returned: success
+    type: list
+    sample: [{"command": "vlan 11", "output": ""}]
+cached:
+    description: Whether the outputs came from the command cache (see commandCacheTtl) rather than the switch.
+    returned: success
+    type: bool
+    sample: false
+timings:
+    description: Seconds spent in each phase of the task (tcp_connect, ssh_auth, invoke_shell and
+      broker_spawn, or attach; enable, terminal_length, get_config, error_scan, file_write), the reply time of
+      each command and the total.
+    returned: always
+    type: dict
+    sample: {"tcp_connect": 0.01, "ssh_auth": 0.4, "invoke_shell": 0.05, "enable": 0.01, "terminal_length": 0.01,
+             "error_scan": 0.001, "commands": [{"command": "show version", "seconds": 0.01}], "total": 0.6}
 '''
 #---- Documentation Ends ----------------------------------------------------#
 #---- Logic Start ------------------------------------------------------------#
 
-import sys
-import paramiko
-import time
-import argparse
-import socket
-import array
-import json
-import time
-import re
 try:
-    from ansible.module_utils import cnos
+    from ansible.module_utils import enos
+    from ansible.module_utils import enos_parsers
     HAS_LIB = True
-except:
+except ImportError as e:
     HAS_LIB = False
-
-#try:
-#    import cnos_utility
-#    HAS_LIB=True
-#except:
-#    HAS_LIB=False
+    LIB_IMPORT_ERROR = str(e)
 
 #
 # load Ansible module
 #
-from ansible.module_utils.basic import *
-from collections import defaultdict
+from ansible.module_utils import basic
+from ansible.module_utils.basic import AnsibleModule
+
+
+def command_results(commands, responses):
+    results = [dict(command=command, output=enos.command_output(response))
+               for command, response in zip(commands, responses)]
+    for result in results:
+        parsed = enos_parsers.parse_output(result['command'], result['output'])
+        if parsed is not None:
+            result['parsed'] = parsed
+    return results
+
 
 #
 def  main():
+    if not HAS_LIB:
+        # The option specs come from enos: take whatever was passed, kept
+        # out of the logs, to report why it did not load
+        params = basic._load_params()
+        AnsibleModule(argument_spec=dict((name, dict(no_log=True)) for name in params)).fail_json(
+            msg="enos module_utils could not be imported: %s" % LIB_IMPORT_ERROR)
     #
     # Define parameters for commandline entry
     #
-    module = AnsibleModule(
-        argument_spec=dict(
-            clicommand=dict(required=True),
-            clicommand2=dict(required=False),
-            outputfile=dict(required=True),
-            host=dict(required=True),
-            # deviceType=dict(required=True),
-            deviceType=dict(required=False),
-            username=dict(required=True),
-            password=dict(required=True, no_log=True),
-            enablePassword=dict(required=False, no_log=True),),
-        supports_check_mode=False)
-
-    username = module.params['username']
-    password = module.params['password']
+    argument_spec = dict(
+        commands=dict(required=False, type='list'),
+        channels=dict(required=False, type='int', default=1),
+        clicommand=dict(required=False),
+        clicommand2=dict(required=False),
+        outputfile=dict(required=True),
+        host=dict(required=True),
+        # deviceType=dict(required=True),
+        deviceType=dict(required=False),
+        username=dict(required=True),
+        password=dict(required=True, no_log=True),
+        enablePassword=dict(required=False, no_log=True))
+    argument_spec.update(enos.enos_session_spec)
+    argument_spec.update(enos.enos_command_cache_spec)
+    module = AnsibleModule(argument_spec=argument_spec,
+                           required_one_of=[['commands', 'clicommand']],
+                           mutually_exclusive=[['commands', 'clicommand'], ['commands', 'clicommand2']],
+                           supports_check_mode=False)
+
     enablePassword = module.params['enablePassword']
-    cliCommand= module.params['clicommand']
-    cliCommand2= module.params['clicommand2']
-    # deviceType = module.params['deviceType']
-    deviceType = "g8272_cnos"
+    commands = module.params['commands']
+    if commands is None:
+        commands = [c for c in (module.params['clicommand'], module.params['clicommand2']) if c]
+    readonly = all(enos.command_mode(command) == 'exec' for command in commands)
     outputfile =  module.params['outputfile']
     hostIP = module.params['host']
-    output = ""
-
-    # Create instance of SSHClient object
-    remote_conn_pre = paramiko.SSHClient()
-
-    # Automatically add untrusted hosts (make sure okay for security policy in your environment)
-    remote_conn_pre.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    # initiate SSH connection with the switch
-    remote_conn_pre.connect(hostIP, username=username, password=password, look_for_keys=False)
-    time.sleep(2)
-
-    # Use invoke_shell to establish an 'interactive session'
-    remote_conn = remote_conn_pre.invoke_shell()
-    time.sleep(2)
-
-    # Enable and enter configure terminal then send command
-    output = output + cnos.waitForDeviceResponse("\n",">", 2, remote_conn)
-
-    output = output + cnos.enterEnableModeForDevice(enablePassword, 3, remote_conn)
-
-    #Make terminal length = 0
-    output = output + cnos.waitForDeviceResponse("terminal-length 0\n","#", 2, remote_conn)
+    timeout = module.params['commandTimeout']
 
-    #Disable console prompts
-    output = output + cnos.waitForDeviceResponse("terminal dont-ask\n","#", 2, remote_conn)
+    # Show commands all run by earlier tasks need no login
+    cache = enos.CommandCache(module.params)
+    timings = enos.Timings()
+    outputs = cache.get(commands, timings)
+    if outputs is not None:
+        enos.report_timings(module, timings)
+        responses = ['%s\n%s\n' % (command, text) for command, text in zip(commands, outputs)]
+        outfile = enos.open_output(outputfile)
+        outfile.write(enos.to_bytes("".join(responses)))
+        outfile.close()
+        module.exit_json(changed=False, cached=True, results=command_results(commands, responses),
+                         msg="CLI command executed and results saved in file ")
 
-    #Go to config mode
-    output = output + cnos.waitForDeviceResponse("configure t\n","(config)#", 2, remote_conn)
+    # Attach to a persistent shell for this switch, only logging in when
+    # no live session is available
+    remote_conn = enos.get_shell(module)
 
-    #Send the CLi command
-    output = output + cnos.waitForDeviceResponse(cliCommand +"\n","#", 2, remote_conn)
+    # Stream everything the switch sends to the output file as it arrives
+    outfile = enos.open_output(outputfile)
+    remote_conn.sink = outfile
 
-    #Send the second CLi command
-    output = output + cnos.waitForDeviceResponse(cliCommand2 +"\n","#", 2, remote_conn)
+    try:
+        # Enable, terminal length 0 and no console prompts, written at once
+        enos.bootstrap(remote_conn, enablePassword, timeout, dont_ask=True)
 
-    # End config mode
-    output = output + cnos.waitForDeviceResponse("end\n","#", 2, remote_conn)
+        if readonly:
+            # Show commands run from the enable prompt, over several
+            # channels at once when asked to
+            if module.params['channels'] > 1:
+                responses = enos.run_parallel(remote_conn, commands, timeout, enablePassword,
+                                              module.params['channels'])
+            else:
+                responses = enos.send_batch(remote_conn, commands, timeout)
+        else:
+            #Go to config mode, send the CLi commands and end config mode in a single write
+            enos.bump_config_generation(hostIP)
+            responses = enos.send_batch(remote_conn, ["configure t"] + commands + ["end"], timeout)[1:-1]
+    except enos.EnosCommandError as e:
+        # Report what ran before the rejected command
+        outfile.close()
+        remote_conn.close()
+        responses = e.responses if readonly else e.responses[1:]
+        results = [dict(command=command, output=enos.command_output(response))
+                   for command, response in zip(commands, responses)]
+        module.fail_json(msg=str(e), results=results)
+    except enos.EnosError as e:
+        outfile.close()
+        remote_conn.close()
+        module.fail_json(msg=str(e))
 
-    #Save it into the file
-    file = open(outputfile, "a")
-    file.write(output)
-    file.close()
+    outfile.close()
+    remote_conn.close()
 
-    # Logic to check when changes occur or not
-    errorMsg = cnos.checkOutputForError(output)
-    if(errorMsg == None):
-        module.exit_json(changed=True, msg="CLI command executed and results saved in file ")
-    else:
-        module.fail_json(msg=errorMsg)
+    # CLI rejections stopped the batch as soon as they came in
+    results = command_results(commands, responses)
+    cache.put(commands, [result['output'] for result in results])
+    module.exit_json(changed=not readonly, cached=False, results=results,
+                     msg="CLI command executed and results saved in file ")
 
 
 if __name__ == '__main__':
@@ -20,6 +20,8 @@ short_description: Copies running config to start up config.
 description:
     - This command let u to save running config to start up config.
     Use this module soon after any major configurations to sustain the recent changes after restart.
+    The running and startup configs are hashed first, over the same session, and the save (which rewrites
+    flash) is skipped with changed=False when they already match.
 options:
 # Options are as given below
 
@@ -28,6 +30,7 @@ options:
             - This specifies the file path to which the output of each command excection is persisted.
              Response from the device saved here. Usually the location is the results folder.
              But your user can choose which ever path he has write permission.
+             Output is written as it arrives. If the path ends in .gz it is gzip-compressed.
         required: true
         default: null
         choices: []
@@ -64,6 +67,42 @@ options:
         required: false
         default:
         choices: []
+    port:
+        description:
+            - SSH port of the switch.
+        required: false
+        default: 22
+        choices: []
+    persistTimeout:
+        description:
+            - Number of seconds an idle SSH session to the switch is kept open so later tasks can reuse it
+            instead of logging in again. Set to 0 to open and close a new session for every task.
+            Can also be set with the ANSIBLE_ENOS_PERSIST_TIMEOUT environment variable.
+        required: false
+        default: 30
+        choices: []
+    commandTimeout:
+        description:
+            - Maximum number of seconds to wait for the switch prompt after each command. Commands return as soon
+            as the prompt shows, this is only the deadline after which the task fails. When not set, each command
+            gets a deadline learnt from the earlier reply times of the switch for that kind of command, 120
+            seconds until enough of them are known.
+        required: false
+        default: null
+        choices: []
+    force:
+        description:
+            - Save even when the startup config already matches the running config.
+        required: false
+        default: false
+        choices: [true, false]
+    metricsSink:
+        description:
+            - Where to also send the timings of the task, "udp://host:port" for a statsd server or the path of a
+            JSON-lines file to append to. Can also be set with the ANSIBLE_ENOS_METRICS_SINK environment variable.
+        required: false
+        default: null
+        choices: []
     deviceType:
         description:
             - This specifies the type of device against which the image is downloaded.
@@ -76,8 +115,7 @@ Notes:
     - For help in developing on modules, should you be so inclined, please read
     Community Information & Contributing, Helping Testing PRs and Developing Modules.
     Module Dependency :
-    1. cnos_save.py
-    2. cnos_utility.py
+    1. enos.py (module_utils)
 '''
 
 EXAMPLES = '''
@@ -108,98 +146,108 @@ On successful execution, the method returns and empty string with a message
 "Switch Running Config is Saved to Startup Config" in json format. But upon any failure, the output will be
 the error display string. You may have to rectify the error and try again..
 
+running_sha256:
+    description: Hash of the running config, as compared with the startup config. Not returned with force.
+    returned: success
+    type: string
+startup_sha256:
+    description: Hash of the startup config before the save, null when the switch would not show it.
+    returned: success
+    type: string
+timings:
+    description: Seconds spent in each phase of the task (tcp_connect, ssh_auth, invoke_shell and
+      broker_spawn, or attach; enable, terminal_length, get_config, error_scan, file_write), the reply time of
+      each command and the total.
+    returned: always
+    type: dict
+    sample: {"tcp_connect": 0.01, "ssh_auth": 0.4, "invoke_shell": 0.05, "enable": 0.01, "terminal_length": 0.01,
+             "error_scan": 0.001, "commands": [{"command": "show version", "seconds": 0.01}], "total": 0.6}
 '''
 #---- Documentation Ends ----------------------------------------------------#
 #---- Logic Start ------------------------------------------------------------###
 
-import sys
-import paramiko
-import time
-import argparse
-import socket
-import array
-import json
-import time
-import re
 try:
-    from ansible.module_utils import cnos
+    from ansible.module_utils import enos
     HAS_LIB = True
-except:
+except ImportError as e:
     HAS_LIB = False
-#try:
-#    import cnos_utility
-#    HAS_LIB=True
-#except:
-#    HAS_LIB=False
+    LIB_IMPORT_ERROR = str(e)
+
 #
 # load Ansible module
 #
-from ansible.module_utils.basic import *
-from collections import defaultdict
+from ansible.module_utils import basic
+from ansible.module_utils.basic import AnsibleModule
 
 #
 def  main():
+    if not HAS_LIB:
+        # The option specs come from enos: take whatever was passed, kept
+        # out of the logs, to report why it did not load
+        params = basic._load_params()
+        AnsibleModule(argument_spec=dict((name, dict(no_log=True)) for name in params)).fail_json(
+            msg="enos module_utils could not be imported: %s" % LIB_IMPORT_ERROR)
     #
     # Define parameters for config save entry
     #
-    module = AnsibleModule(
-        argument_spec=dict(
-            outputfile=dict(required=True),
-            host=dict(required=True),
-            username=dict(required=True),
-            password=dict(required=True, no_log=True),
-            enablePassword=dict(required=False, no_log=True),
-            #deviceType=dict(required=True),),
-            deviceType=dict(required=False),),
-        supports_check_mode=False)
-
-    username = module.params['username']
-    password = module.params['password']
+    argument_spec = dict(
+        outputfile=dict(required=True),
+        host=dict(required=True),
+        username=dict(required=True),
+        password=dict(required=True, no_log=True),
+        enablePassword=dict(required=False, no_log=True),
+        force=dict(required=False, type='bool', default=False),
+        #deviceType=dict(required=True),
+        deviceType=dict(required=False))
+    argument_spec.update(enos.enos_session_spec)
+    module = AnsibleModule(argument_spec=argument_spec, supports_check_mode=False)
+
     enablePassword = module.params['enablePassword']
-    cliCommand= "write memory \n"
+    cliCommand= "write memory"
     outputfile =  module.params['outputfile']
     hostIP = module.params['host']
-    #deviceType = module.params['deviceType']
-    deviceType = "g8272_cnos"
-    output = ""
-
-    # Create instance of SSHClient object
-    remote_conn_pre = paramiko.SSHClient()
-
-    # Automatically add untrusted hosts (make sure okay for security policy in your environment)
-    remote_conn_pre.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    # initiate SSH connection with the switch
-    remote_conn_pre.connect(hostIP, username=username, password=password, look_for_keys=False)
-    time.sleep(2)
-
-    # Use invoke_shell to establish an 'interactive session'
-    remote_conn = remote_conn_pre.invoke_shell()
-    time.sleep(2)
-
-    # Enable and enter configure terminal then send command
-    output = output + cnos.waitForDeviceResponse("\n",">", 2, remote_conn)
-
-    output = output + cnos.enterEnableModeForDevice(enablePassword, 3, remote_conn)
-
-    #Make terminal length = 0
-    output = output + cnos.waitForDeviceResponse("terminal-length 0\n","#", 2, remote_conn)
-
-    
-    #cnos.debugOutput(cliCommand)
-    #Send the CLi command
-    output = output + cnos.waitForDeviceResponse(cliCommand,"#", 2, remote_conn)
-
-    #Save it into the file
-    file = open(outputfile, "a")
-    file.write(output)
-    file.close()
-
-    errorMsg = cnos.checkOutputForError(output)
-    if(errorMsg == None):
-        module.exit_json(changed=True, msg="Switch Running Config is Saved to Startup Config ")
-    else:
-        module.fail_json(msg=errorMsg)
+    timeout = module.params['commandTimeout']
+    hashes = {}
+
+    # Attach to a persistent shell for this switch, only logging in when
+    # no live session is available
+    remote_conn = enos.get_shell(module)
+
+    # Stream everything the switch sends to the output file as it arrives
+    outfile = enos.open_output(outputfile)
+    remote_conn.sink = outfile
+
+    try:
+        # Enable and terminal length = 0, written at once
+        enos.bootstrap(remote_conn, enablePassword, timeout)
+
+
+        # Nothing to save when both configs hash the same
+        if not module.params['force']:
+            hashes['running_sha256'] = enos.digest_command(remote_conn, "show running-config", timeout).hexdigest()
+            try:
+                hashes['startup_sha256'] = enos.digest_command(remote_conn, "show startup-config", timeout).hexdigest()
+            except enos.EnosCommandError:
+                # No startup config yet
+                hashes['startup_sha256'] = None
+            if hashes['running_sha256'] == hashes['startup_sha256']:
+                outfile.close()
+                remote_conn.close()
+                module.exit_json(changed=False, msg="Startup Config already matches Running Config ", **hashes)
+
+        #Send the CLi command, the cached output of show startup-config is stale from here
+        enos.bump_config_generation(hostIP)
+        enos.send_command(remote_conn, cliCommand, timeout)
+    except enos.EnosError as e:
+        outfile.close()
+        remote_conn.close()
+        module.fail_json(msg=str(e))
+
+    outfile.close()
+    remote_conn.close()
+
+    # CLI rejections were caught as the reply to each command came in
+    module.exit_json(changed=True, msg="Switch Running Config is Saved to Startup Config ", **hashes)
 
 
 if __name__ == '__main__':
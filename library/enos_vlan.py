@@ -9,7 +9,6 @@
 # See the GNU General Public License for more details <http://www.gnu.org/licenses/>.
 #
 # Module to send VLAN commands to Lenovo Switches
-# Overloading aspect of vlan creation in a range is pending 
 # Lenovo Networking
 #
 #---- Documentation Start ----------------------------------------------------#
@@ -31,7 +30,8 @@ description:
         description:
             - This specifies the file path to which the output of each command excecution is persisted. 
              Response from the device saved here. Usually the location is the results folder. 
-             But your user can choose which ever path he has write permission. 
+             But your user can choose which ever path he has write permission.
+             Output is written as it arrives. If the path ends in .gz it is gzip-compressed. 
         required: true
         default: null
         choices: []
@@ -68,11 +68,61 @@ description:
         required: false
         default: 
         choices: []
+    port:
+        description:
+            - SSH port of the switch.
+        required: false
+        default: 22
+        choices: []
+    persistTimeout:
+        description:
+            - Number of seconds an idle SSH session to the switch is kept open so later tasks can reuse it
+            instead of logging in again. Set to 0 to open and close a new session for every task.
+            Can also be set with the ANSIBLE_ENOS_PERSIST_TIMEOUT environment variable.
+        required: false
+        default: 30
+        choices: []
+    commandTimeout:
+        description:
+            - Maximum number of seconds to wait for the switch prompt after each command. Commands return as soon
+            as the prompt shows, this is only the deadline after which the task fails. When not set, each command
+            gets a deadline learnt from the earlier reply times of the switch for that kind of command, 120
+            seconds until enough of them are known.
+        required: false
+        default: null
+        choices: []
+    metricsSink:
+        description:
+            - Where to also send the timings of the task, "udp://host:port" for a statsd server or the path of a
+            JSON-lines file to append to. Can also be set with the ANSIBLE_ENOS_METRICS_SINK environment variable.
+        required: false
+        default: null
+        choices: []
+    configCacheTtl:
+        description:
+            - Number of seconds the switch running-config, used to skip configuration that is already present,
+            is cached on the controller between tasks. 0 fetches it once per task.
+            Can also be set with the ANSIBLE_ENOS_CONFIG_CACHE_TTL environment variable.
+        required: false
+        default: 0
+        choices: []
+    aggregate:
+        description:
+            - List of VLANs to manage in one task. Each entry has vlan_id (required), name, state (present or absent,
+            default present) and ports (port list or range, configured as the VLAN members, ports of the VLAN that are
+            not listed are removed from it). All entries are compared against the switch VLAN table in one pass and
+            only the missing or different ones are pushed, over a single session. Entries without name or ports may
+            give a range such as "100-199,250" as vlan_id; those are created or removed with as few range commands as
+            possible. Mutually exclusive with vlanArg1 to vlanArg5.
+        required: No
+        default: null
+        choices: []
     vlanArg1:
         description:
             - This is an overloaded vlan first argument. Usage of these overloaded variables are described in the table below.
-            Value of these argument depends on the configuration context.
-        required: Yes
+            Value of these argument depends on the configuration context. Either vlanArg1 or aggregate is required.
+            A VLAN range such as "10-20,25" with no vlanArg2 creates the VLANs of the range the switch does not have yet.
+        required: No
         default: null
         choices: [access-map, dot1q, filter, <1-3999> VLAN ID 1-3999 or range]
     vlanArg2:
@@ -129,8 +179,7 @@ Please find below the table with option how the overloaded variables are used in
     - For help in developing on modules, should you be so inclined, please read 
     Community Information & Contributing, Helping Testing PRs and Developing Modules.
     Module Dependency :
-    1. cnos_vlan.py
-    2. cnos_utility.py 
+    1. enos.py (module_utils)
 '''
 EXAMPLES = '''
 The task/main.yml will look like this
@@ -182,6 +231,19 @@ The task/main.yml will look like this
   vlanArg5='{{item.vlanArg5}}'
   with_items: "{{test_vlan_data7}}"
 
+- name: Test Vlan - Provision many VLANs in one task
+  enos_vlan:
+    host: "{{ inventory_hostname }}"
+    username: "{{ hostvars[inventory_hostname]['username'] }}"
+    password: "{{ hostvars[inventory_hostname]['password'] }}"
+    outputfile: ./results/test_vlan_{{ inventory_hostname }}_output.txt
+    aggregate:
+      - {vlan_id: 11, name: "servers", ports: "1/1-1/4"}
+      - {vlan_id: 12, name: "storage"}
+      - {vlan_id: 99, state: absent}
+      - {vlan_id: "200-299,310", state: present}
+      - {vlan_id: "3000-3999", state: absent}
+
 In the vars/main.yml will look like this
 
 ---
@@ -214,113 +276,249 @@ On successful execution, the method returns and empty string with a message "VLA
 in json format. But upon any failure, the output will be the error display string. You may have to rectify the 
 error and try again..
 
+commands:
+    description: Configuration commands pushed, empty when the requested state was already in place. Forms that are
+      not compared against the running-config are always pushed.
+    returned: success
+    type: list
+    sample: ["vlan 13", "name \"anil\"", "exit"]
+vlans:
+    description: With aggregate, one entry per VLAN telling whether it had to be changed.
+    returned: success
+    type: list
+    sample: [{"vlan_id": 11, "changed": true}, {"vlan_id": 12, "changed": false}]
+timings:
+    description: Seconds spent in each phase of the task (tcp_connect, ssh_auth, invoke_shell and
+      broker_spawn, or attach; enable, terminal_length, get_config, error_scan, file_write), the reply time of
+      each command and the total.
+    returned: always
+    type: dict
+    sample: {"tcp_connect": 0.01, "ssh_auth": 0.4, "invoke_shell": 0.05, "enable": 0.01, "terminal_length": 0.01,
+             "error_scan": 0.001, "commands": [{"command": "show version", "seconds": 0.01}], "total": 0.6}
 '''
 #---- Documentation Ends ----------------------------------------------------#
 #---- Logic Start ------------------------------------------------------------###
 #
 
-import sys
-import paramiko
-import time
-import argparse
-import socket
-import array
-import json
-import time
-import re
 try:
-    from ansible.module_utils import cnos
+    from ansible.module_utils import enos
     HAS_LIB = True
-except:
+except ImportError as e:
     HAS_LIB = False
-#try:
-#    import cnos_utility
-#    HAS_LIB=True
-#except:
-#    HAS_LIB=False
+    LIB_IMPORT_ERROR = str(e)
 
 #
 # load Ansible module
 #
-from ansible.module_utils.basic import *
-from collections import defaultdict
+from ansible.module_utils import basic
+from ansible.module_utils.basic import AnsibleModule
+
+
+def vlan_settings(vlanArg1, vlanArg2, vlanArg3):
+    #
+    # Desired state (see enos.diff_config) for the plain
+    # "vlan <id> [name|state|flood <value>]" forms, None for the others
+    #
+    if vlanArg1 is None or not str(vlanArg1).isdigit():
+        return None
+    context = "vlan %s" % vlanArg1
+    if vlanArg2 is None:
+        return [(context, {})]
+    if vlanArg3 is None:
+        return None
+    if vlanArg2 == "name":
+        return [(context, {"name": '"%s"' % vlanArg3.strip('"')})]
+    if vlanArg2 in ("state", "flood"):
+        return [(context, {vlanArg2: vlanArg3})]
+    return None
+
+def vlan_range(value):
+    #
+    # VlanSet for a VLAN id or range string such as "10-20,25", None when
+    # value is not one (access-map, dot1q, filter)
+    #
+    try:
+        return enos.VlanSet(str(value))
+    except ValueError:
+        return None
+
+def aggregate_settings(module, aggregate):
+    #
+    # One (vlan_id, vlans, settings) per aggregate entry, vlans being the
+    # VlanSet of the entry and settings the desired state of the VLAN for
+    # enos.diff_config, {} for a bare VLAN and None for an absent one
+    #
+    entries = []
+    for item in aggregate:
+        if not isinstance(item, dict):
+            module.fail_json(msg="aggregate entries must be dictionaries: %s" % item)
+        vlan_id = item.get("vlan_id")
+        vlans = vlan_range(vlan_id) if vlan_id is not None else None
+        if not vlans:
+            module.fail_json(msg="aggregate entries need a vlan_id or range between 1 and 4094: %s" % item)
+        state = item.get("state") or "present"
+        if state not in ("present", "absent"):
+            module.fail_json(msg="aggregate state must be present or absent: %s" % item)
+
+        settings = None
+        if state == "present":
+            settings = {}
+            if item.get("name") is not None:
+                settings["name"] = '"%s"' % str(item["name"]).strip('"')
+            ports = item.get("ports")
+            if ports is not None:
+                if isinstance(ports, list):
+                    ports = ",".join(str(port) for port in ports)
+                # The member ports, those on the VLAN but not listed
+                # are removed from it
+                try:
+                    settings["member"] = enos.expand_interfaces(ports)
+                except ValueError:
+                    module.fail_json(msg="aggregate ports must be a port list or range: %s" % item)
+            if settings and len(vlans) > 1:
+                module.fail_json(msg="name and ports need a single vlan_id: %s" % item)
+        entries.append((vlan_id, vlans, settings))
+    return entries
+
+def range_commands(create, prune, config):
+    #
+    # Commands adding the VLANs of create missing from the switch and
+    # removing those of prune still on it, as few range lines as possible
+    #
+    existing = config.vlan_ids()
+    commands = []
+    for line in enos.vlan_range_commands("vlan", create - existing):
+        commands.extend([line, "exit"])
+    commands.extend(enos.vlan_range_commands("no vlan", prune & existing))
+    return commands
+
+def aggregate_commands(aggregate, config):
+    #
+    # Commands for all aggregate entries, bare and absent VLANs being
+    # folded into range lines, plus whether each entry had to change
+    #
+    existing = config.vlan_ids()
+    create = enos.VlanSet()
+    prune = enos.VlanSet()
+    wanted = []
+    vlans = []
+    for vlan_id, ids, settings in aggregate:
+        if settings is None:
+            prune = prune | ids
+            changed = bool(ids & existing)
+        elif settings:
+            context = "vlan %s" % ids
+            wanted.append((context, settings))
+            changed = bool(enos.diff_config([(context, settings)], config))
+        else:
+            create = create | ids
+            changed = bool(ids - existing)
+        vlans.append(dict(vlan_id=vlan_id, changed=changed))
+    for context, settings in wanted:
+        create.discard(context.split()[1])
+    commands = range_commands(create, enos.VlanSet(), config)
+    commands.extend(enos.diff_config(wanted, config))
+    commands.extend(range_commands(enos.VlanSet(), prune, config))
+    return commands, vlans
 
 #
 def  main():
+    if not HAS_LIB:
+        # The option specs come from enos: take whatever was passed, kept
+        # out of the logs, to report why it did not load
+        params = basic._load_params()
+        AnsibleModule(argument_spec=dict((name, dict(no_log=True)) for name in params)).fail_json(
+            msg="enos module_utils could not be imported: %s" % LIB_IMPORT_ERROR)
     #
     # Define parameters for vlan creation entry
     #
-    module = AnsibleModule(
-        argument_spec=dict(
-            outputfile=dict(required=True),
-            host=dict(required=True),
-            username=dict(required=True),
-            password=dict(required=True),
-            enablePassword=dict(required=False),
-            #deviceType=dict(required=True),
-            deviceType=dict(required=False),
-            vlanArg1=dict(required=True),
-            vlanArg2=dict(required=False),
-            vlanArg3=dict(required=False),
-            vlanArg4=dict(required=False),
-            vlanArg5=dict(required=False),),
-        supports_check_mode=False)
-
-    username = module.params['username']
-    password = module.params['password']
+    argument_spec = dict(
+        outputfile=dict(required=True),
+        host=dict(required=True),
+        username=dict(required=True),
+        password=dict(required=True),
+        enablePassword=dict(required=False),
+        #deviceType=dict(required=True),
+        deviceType=dict(required=False),
+        aggregate=dict(required=False, type='list'),
+        vlanArg1=dict(required=False),
+        vlanArg2=dict(required=False),
+        vlanArg3=dict(required=False),
+        vlanArg4=dict(required=False),
+        vlanArg5=dict(required=False))
+    argument_spec.update(enos.enos_session_spec)
+    argument_spec.update(enos.enos_config_spec)
+    module = AnsibleModule(argument_spec=argument_spec,
+                           required_one_of=[['vlanArg1', 'aggregate']],
+                           mutually_exclusive=[['vlanArg1', 'aggregate']],
+                           supports_check_mode=False)
+
     enablePassword = module.params['enablePassword']
     vlanArg1= module.params['vlanArg1']
     vlanArg2 = module.params['vlanArg2']
     vlanArg3= module.params['vlanArg3']
     vlanArg4 = module.params['vlanArg4']
     vlanArg5 = module.params['vlanArg5']
+    aggregate = None
+    if module.params['aggregate'] is not None:
+        aggregate = aggregate_settings(module, module.params['aggregate'])
     outputfile =  module.params['outputfile']
-    hostIP = module.params['host']
-    #deviceType = module.params['deviceType']
-    deviceType = "g8272_cnos"
-    
-    output = ""
+    timeout = module.params['commandTimeout']
 
-    # Create instance of SSHClient object
-    remote_conn_pre = paramiko.SSHClient()
+    # Attach to a persistent shell for this switch, only logging in when
+    # no live session is available
+    remote_conn = enos.get_shell(module)
 
-    # Automatically add untrusted hosts (make sure okay for security policy in your environment)
-    remote_conn_pre.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    # Stream everything the switch sends to the output file as it arrives
+    outfile = enos.open_output(outputfile)
+    remote_conn.sink = outfile
 
-    # initiate SSH connection with the switch
-    remote_conn_pre.connect(hostIP, username=username, password=password, look_for_keys=False)
-    time.sleep(2)
-    
-    # Use invoke_shell to establish an 'interactive session'
-    remote_conn = remote_conn_pre.invoke_shell()
-    time.sleep(2)
-    
-    # Enable and enter configure terminal then send command
-    output = output + cnos.waitForDeviceResponse("\n",">", 2, remote_conn)
-    
-    output = output + cnos.enterEnableModeForDevice(enablePassword, 3, remote_conn)
-        
-    #Make terminal length = 0
-    output = output + cnos.waitForDeviceResponse("terminal-length 0\n","#", 2, remote_conn)
-        
-    #Go to config mode
-    output = output + cnos.waitForDeviceResponse("configure t\n","(config)#", 2, remote_conn)
-    
-    #Send the CLi command
-    #output = output + cnos.createVlan(vlanid,vlanname,"(config)#", 2, remote_conn)
-    output = output + cnos.vlanConfig(remote_conn, deviceType, "(config)#", 2, vlanArg1, vlanArg2, vlanArg3, vlanArg4, vlanArg5)
-    
-    #Save it into the file
-    file = open(outputfile, "a")
-    file.write(output)
-    file.close()
-    
-    # need to add logic to check when changes occur or not
-    errorMsg = cnos.checkOutputForError(output)
-    if(errorMsg == None):
-        module.exit_json(changed=True, msg="VLAN configuration is accomplished ")
-    else:
-        module.fail_json(msg=errorMsg)
+    try:
+        # Enable and terminal length = 0, written at once
+        enos.bootstrap(remote_conn, enablePassword, timeout)
+
+        # Compare every aggregate entry against the VLAN table in one pass
+        # and push the missing or different ones in one batch
+        if aggregate is not None:
+            commands, vlans = aggregate_commands(aggregate, enos.get_config(module, remote_conn))
+            if commands:
+                enos.push_config(module, remote_conn, commands, timeout)
+            outfile.close()
+            remote_conn.close()
+            module.exit_json(changed=bool(commands), commands=commands, vlans=vlans,
+                             msg="VLAN configuration is accomplished ")
+
+        # Push only what the running-config is missing, in one batch
+        wanted = vlan_settings(vlanArg1, vlanArg2, vlanArg3)
+        create = vlan_range(vlanArg1) if vlanArg2 is None else None
+        if wanted is not None or create:
+            config = enos.get_config(module, remote_conn)
+            if wanted is not None:
+                commands = enos.diff_config(wanted, config)
+            else:
+                # A range only creates the VLANs the switch does not have yet
+                commands = range_commands(create, enos.VlanSet(), config)
+            if commands:
+                enos.push_config(module, remote_conn, commands, timeout)
+            outfile.close()
+            remote_conn.close()
+            if commands:
+                module.exit_json(changed=True, commands=commands, msg="VLAN configuration is accomplished ")
+            module.exit_json(changed=False, commands=commands, msg="VLAN configuration is already present ")
+
+        # Other forms are sent as they are, in config mode
+        commands = enos.vlan_commands(vlanArg1, vlanArg2, vlanArg3, vlanArg4, vlanArg5)
+        enos.push_config(module, remote_conn, commands, timeout)
+    except enos.EnosError as e:
+        outfile.close()
+        remote_conn.close()
+        module.fail_json(msg=str(e))
+
+    outfile.close()
+    remote_conn.close()
+
+    # CLI rejections stopped the batch as soon as they came in
+    module.exit_json(changed=True, commands=commands, msg="VLAN configuration is accomplished ")
     
 
 if __name__ == '__main__':
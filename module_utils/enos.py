@@ -32,14 +32,38 @@
 #####
 
 
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import math
+import os
+import re
+import select
+import socket
+import tempfile
+import time
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+# paramiko is most of the import time of this file and only needed to log
+# in; it is imported then (see _paramiko()), so tasks attaching to a
+# persistent session never load it
+paramiko = None
+
 # From junos.py
 from ansible.module_utils.six import string_types
+from ansible.module_utils._text import to_bytes, to_text
+from ansible.module_utils.enos_parsers import SHOW_PATTERN
 
 
 # From ios.py
-from ansible.module_utils.basic import env_fallback, return_values
-from ansible.module_utils.network_common import to_list, ComplexList
-from ansible.module_utils.connection import exec_command
+from ansible.module_utils.basic import env_fallback
 
 
 _DEVICE_CONFIGS = {}
@@ -56,26 +80,2181 @@ enos_argument_spec = {
     'provider': dict(type='dict'),
 }
 
-def check_args(module, warnings):
-    provider = module.params['provider'] or {}
-    for key in enos_argument_spec:
-        if key not in ['provider', 'authorize'] and module.params[key]:
-            warnings.append('argument %s has been deprecated and will be '
-                    'removed in a future version' % key)
-
-    if provider:
-        for param in ('auth_pass', 'password'):
-            if provider.get(param):
-                module.no_log_values.update(return_values(provider[param]))
-
-
-def run_commands(module, commands, check_rc=True):
-    responses = list()
-    commands = to_commands(module, to_list(commands))
-    for cmd in commands:
-        cmd = module.jsonify(cmd)
-        rc, out, err = exec_command(module, cmd)
-        if check_rc and rc != 0:
-            module.fail_json(msg=err, rc=rc)
-        responses.append(out)
+# Options shared by every enos_* module that opens a CLI session
+enos_session_spec = {
+    'port': dict(type='int'),
+    'persistTimeout': dict(type='int', fallback=(env_fallback, ['ANSIBLE_ENOS_PERSIST_TIMEOUT'])),
+    'commandTimeout': dict(type='int'),
+    'metricsSink': dict(fallback=(env_fallback, ['ANSIBLE_ENOS_METRICS_SINK'])),
+}
+
+# Options of the modules that compare against the running-config
+enos_config_spec = {
+    'configCacheTtl': dict(type='int', fallback=(env_fallback, ['ANSIBLE_ENOS_CONFIG_CACHE_TTL'])),
+}
+
+# Options of the modules that run read-only commands
+enos_command_cache_spec = {
+    'commandCacheTtl': dict(type='int', fallback=(env_fallback, ['ANSIBLE_ENOS_COMMAND_CACHE_TTL'])),
+}
+
+def to_list(val):
+    """Return val as a list, None as an empty one.  Kept here rather than
+    imported from network_common, which newer Ansible releases dropped."""
+    if isinstance(val, (list, tuple, set)):
+        return list(val)
+    if val is not None:
+        return [val]
+    return []
+
+
+def run_commands(module, commands, check_rc=True, host=None, timings=None, total_timeout=None):
+    """Run commands from the enable prompt and return the output of each.
+
+    Read-only commands are answered from the CommandCache when they can
+    be.  host overrides module.params['host'] so a single module can drive
+    several switches.  Errors call fail_json when check_rc is set and are
+    raised as EnosError otherwise.  The session is timed into timings
+    when one is given.  With total_timeout, the login and every command
+    must be done within that many seconds: each step only waits for what
+    is left of it.
+    """
+    params = dict(module.params)
+    if host is not None:
+        params['host'] = host
+    timeout = params.get('commandTimeout')
+    deadline = _now() + total_timeout if total_timeout is not None else None
+
+    commands = to_list(commands)
+    cache = CommandCache(params)
+    outputs = cache.get(commands, timings)
+    if outputs is not None:
+        return outputs
+    if any(command_mode(command) == 'config' for command in commands):
+        bump_config_generation(params['host'])
+
+    try:
+        shell = open_shell(params, timings, deadline)
+        try:
+            bootstrap(shell, params.get('enablePassword'), _time_left(deadline, timeout))
+            responses = send_batch(shell, commands, timeout, deadline=deadline)
+        finally:
+            shell.close()
+    except EnosError as e:
+        if check_rc:
+            module.fail_json(msg=str(e))
+        raise
+    outputs = [command_output(response) for response in responses]
+    cache.put(commands, outputs)
+    return outputs
+
+
+class EnosError(Exception):
+    pass
+
+
+class EnosTimeoutError(EnosError):
+
+    def __init__(self, msg, output=''):
+        super(EnosTimeoutError, self).__init__(msg)
+        self.output = output
+
+
+class EnosCommandError(EnosError):
+
+    def __init__(self, command, error, responses=None, after=None):
+        message = '%s: %s' % (command, error)
+        if after:
+            message += '; ran after it: %s' % ', '.join(after)
+        super(EnosCommandError, self).__init__(message)
+        self.command = command
+        self.error = error
+        self.responses = responses or []
+        self.after = after or []
+
+
+#####
+# Prompt-driven CLI reader
+#
+# Rather than sleeping a fixed time after each command and hoping the
+# answer has arrived, block on the channel with select() and return as
+# soon as the CLI prompt shows at the tail of what was received.  The
+# timeout is only a deadline for a switch that stopped answering.
+#####
+
+DEFAULT_COMMAND_TIMEOUT = 120
+RECV_SIZE = 65535
+TAIL_SIZE = 512
+
+# Tail of the buffer when the CLI waits for input: "G8272>", "G8272#",
+# "G8272(config)#", "G8272(config-if)#", ...
+PROMPT_RE = re.compile(br'(?:^|[\r\n])[\w.\-]+(\(config[^)]*\))?([>#]) ?$')
+PASSWORD_RE = re.compile(br'[Pp]assword: ?$')
+
+# Commands pipelined ahead of the replies by send_batch()
+BATCH_WINDOW = 16
+
+# Configuration lines entering or leaving a context; send_batch() sends
+# them alone, so the lines after one never run in the wrong context when
+# it is rejected
+CONTEXT_COMMAND_RE = re.compile(r'\s*(?:no\s+)?(?:interface|vlan|router|route-map|spanning-tree\s+mst\s+configuration'
+                                r'|exit|end|conf(?:igure)?)\b')
+
+# CLI feedback for a rejected command, anchored at the start of a line
+ERROR_RE = re.compile(r'^[ \t]*(?:%[ \t]*(?:Invalid|Incomplete|Ambiguous|Unrecognized|Unknown|Error)\b'
+                      r'|(?:Error|ERROR)\b|Invalid\b|Command not found\b).*$', re.M)
+
+# The "^" line ENOS prints under a rejected command, pointing at the
+# word it could not parse
+_MARKER_RE = re.compile(r'\s*\^\s*$')
+
+# Lines after the echo of a data command that may hold CLI feedback: a
+# blank line, the "^" marker and the message
+FEEDBACK_LINES = 3
+
+# Read-only commands, run from the enable prompt rather than in configure
+# mode ("sh run" included); their output is data rather than CLI feedback
+EXEC_COMMAND_RE = re.compile(r'\s*(?:%s|display|dir|ping|traceroute)\b' % SHOW_PATTERN)
+
+_now = getattr(time, 'monotonic', time.time)
+
+
+def read_until_prompt(shell, timeout=None, prompt=None, limit=None):
+    """Read from shell until the CLI prompt shows and return the output.
+
+    Raises EnosTimeoutError when prompt (PROMPT_RE by default) has not
+    matched within timeout seconds.  With limit, only the first limit
+    bytes are kept and returned; the whole output still reaches the
+    shell's sink, so memory stays bounded however much the switch sends.
+    """
+    return to_text(_read(shell, timeout, prompt, limit)[0], errors='surrogate_or_replace')
+
+
+def send_command(shell, command, timeout=None, prompt=None, limit=None, check=True):
+    """Send one CLI line and return everything up to the next prompt.
+
+    With check, a CLI rejection of the command raises EnosCommandError.
+    Without timeout, the deadline is learnt from earlier replies (see
+    LatencyModel).
+    """
+    started = _now()
+    shell.send(command + '\n')
+    try:
+        response = read_until_prompt(shell, command_timeout(shell, command, timeout), prompt, limit)
+    except EnosTimeoutError:
+        _replied(shell, command, started)
+        raise
+    _replied(shell, command, started)
+    if check:
+        error = _scan(shell, response, command)
+        if error:
+            raise EnosCommandError(command, error, [response])
+    return response
+
+
+def enter_enable_mode(shell, enablePassword, timeout=None):
+    """Enter privileged exec mode, answering the password prompt if any."""
+    started = _now()
+    shell.send('enable\n')
+    data, match = _read(shell, timeout, _PROMPT_OR_PASSWORD_RE)
+    if match.group('password'):
+        if not enablePassword:
+            raise EnosError('the switch asks for an enable password but enablePassword is not set')
+        shell.send(enablePassword + '\n')
+        more, match = _read(shell, timeout)
+        data += more
+    if match.group(2) != b'#':
+        raise EnosError('unable to enter enable mode')
+    if shell.timings is not None:
+        shell.timings.add('enable', started)
+    return to_text(data, errors='surrogate_or_replace')
+
+
+def send_batch(shell, commands, timeout=None, check=True, window=BATCH_WINDOW, deadline=None):
+    """Pipeline commands to the switch and split the replies.
+
+    Up to window commands are written ahead of the replies, topped up as
+    each reply completes, so a long block costs about one round trip
+    rather than one per line.  A line entering or leaving a context (see
+    CONTEXT_COMMAND_RE) is a barrier: it is written once every reply
+    before it is in and nothing follows it until its own reply is, so
+    only lines of one context are ever in flight together.  Returns one
+    response per command, each running from the command echo through the
+    prompt that follows its output; joining them gives the session
+    transcript.  timeout applies to each command in turn, learnt for each
+    command when not given, and no command waits past deadline (a _now()
+    reading) when one is given.
+
+    With check, the first response carrying a CLI rejection stops the
+    batch: nothing more is written, the commands already in flight are
+    drained and EnosCommandError is raised, naming those that ran after
+    the rejected one.
+    """
+    echoes = [to_bytes(command.strip(), errors='surrogate_or_strict') for command in commands]
+    responses = []
+    sent = 0
+    failure = None
+    # Grown and trimmed in place: a large reply comes in many chunks
+    pending = bytearray()
+    # (offset in pending, time) where each chunk received ends
+    marks = []
+    scan_from = 0
+    arrived = _now()
+    if commands:
+        wait = _batch_wait(shell, commands[0], timeout, deadline, arrived)
+        due = arrived + wait
+    while len(responses) < sent or (failure is None and sent < len(commands)):
+        if failure is None and sent - len(responses) < window and sent < len(commands):
+            upto = min(len(commands), len(responses) + window)
+            if CONTEXT_COMMAND_RE.match(commands[sent]):
+                upto = sent + 1 if sent == len(responses) else sent
+            else:
+                upto = next((index for index in range(sent, upto)
+                             if CONTEXT_COMMAND_RE.match(commands[index])), upto)
+            if upto > sent:
+                # Sent stripped, as the echoes the replies are split on are
+                shell.send(''.join(command.strip() + '\n' for command in commands[sent:upto]))
+                sent = upto
+
+        remaining = due - _now()
+        if remaining <= 0 or not select.select([shell], [], [], remaining)[0]:
+            output = to_text(bytes(pending), errors='surrogate_or_replace')
+            _replied(shell, commands[len(responses)], arrived)
+            raise EnosTimeoutError('timed out after %s seconds waiting for the switch prompt after %r, '
+                                   'last output: %r' % (round(wait, 3), commands[len(responses)], output[-200:]), output)
+        data = shell.recv(RECV_SIZE)
+        if not data:
+            raise EnosError('the switch closed the session')
+        pending += data
+        marks.append((len(pending), _now()))
+
+        while len(responses) < sent:
+            last = len(responses) == sent - 1
+            end, scan_from = _find_boundary(shell, pending, scan_from, None if last else echoes[len(responses) + 1])
+            if end is None:
+                break
+            response = to_text(bytes(pending[:end]), errors='surrogate_or_replace')
+            if check and failure is None:
+                error = _scan(shell, response, commands[len(responses)])
+                if error:
+                    failure = (len(responses), error)
+            # Pipelined: each reply is timed from the one before it to
+            # the chunk its prompt came in, as the end of a reply only
+            # shows once the next echo is in
+            done = [at for offset, at in marks if offset >= end][0]
+            _replied(shell, commands[len(responses)], arrived, done)
+            responses.append(response)
+            del pending[:end]
+            marks = [(offset - end, at) for offset, at in marks if offset > end]
+            scan_from = 0
+            arrived = done
+            if len(responses) < len(commands):
+                wait = _batch_wait(shell, commands[len(responses)], timeout, deadline, arrived)
+                due = arrived + wait
+
+    if failure is not None:
+        index, error = failure
+        raise EnosCommandError(commands[index], error, responses, commands[index + 1:len(responses)])
+    return responses
+
+
+def _batch_wait(shell, command, timeout, deadline, arrived):
+    # Seconds the reply to command is waited for from arrived, at most
+    # until deadline
+    wait = command_timeout(shell, command, timeout)
+    if deadline is not None:
+        wait = max(0, min(wait, deadline - arrived))
+    return wait
+
+
+def find_error(response, command=None):
+    """Return the first CLI rejection found in response, or None.
+
+    Only lines starting like ENOS error feedback match ("% Invalid input
+    ...", "Error: ..."), so a word such as "error" inside interface
+    counters does not.  When command is given and its output is data
+    (show ...), only the first line after the echo and the "^" marker
+    pointing at the bad word can be CLI feedback and nothing past it is
+    scanned.
+    """
+    if command is not None and command_mode(command) == 'exec':
+        lines = response.split('\n', FEEDBACK_LINES + 1)[1:FEEDBACK_LINES + 1]
+        first = [line for line in lines if line.strip() and not _MARKER_RE.match(line)][:1]
+        match = ERROR_RE.search(first[0]) if first else None
+    else:
+        match = ERROR_RE.search(response)
+    if match:
+        return match.group(0).strip()
+    return None
+
+
+def _scan(shell, response, command):
+    # find_error(), timed as the error_scan phase
+    started = _now()
+    error = find_error(response, command)
+    if shell.timings is not None:
+        shell.timings.add('error_scan', started)
+    return error
+
+
+def command_output(response):
+    """Strip the command echo and the trailing prompt from a response."""
+    lines = response.splitlines()
+    if lines and PROMPT_RE.search(to_bytes('\n' + lines[-1], errors='surrogate_or_strict')):
+        lines = lines[:-1]
+    return '\n'.join(lines[1:])
+
+
+def command_mode(command):
+    """Return "exec" for a read-only command (see EXEC_COMMAND_RE), which
+    needs neither configure mode nor a new config generation, and
+    "config" for the others."""
+    return 'exec' if EXEC_COMMAND_RE.match(command) else 'config'
+
+
+# A prompt at the start of a line, as printed before the next command echo
+_PROMPT_LINE_RE = re.compile(br'[\r\n][\w.\-]+(?:\(config[^)]*\))?[>#] ?')
+
+
+def _find_boundary(shell, pending, scan_from, next_echo):
+    # Return (offset just past the prompt that ends the current response,
+    # offset to resume scanning from).  The current response ends at a
+    # prompt followed by the next command's echo, or for the last command
+    # at a prompt sitting at the tail with nothing queued behind it.
+    if next_echo is None:
+        if PROMPT_RE.search(pending[-TAIL_SIZE:]) and not select.select([shell], [], [], 0)[0]:
+            return len(pending), scan_from
+        return None, max(0, len(pending) - TAIL_SIZE)
+
+    pos = scan_from
+    while True:
+        match = _PROMPT_LINE_RE.search(pending, pos)
+        if match is None:
+            return None, max(0, len(pending) - TAIL_SIZE)
+        following = pending[match.end():match.end() + len(next_echo)]
+        if len(following) < len(next_echo):
+            # Echo not fully received yet, look here again next time
+            return None, match.start()
+        if following == next_echo:
+            return match.end(), 0
+        pos = match.end()
+
+
+_PROMPT_OR_PASSWORD_RE = re.compile(PROMPT_RE.pattern + br'|(?P<password>' + PASSWORD_RE.pattern + br')')
+
+
+def _read(shell, timeout=None, prompt=None, limit=None):
+    # Return (bytes read, or the first limit of them, prompt match)
+    if timeout is None:
+        timeout = DEFAULT_COMMAND_TIMEOUT
+    if prompt is None:
+        prompt = PROMPT_RE
+    deadline = _now() + timeout
+    chunks = []
+    kept = 0
+    tail = b''
+    while True:
+        remaining = deadline - _now()
+        if remaining <= 0 or not select.select([shell], [], [], remaining)[0]:
+            output = to_text(b''.join(chunks), errors='surrogate_or_replace')
+            raise EnosTimeoutError('timed out after %s seconds waiting for the switch prompt, '
+                                   'last output: %r' % (timeout, to_text(tail[-200:])), output)
+        data = shell.recv(RECV_SIZE)
+        if not data:
+            raise EnosError('the switch closed the session')
+        if limit is None:
+            chunks.append(data)
+        elif kept < limit:
+            chunks.append(data[:limit - kept])
+            kept += len(chunks[-1])
+        tail = (tail + data)[-TAIL_SIZE:]
+        match = prompt.search(tail)
+        # A prompt-looking tail with more data already queued behind it
+        # is part of the output, keep reading
+        if match and not select.select([shell], [], [], 0)[0]:
+            return b''.join(chunks), match
+
+
+OUTPUT_BUFFER_SIZE = 64 * 1024
+# CLI rejections show right after the command echo, this much of a
+# command's output is enough to check it
+OUTPUT_HEAD_SIZE = 4096
+
+
+def open_output(path):
+    """Open path for appending a session transcript, to be set as a
+    Shell's sink.
+
+    Writes are buffered, and paths ending in .gz are gzip-compressed; each
+    run appends a gzip member, which gzip/zcat read back as one stream.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'ab')
+    return io.open(path, 'ab', buffering=OUTPUT_BUFFER_SIZE)
+
+
+class OutputSink(object):
+    """Shell sink receiving one command's output as it streams in.
+
+    The command echo and the closing prompt are left out and line ends
+    are normalised to \\n; subclasses get the output a run of complete
+    lines at a time in update().  What they get is also written to copy,
+    and everything received as is to tee, when given.
+    """
+
+    def __init__(self, copy=None, tee=None):
+        self.copy = copy
+        self.tee = tee
+        self._echo = True
+        self._pending = b''
+
+    def write(self, data):
+        if self.tee is not None:
+            self.tee.write(data)
+        data = self._pending + data.replace(b'\r', b'')
+        if self._echo:
+            end = data.find(b'\n')
+            if end < 0:
+                self._pending = data
+                return
+            data = data[end + 1:]
+            self._echo = False
+        # The last partial line may be the prompt, hold it back
+        end = data.rfind(b'\n') + 1
+        self._pending = data[end:]
+        if end:
+            self.update(data[:end])
+            if self.copy is not None:
+                self.copy.write(data[:end])
+
+    def update(self, data):
+        pass
+
+
+class OutputDigest(OutputSink):
+    """OutputSink computing the sha256 of the output, so equal output
+    gives an equal digest whatever the session."""
+
+    def __init__(self, copy=None, tee=None):
+        OutputSink.__init__(self, copy, tee)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def update(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+class OutputParser(OutputSink):
+    """OutputSink feeding each line to parser (see enos_parsers) and
+    collecting the rows it returns, or handing them to emit."""
+
+    def __init__(self, parser, copy=None, tee=None, emit=None):
+        OutputSink.__init__(self, copy, tee)
+        self.parser = parser
+        self.rows = []
+        self.count = 0
+        self._emit = emit if emit is not None else self.rows.append
+
+    def update(self, data):
+        feed = self.parser.feed
+        emit = self._emit
+        for line in to_text(data, errors='surrogate_or_replace').split('\n')[:-1]:
+            row = feed(line)
+            if row is not None:
+                emit(row)
+                self.count += 1
+
+    def close(self):
+        """Hand over the last row; call once the prompt has come back."""
+        row = self.parser.close()
+        if row is not None:
+            self._emit(row)
+            self.count += 1
+
+
+def stream_command(shell, command, sink, timeout=None):
+    """Run command with its output going to sink (an OutputSink) rather
+    than to memory or to the shell's own sink, and return sink."""
+    saved, shell.sink = shell.sink, sink
+    try:
+        send_command(shell, command, timeout, limit=OUTPUT_HEAD_SIZE)
+    finally:
+        shell.sink = saved
+    return sink
+
+
+def digest_command(shell, command, timeout=None, copy=None):
+    """Run command and return an OutputDigest of its output, which is
+    streamed to copy rather than kept in memory."""
+    return stream_command(shell, command, OutputDigest(copy), timeout)
+
+
+#####
+# Session bootstrap
+#
+# Every task starts with the same preamble: enable, terminal-length 0 and
+# for some terminal dont-ask, a round trip each when sent one at a time.
+# bootstrap() writes the preamble at once and checks each step on the
+# prompt ending its reply.  What a login needed last time is kept in
+# STATE_DIR: the lines after enable are only sent along with it once
+# enable is known not to ask for a password (which would take the next
+# line for it), and lines the switch rejected (dont-ask on firmware
+# without it) are left out.  What is learnt is forgotten after
+# BOOTSTRAP_STATE_TTL, so a switch upgraded since is asked again.
+#####
+
+PREAMBLE = ['terminal-length 0']
+DONT_ASK = 'terminal dont-ask'
+BOOTSTRAP_STATE_TTL = 24 * 3600
+
+# Prompt or password prompt ending the reply to each line written
+_REPLY_END_RE = re.compile(br'(?:^|[\r\n])[\w.\-]+(\(config[^)]*\))?([>#]) ?|(?P<password>[Pp]assword: ?)')
+
+
+def bootstrap(shell, enablePassword, timeout=None, dont_ask=False):
+    """Bring shell to the enable prompt with paging off, and with the
+    confirmation prompts off too with dont_ask.  Returns the transcript;
+    raises EnosError as enter_enable_mode() does."""
+    session = _Bootstrap(shell, enablePassword, dont_ask)
+    session.start()
+    return session.finish(timeout)
+
+
+class _Bootstrap(object):
+    # The preamble of one shell, split into start() writing it and
+    # finish() reading the replies so that several channels are
+    # bootstrapped at once
+
+    def __init__(self, shell, enablePassword, dont_ask=False):
+        self.shell = shell
+        self.enablePassword = enablePassword
+        self._path = _state_path('bootstrap', shell.login) if shell.login else None
+        self.known = _load_state(self._path) if self._path else {}
+        if time.time() - self.known.get('time', 0) > BOOTSTRAP_STATE_TTL:
+            self.known = {}
+        rejected = self.known.get('rejected', [])
+        self.steps = [line for line in PREAMBLE + ([DONT_ASK] if dont_ask else []) if line not in rejected]
+        self.output = []
+        self._ahead = []
+        self._started = None
+
+    def start(self):
+        self._started = _now()
+        if self.known.get('password') is False:
+            self._ahead = self.steps
+        self._write(['enable'] + self._ahead)
+
+    def finish(self, timeout=None):
+        replies = self._read(1 + len(self._ahead), timeout)
+        (data, match, enabled), done = replies[0], replies[1:]
+        asked = bool(match.group('password'))
+        if asked and self._ahead:
+            # enable asks for a password since the last session and took
+            # the next line for it: ask again
+            self._write(['enable'])
+            (data, match, enabled), done = self._read(1, timeout)[0], []
+            asked = bool(match.group('password'))
+        if match.group('password'):
+            if not self.enablePassword:
+                raise EnosError('the switch asks for an enable password but enablePassword is not set')
+            self._write([self.enablePassword] + self.steps)
+            replies = self._read(1 + len(self.steps), timeout)
+            (data, match, enabled), done = replies[0], replies[1:]
+        if match.group(2) != b'#':
+            raise EnosError('unable to enter enable mode')
+        if len(done) < len(self.steps):
+            self._write(self.steps)
+            done = self._read(len(self.steps), timeout)
+
+        rejected = set(self.known.get('rejected', []))
+        for line, (data, match, at) in zip(self.steps, done):
+            if find_error(to_text(data, errors='surrogate_or_replace'), line):
+                rejected.add(line)
+        known = dict(password=asked, rejected=sorted(rejected))
+        if self._path and known != dict((key, self.known.get(key)) for key in known):
+            known['time'] = time.time()
+            try:
+                _save_state(self._path, known)
+            except EnvironmentError:
+                pass
+        if self.shell.timings is not None:
+            # Up to the enable prompt, then the rest of the preamble
+            # (terminal-length and the like)
+            self.shell.timings.add('enable', self._started, enabled)
+            self.shell.timings.add('terminal_length', enabled, done[-1][2] if done else enabled)
+        return to_text(b''.join(self.output), errors='surrogate_or_replace')
+
+    def _write(self, lines):
+        self.shell.send(''.join(line + '\n' for line in lines))
+
+    def _read(self, count, timeout=None):
+        # (bytes, match, _now() when in) of the replies to the next count
+        # lines written
+        timeout = command_timeout(self.shell, 'enable', timeout)
+        replies = []
+        pending = b''
+        deadline = _now() + timeout
+        while True:
+            match = _REPLY_END_RE.search(pending)
+            if match is not None:
+                self.output.append(pending[:match.end()])
+                replies.append((pending[:match.end()], match, _now()))
+                pending = pending[match.end():]
+                deadline = _now() + timeout
+                if len(replies) == count:
+                    break
+                continue
+            remaining = deadline - _now()
+            if remaining <= 0 or not select.select([self.shell], [], [], remaining)[0]:
+                output = to_text(pending, errors='surrogate_or_replace')
+                raise EnosTimeoutError('timed out after %s seconds waiting for the switch prompt, '
+                                       'last output: %r' % (timeout, output[-200:]), output)
+            data = self.shell.recv(RECV_SIZE)
+            if not data:
+                raise EnosError('the switch closed the session')
+            pending += data
+        self.output.append(pending)
+        return replies
+
+
+#####
+# Parallel channels
+#
+# The switch answers each CLI channel on its own, so independent
+# read-only commands need not queue behind one another.  run_parallel()
+# opens more channels on the transport a shell logged in with (through
+# the broker for a persistent session), gives each a share of the
+# commands and reads all of them in one select() loop: a set of show
+# commands takes about as long as the slowest one rather than the sum.
+#####
+
+# CLI channels opened on one SSH transport, by run_parallel() or a broker
+MAX_CHANNELS = 4
+
+
+def run_parallel(shell, commands, timeout=None, enablePassword=None, channels=MAX_CHANNELS, check=True):
+    """Run read-only commands concurrently over up to channels channels.
+
+    shell sits at the enable prompt and takes a share of the commands;
+    the other channels are opened, brought to the enable prompt and
+    closed again here.  When the switch or broker gives fewer channels
+    the commands are spread over those.  Returns one response per
+    command, in order, as send_batch() does; they reach shell's sink in
+    that order once all are in.  With check, a CLI rejection raises
+    EnosCommandError after all the replies have come in.
+    """
+    commands = list(commands)
+    shells = [shell]
+    started = _now()
+    try:
+        while len(shells) < min(channels, len(commands)):
+            try:
+                shells.append(shell.open_channel())
+            except EnosError:
+                break
+        if len(shells) > 1:
+            _prepare_channels(shells[1:], enablePassword, timeout)
+            if shell.timings is not None:
+                shell.timings.add('open_channels', started)
+            for other in shells[1:]:
+                other.timings = shell.timings
+
+        # One piece per command to the sink, rather than the replies of
+        # the channels interleaved
+        sink, shell.sink = shell.sink, None
+        try:
+            lanes = _run_lanes([(other, commands[index::len(shells)]) for index, other in enumerate(shells)],
+                               timeout)
+        finally:
+            shell.sink = sink
+    finally:
+        for other in shells[1:]:
+            other.close()
+
+    replies = [None] * len(commands)
+    for index, lane in enumerate(lanes):
+        for position, (data, match) in enumerate(lane):
+            replies[index + position * len(shells)] = data
+    if sink is not None:
+        for data in replies:
+            sink.write(data)
+    responses = [to_text(data, errors='surrogate_or_replace') for data in replies]
+    if check:
+        for command, response in zip(commands, responses):
+            error = _scan(shell, response, command)
+            if error:
+                raise EnosCommandError(command, error, responses)
     return responses
+
+
+def _prepare_channels(shells, enablePassword, timeout=None):
+    # Bootstrap all the new channels at once
+    sessions = [_Bootstrap(shell, enablePassword) for shell in shells]
+    for session in sessions:
+        session.start()
+    for session in sessions:
+        session.finish(timeout)
+
+
+def _run_lanes(lanes, timeout=None, prompt=None):
+    # lanes is a list of (shell, commands).  Each shell works through its
+    # commands one after the other, all shells at once; returns the
+    # (bytes read, prompt match) of every command, lane by lane.  timeout
+    # applies to each command, learnt for each when not given.
+    if prompt is None:
+        prompt = PROMPT_RE
+    results = [[] for lane in lanes]
+    # shell -> [lane, chunks, tail, started, deadline]
+    busy = {}
+
+    def start(index):
+        shell, commands = lanes[index]
+        command = commands[len(results[index])]
+        shell.send(command + '\n')
+        started = _now()
+        busy[shell] = [index, [], b'', started, started + command_timeout(shell, command, timeout)]
+
+    for index, (shell, commands) in enumerate(lanes):
+        if commands:
+            start(index)
+    while busy:
+        first = min(state[4] for state in busy.values())
+        ready = select.select(list(busy), [], [], max(0, first - _now()))[0]
+        if not ready:
+            shell = min(busy, key=lambda shell: busy[shell][4])
+            index, chunks, tail, started, deadline = busy[shell]
+            command = lanes[index][1][len(results[index])]
+            _replied(shell, command, started)
+            raise EnosTimeoutError('timed out after %s seconds waiting for the switch prompt after %r, '
+                                   'last output: %r' % (round(deadline - started, 3), command, to_text(tail[-200:])),
+                                   to_text(b''.join(chunks), errors='surrogate_or_replace'))
+        for shell in ready:
+            state = busy[shell]
+            data = shell.recv(RECV_SIZE)
+            if not data:
+                raise EnosError('the switch closed the session')
+            state[1].append(data)
+            state[2] = (state[2] + data)[-TAIL_SIZE:]
+            match = prompt.search(state[2])
+            # As in _read(), a prompt with more data queued behind it is
+            # part of the output
+            if match and not select.select([shell], [], [], 0)[0]:
+                index = state[0]
+                command = lanes[index][1][len(results[index])]
+                results[index].append((b''.join(state[1]), match))
+                _replied(shell, command, state[3])
+                del busy[shell]
+                if len(results[index]) < len(lanes[index][1]):
+                    start(index)
+    return results
+
+
+#####
+# Running-config cache
+#
+# Idempotent modules compare what they would push against the running
+# config.  It is fetched once per host and session and kept in
+# _DEVICE_CONFIGS; with configCacheTtl it is also kept on the controller
+# so later tasks skip the fetch.  Entries are keyed by host plus a change
+# counter the enos_* modules bump before they push configuration, so a
+# cached copy never outlives a change made through them.  Changes made
+# by other means are picked up once the TTL runs out.
+#####
+
+STATE_DIR = os.path.expanduser(os.environ.get('ANSIBLE_ENOS_STATE_DIR', '~/.ansible/enos'))
+
+
+def get_config(module, shell):
+    """Return the running-config of module.params['host'] as a
+    ConfigTree, from cache when it is still current."""
+    host = module.params['host']
+    ttl = module.params.get('configCacheTtl') or 0
+    generation = config_generation(host)
+
+    cached = _DEVICE_CONFIGS.get(host)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
+    text = None
+    path = _state_path('config', host)
+    if ttl > 0:
+        entry = _load_state(path)
+        if entry.get('generation') == generation and time.time() - entry.get('time', 0) < ttl:
+            text = entry['config']
+
+    started = _now()
+    if text is None:
+        # Keep the fetch out of the module's output file
+        sink, shell.sink = shell.sink, None
+        try:
+            text = command_output(send_command(shell, 'show running-config', module.params.get('commandTimeout')))
+        finally:
+            shell.sink = sink
+        if ttl > 0:
+            _save_state(path, dict(generation=generation, time=time.time(), config=text))
+
+    config = parse_config(text)
+    _DEVICE_CONFIGS[host] = (generation, config)
+    if shell.timings is not None:
+        shell.timings.add('get_config', started)
+    return config
+
+
+def parse_config(text):
+    """Parse running-config text into a ConfigTree."""
+    return ConfigTree(text)
+
+
+class ConfigSection(object):
+    """A running-config line and the lines indented under it.
+
+    lines keeps the child lines in order; membership tests (line in
+    section) are O(1).  Child lines that open blocks of their own are
+    also in children, keyed by their text.
+    """
+
+    __slots__ = ('text', 'lines', 'children', '_index')
+
+    def __init__(self, text):
+        self.text = text
+        self.lines = []
+        self.children = {}
+        self._index = set()
+
+    def add(self, line):
+        if line not in self._index:
+            self._index.add(line)
+            self.lines.append(line)
+
+    def __contains__(self, line):
+        return ' '.join(line.split()) in self._index
+
+    def __eq__(self, other):
+        return isinstance(other, ConfigSection) and self._index == other._index
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'ConfigSection(%r, %d lines)' % (self.text, len(self.lines))
+
+
+class ConfigTree(object):
+    """ENOS running-config as a tree of sections keyed by context.
+
+    sections maps every top-level line ("vlan 11", "interface port 1/5",
+    "spanning-tree mst configuration", "hostname ...") to its
+    ConfigSection, in config order.  interfaces maps interface names
+    ("port 1/5", "portchannel 10", "ip 1") and vlans maps VLAN ids (int)
+    to their sections, for O(1) lookup.
+    """
+
+    def __init__(self, text=''):
+        self.sections = {}
+        self.order = []
+        self.interfaces = {}
+        self.vlans = {}
+        self._parse(text)
+
+    def _parse(self, text):
+        # Nesting follows indentation; ENOS closes blocks with "exit" and
+        # separates them with "!", neither carries configuration
+        # Each stack entry is [indent, parent section, text, section]; a
+        # nested line only gets a section once something is indented
+        # under it
+        stack = []
+        for line in text.splitlines():
+            normalized = ' '.join(line.split())
+            if not normalized or normalized in ('!', 'exit'):
+                continue
+            indent = len(line) - len(line.lstrip())
+            while stack and stack[-1][0] >= indent:
+                stack.pop()
+            if not stack:
+                stack.append([indent, None, normalized, self._top(normalized)])
+                continue
+            top = stack[-1]
+            if top[3] is None:
+                top[3] = top[1].children.setdefault(top[2], ConfigSection(top[2]))
+            top[3].add(normalized)
+            stack.append([indent, top[3], normalized, None])
+
+    def _top(self, context):
+        section = self.sections.get(context)
+        if section is not None:
+            return section
+        section = self.sections[context] = ConfigSection(context)
+        self.order.append(context)
+        words = context.split(' ', 1)
+        if words[0] == 'interface' and len(words) == 2:
+            self.interfaces[words[1]] = section
+        elif words[0] == 'vlan' and len(words) == 2 and words[1].isdigit():
+            self.vlans[int(words[1])] = section
+        return section
+
+    def __contains__(self, context):
+        return ' '.join(context.split()) in self.sections
+
+    def section(self, context):
+        """Return the ConfigSection for context, or None."""
+        return self.sections.get(' '.join(context.split()))
+
+    def interface(self, name):
+        return self.interfaces.get(' '.join(name.split()))
+
+    def vlan(self, vlan_id):
+        return self.vlans.get(int(vlan_id))
+
+    def vlan_ids(self):
+        """Return the configured VLANs as a VlanSet."""
+        return VlanSet(self.vlans)
+
+    def has(self, context, lines):
+        """True when context exists with all of lines under it."""
+        section = self.section(context)
+        return section is not None and all(line in section for line in lines)
+
+
+def diff_config(want, config):
+    """Return the commands that turn config (a ConfigTree) into want.
+
+    want maps contexts ("vlan 11", "interface port 1/5") to settings, as
+    a dict or a list of (context, settings) pairs to keep the order.
+    settings map a key to its value: the line pushed is "<key> <value>",
+    which replaces the value the switch had for key, True pushes the bare
+    key ("shutdown") and None or False removes whatever line starts with
+    the key ("no <key>").  A list value is a set of interface names (the
+    "member" ports of a VLAN): the ones missing are added with "<key>
+    <ranges>" and those configured but not listed are removed with "no
+    <key> <ranges>".  A context mapped to None is removed as a whole.
+
+    Only the keys given are compared: settings of a context that want
+    does not name are left as they are.  Only lines that differ are
+    emitted, each changed context wrapped in "<context>" ... "exit";
+    contexts are created before removals so ports never point at a VLAN
+    that is gone yet.
+    """
+    commands = []
+    removals = []
+    for context, settings in _items(want):
+        context = ' '.join(context.split())
+        section = config.section(context)
+        if settings is None:
+            if section is not None:
+                removals.append('no %s' % context)
+            continue
+
+        lines = []
+        for key, value in _items(settings):
+            key = ' '.join(key.split())
+            if value is None or value is False:
+                if section is not None and _find_key(section, key) is not None:
+                    lines.append('no %s' % key)
+            elif isinstance(value, (list, tuple)):
+                lines.extend(_port_list_lines(section, key, value))
+            else:
+                line = key if value is True else '%s %s' % (key, value)
+                if section is None or line not in section:
+                    lines.append(' '.join(line.split()))
+
+        if lines or section is None:
+            commands.append(context)
+            commands.extend(lines)
+            commands.append('exit')
+    return commands + removals
+
+
+# Longest VLAN list put on one CLI line by vlan_range_commands()
+VLAN_COMMAND_WIDTH = 200
+
+
+class VlanSet(object):
+    """Set of VLAN ids (1-4094) kept as a 4096-bit bitmap.
+
+    Built from ids or from CLI range strings such as "10-20,25,30-40";
+    union, intersection and difference are single integer operations,
+    and str() gives back the shortest range string.
+    """
+
+    __slots__ = ('_bits',)
+
+    def __init__(self, vlans=None):
+        self._bits = 0
+        if isinstance(vlans, VlanSet):
+            self._bits = vlans._bits
+        elif isinstance(vlans, string_types):
+            self._bits = self._parse(vlans)
+        elif vlans is not None:
+            for vlan in vlans:
+                self.add(vlan)
+
+    @staticmethod
+    def _parse(text):
+        bits = 0
+        for part in text.replace(' ', '').split(','):
+            if not part:
+                continue
+            start, sep, end = part.partition('-')
+            if not start.isdigit() or (sep and not end.isdigit()):
+                raise ValueError('invalid VLAN range %r' % part)
+            start = int(start)
+            end = int(end) if sep else start
+            if not 1 <= start <= end <= 4094:
+                raise ValueError('invalid VLAN range %r' % part)
+            bits |= ((1 << (end - start + 1)) - 1) << start
+        return bits
+
+    @classmethod
+    def _from_bits(cls, bits):
+        vlans = cls()
+        vlans._bits = bits
+        return vlans
+
+    def add(self, vlan):
+        vlan = int(vlan)
+        if not 1 <= vlan <= 4094:
+            raise ValueError('invalid VLAN id %r' % vlan)
+        self._bits |= 1 << vlan
+
+    def discard(self, vlan):
+        self._bits &= ~(1 << int(vlan))
+
+    def __contains__(self, vlan):
+        return bool(self._bits >> int(vlan) & 1)
+
+    def __len__(self):
+        return bin(self._bits).count('1')
+
+    def __bool__(self):
+        return self._bits != 0
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        for start, end in self.ranges():
+            for vlan in range(start, end + 1):
+                yield vlan
+
+    def __eq__(self, other):
+        return isinstance(other, VlanSet) and self._bits == other._bits
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __or__(self, other):
+        return self._from_bits(self._bits | VlanSet(other)._bits)
+
+    def __and__(self, other):
+        return self._from_bits(self._bits & VlanSet(other)._bits)
+
+    def __sub__(self, other):
+        return self._from_bits(self._bits & ~VlanSet(other)._bits)
+
+    def ranges(self):
+        """Return the set as sorted (first, last) runs."""
+        runs = []
+        bits = self._bits
+        offset = 0
+        while bits:
+            # Skip to the lowest set bit, then measure the run of ones
+            skip = (bits & -bits).bit_length() - 1
+            bits >>= skip
+            offset += skip
+            length = (bits ^ (bits + 1)).bit_length() - 1
+            runs.append((offset, offset + length - 1))
+            bits >>= length
+            offset += length
+        return runs
+
+    def __str__(self):
+        return ','.join(str(start) if start == end else '%d-%d' % (start, end)
+                        for start, end in self.ranges())
+
+    def __repr__(self):
+        return 'VlanSet(%r)' % str(self)
+
+
+def vlan_range_commands(command, vlans, width=VLAN_COMMAND_WIDTH):
+    """Return the fewest "<command> <ranges>" lines covering vlans, each
+    VLAN list kept under width characters."""
+    lines = []
+    current = []
+    length = 0
+    for start, end in VlanSet(vlans).ranges():
+        part = str(start) if start == end else '%d-%d' % (start, end)
+        if current and length + len(part) + 1 > width:
+            lines.append('%s %s' % (command, ','.join(current)))
+            current = []
+            length = 0
+        current.append(part)
+        length += len(part) + 1
+    if current:
+        lines.append('%s %s' % (command, ','.join(current)))
+    return lines
+
+
+# Interface types whose contexts take a range ("interface port 1/1-1/48");
+# the others (mgmt, loopback, ...) are configured one at a time
+RANGE_INTERFACES = ('port', 'portchannel')
+
+
+def expand_interfaces(text):
+    """Return the interface names of an interface range, in order.
+
+    Names are port numbers ("17") or slot/port ("1/5"); ranges give both
+    ends in full ("1/1-1/48") or only the last number ("1/1-48").  Raises
+    ValueError for anything else.
+    """
+    names = []
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        start = _port_key(first)
+        if not sep:
+            names.append(first)
+            continue
+        end = _port_key(last) if '/' in last else (start[0], _port_number(last))
+        if end[0] != start[0] or end[1] < start[1]:
+            raise ValueError('invalid interface range %r' % part)
+        prefix = ''.join('%d/' % slot for slot in start[0])
+        names.extend('%s%d' % (prefix, number) for number in range(start[1], end[1] + 1))
+    return names
+
+
+def interface_ranges(names):
+    """Return names coalesced into the fewest contiguous ranges
+    ("1/1-1/48", "17-20", "1/50"), in port order."""
+    runs = []
+    for prefix, number in sorted(set(_port_key(name) for name in names)):
+        if runs and runs[-1][0] == prefix and runs[-1][2] == number - 1:
+            runs[-1][2] = number
+        else:
+            runs.append([prefix, number, number])
+    ranges = []
+    for prefix, start, end in runs:
+        prefix = ''.join('%d/' % slot for slot in prefix)
+        if start == end:
+            ranges.append('%s%d' % (prefix, start))
+        else:
+            ranges.append('%s%d-%s%d' % (prefix, start, prefix, end))
+    return ranges
+
+
+def plan_interfaces(want, config):
+    """Like diff_config() for interfaces, grouping them into ranges.
+
+    want is a list of (option, name, settings) with option the interface
+    type ("port") and name one interface ("1/5").  Interfaces of a type in
+    RANGE_INTERFACES that need the same lines are pushed through one
+    "interface <type> <range>" context per contiguous run, so setting the
+    MTU of 48 ports is a single context.
+    """
+    groups = []
+    members = {}
+    for option, name, settings in want:
+        context = 'interface %s %s' % (option, name)
+        commands = diff_config([(context, settings)], config)
+        if not commands:
+            continue
+        if option not in RANGE_INTERFACES:
+            groups.append((option, None, commands))
+            continue
+        key = (option, tuple(commands[1:]))
+        if key not in members:
+            members[key] = []
+            groups.append((option, key, None))
+        members[key].append(name)
+
+    result = []
+    for option, key, commands in groups:
+        if key is None:
+            result.extend(commands)
+            continue
+        for ports in interface_ranges(members[key]):
+            result.append('interface %s %s' % (option, ports))
+            result.extend(key[1])
+    return result
+
+
+def _port_key(name):
+    # ((slot, ...), port) of an interface name, for ordering and runs
+    numbers = [_port_number(number) for number in name.split('/')]
+    return tuple(numbers[:-1]), numbers[-1]
+
+
+def _port_number(text):
+    if not text.isdigit():
+        raise ValueError('invalid interface %r' % text)
+    return int(text)
+
+
+#####
+# Command builders
+#
+# ENOS lines for the free-form vlanArg*/interfaceArg* parameters that
+# diff_config() cannot compare, sent as they are through push_config().
+#####
+
+# interfaceOption values of the CNOS-derived modules and their ENOS
+# interface types
+INTERFACE_TYPES = {'ethernet': 'port', 'port-aggregation': 'portchannel', 'vlan': 'ip'}
+
+
+def vlan_commands(*args):
+    """Return the ENOS lines for vlanArg1 to vlanArg5, None ones left out.
+
+    A VLAN id or range in the first argument opens that VLAN context and
+    the others give the line to enter in it ("name" "Servers"); anything
+    else is a global "vlan ..." line (vlan dot1q tag native).
+    """
+    args = [str(arg) for arg in args if arg is not None]
+    if not args:
+        return []
+    try:
+        VlanSet(args[0])
+    except ValueError:
+        return [' '.join(['vlan'] + args)]
+    commands = ['vlan %s' % args[0]]
+    rest = args[1:]
+    if rest[:1] == ['name'] and len(rest) > 1:
+        rest = ['name', '"%s"' % ' '.join(rest[1:]).strip('"')]
+    if rest:
+        commands.append(' '.join(rest))
+    commands.append('exit')
+    return commands
+
+
+def interface_commands(option, interfaceRange, *args):
+    """Return the ENOS lines entering the interface context of option
+    ("port", "portchannel", "mgmt", ...) and interfaceRange and entering
+    args there, None ones left out.  With no option interfaceRange names
+    the whole context ("port 17")."""
+    args = [str(arg) for arg in args if arg is not None]
+    if option:
+        context = 'interface %s %s' % (INTERFACE_TYPES.get(option, option), interfaceRange)
+    else:
+        context = 'interface %s' % interfaceRange
+    commands = [context]
+    if args:
+        commands.append(' '.join(args))
+    commands.append('exit')
+    return commands
+
+
+def push_config(module, shell, commands, timeout=None):
+    """Push commands in configure mode as a single batch.
+
+    Returns the responses to commands (see send_batch()).
+    """
+    bump_config_generation(module.params['host'])
+    responses = send_batch(shell, ['configure t'] + list(commands) + ['end'], timeout)
+    return responses[1:-1]
+
+
+def _items(pairs):
+    if isinstance(pairs, dict):
+        return pairs.items()
+    return pairs
+
+
+def _port_list_lines(section, key, names):
+    # Lines turning the interfaces section sets with key into names
+    configured = []
+    prefix = key + ' '
+    for line in section.lines if section is not None else []:
+        if line.startswith(prefix):
+            configured.extend(expand_interfaces(line[len(prefix):]))
+    extra = set(configured) - set(names)
+    missing = set(names) - set(configured)
+    lines = []
+    if extra:
+        lines.append('no %s %s' % (key, ','.join(interface_ranges(extra))))
+    if missing:
+        lines.append('%s %s' % (key, ','.join(interface_ranges(missing))))
+    return lines
+
+
+def _find_key(section, key):
+    # Return the line of section setting key, or None
+    prefix = key + ' '
+    for line in section.lines:
+        if line == key or line.startswith(prefix):
+            return line
+    return None
+
+
+def config_generation(host):
+    return _load_state(_state_path('generation', host)).get('generation', 0)
+
+
+def bump_config_generation(host):
+    """Record that configuration is being pushed to or saved on host,
+    invalidating its cached running-config and command outputs."""
+    _DEVICE_CONFIGS.pop(host, None)
+    path = _state_path('generation', host)
+    lock = _lock_state(path)
+    try:
+        _save_state(path, dict(generation=config_generation(host) + 1))
+    finally:
+        _unlock_state(lock)
+
+
+def _state_path(kind, host):
+    digest = hashlib.sha1(to_bytes(host, errors='surrogate_or_strict')).hexdigest()
+    return os.path.join(STATE_DIR, kind, digest[:20])
+
+
+def _load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save_state(path, data):
+    # Written to a temporary file and renamed so readers never see half
+    # of it; the files may hold configuration, keep them private
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, path)
+    except Exception:
+        _unlink(tmp)
+        raise
+
+
+def _lock_state(path):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    lock = open(path + '.lock', 'w')
+    if HAS_FCNTL:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def _unlock_state(lock):
+    if HAS_FCNTL:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    lock.close()
+
+
+#####
+# Command result cache
+#
+# Playbooks often run the same show commands several times (show version
+# in several roles, show running-config for a backup and again for a
+# check), each costing a login.  With commandCacheTtl the output of
+# read-only commands is kept on the controller, one file per host and
+# command under STATE_DIR, and a task whose commands are all there and
+# younger than the TTL does not log in at all.  Entries are keyed by
+# host, user, command and the change counter of the running-config
+# cache, so a configuration change or save made through the enos_*
+# modules invalidates them.  Each host keeps at most
+# COMMAND_CACHE_ENTRIES entries and COMMAND_CACHE_SIZE bytes, the least
+# recently used going first.
+#####
+
+COMMAND_CACHE_ENTRIES = 64
+COMMAND_CACHE_SIZE = 16 * 1024 * 1024
+# Outputs larger than this (show tech) are not cached
+COMMAND_CACHE_ENTRY_SIZE = 1024 * 1024
+
+
+class CommandCache(object):
+    """Cached outputs of the read-only commands run on params['host'].
+
+    Disabled (get() returns None, put() does nothing) unless
+    params['commandCacheTtl'] is set.  The change counter is read when
+    the cache is made, before anything runs, so an output is never
+    stored under a change made while it was coming in.
+    """
+
+    def __init__(self, params):
+        self.ttl = params.get('commandCacheTtl') or 0
+        self._login = '%s:%s:%s' % (params['host'], params.get('port') or 22, params['username'])
+        self._directory = _state_path('commands', params['host'])
+        self._generation = config_generation(params['host']) if self.ttl > 0 else None
+
+    def enabled(self, commands):
+        return self.ttl > 0 and all(command_mode(command) == 'exec' for command in commands)
+
+    def get(self, commands, timings=None):
+        """Return the outputs of commands when all of them are cached and
+        fresh, or None.  A hit is timed into timings as command_cache."""
+        if not self.enabled(commands):
+            return None
+        started = _now()
+        paths = [self._path(command) for command in commands]
+        outputs = []
+        for path in paths:
+            entry = _load_state(path)
+            if 'output' not in entry or time.time() - entry.get('time', 0) >= self.ttl:
+                return None
+            outputs.append(entry['output'])
+        for path in paths:
+            # Recently used, evicted last
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        if timings is not None:
+            timings.add('command_cache', started)
+        return outputs
+
+    def put(self, commands, outputs):
+        """Store the outputs of commands, skipping those None (see
+        buffer()) or larger than COMMAND_CACHE_ENTRY_SIZE.  Errors are
+        ignored: the cache never fails a task."""
+        if not self.enabled(commands):
+            return
+        try:
+            for command, output in zip(commands, outputs):
+                if output is not None and len(output) <= COMMAND_CACHE_ENTRY_SIZE:
+                    _save_state(self._path(command), dict(command=command, time=time.time(), output=output))
+            self._evict()
+        except EnvironmentError:
+            pass
+
+    def buffer(self):
+        """Return a CacheBuffer to collect the output of a command as it
+        streams in (the copy of an OutputSink), or None when disabled."""
+        if self.ttl <= 0:
+            return None
+        return CacheBuffer(COMMAND_CACHE_ENTRY_SIZE)
+
+    def _path(self, command):
+        key = '%s:%s:%s' % (self._login, self._generation, ' '.join(command.split()))
+        digest = hashlib.sha1(to_bytes(key, errors='surrogate_or_strict')).hexdigest()
+        return os.path.join(self._directory, digest[:20])
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self._directory):
+            try:
+                stat = os.stat(os.path.join(self._directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort(reverse=True)
+        size = 0
+        for index, (used, length, name) in enumerate(entries):
+            size += length
+            if index >= COMMAND_CACHE_ENTRIES or size > COMMAND_CACHE_SIZE:
+                _unlink(os.path.join(self._directory, name))
+
+
+class CacheBuffer(object):
+    """File-like object keeping what is written to it up to limit bytes;
+    value() is the text, or None once more than that came in."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.size = 0
+        self._chunks = []
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size <= self.limit:
+            self._chunks.append(data)
+        else:
+            self._chunks = []
+
+    def value(self):
+        if self.size > self.limit:
+            return None
+        text = to_text(b''.join(self._chunks), errors='surrogate_or_replace')
+        # Without the last line end, as command_output() gives it
+        return text[:-1] if text.endswith('\n') else text
+
+
+#####
+# Adaptive command timeouts
+#
+# One fixed deadline is too short for show tech on a big chassis and far
+# longer than it takes to notice that a small switch stopped answering.
+# Without commandTimeout, each command gets a deadline from the reply
+# times seen before on that switch for its class of command (see
+# command_class()): the larger of TIMEOUT_P99_FACTOR times their p99 and
+# TIMEOUT_EWMA_FACTOR times their moving average, kept within
+# MIN_COMMAND_TIMEOUT and MAX_COMMAND_TIMEOUT.  Until LATENCY_MIN_SAMPLES
+# replies are known, and always for the commands of SLOW_COMMAND_RE that
+# write flash or move files, the deadline is no shorter than
+# DEFAULT_COMMAND_TIMEOUT.  A command timing out counts as a reply after
+# its deadline, so the next deadline is longer.  The last
+# LATENCY_SAMPLES reply times of each class are kept per switch in
+# STATE_DIR, written once when the shell closes.
+#####
+
+LATENCY_SAMPLES = 64
+LATENCY_MIN_SAMPLES = 5
+LATENCY_EWMA_WEIGHT = 0.2
+TIMEOUT_P99_FACTOR = 3
+TIMEOUT_EWMA_FACTOR = 5
+MIN_COMMAND_TIMEOUT = 10
+MAX_COMMAND_TIMEOUT = 900
+
+# Commands whose reply time depends on flash, the network or a reboot
+# rather than on the CLI, and whose deadline is never learnt below
+# DEFAULT_COMMAND_TIMEOUT however fast they were before
+SLOW_COMMAND_RE = re.compile(r'\s*(?:write|wr|copy|save|reload|boot|erase|install|upgrade)\b')
+
+
+def command_class(command):
+    """Return the class the reply times of command are kept under: the
+    first two words of a read-only command ("show interface"), the first
+    word of the others ("vlan", "name", "write")."""
+    words = command.split()
+    if command_mode(command) == 'exec':
+        return ' '.join(words[:2])
+    return ' '.join(words[:1])
+
+
+def command_timeout(shell, command, timeout=None):
+    """Return timeout, or when None the deadline learnt for command on
+    the switch of shell."""
+    if timeout is not None:
+        return timeout
+    if shell.latency is not None:
+        return shell.latency.timeout(command)
+    return DEFAULT_COMMAND_TIMEOUT
+
+
+def _time_left(deadline, timeout=None):
+    # timeout cut down to the seconds left until deadline (a _now()
+    # reading), timeout itself without one
+    if deadline is None:
+        return timeout
+    left = deadline - _now()
+    if left <= 0:
+        raise EnosTimeoutError('timed out before the switch was done')
+    return left if timeout is None else min(timeout, left)
+
+
+def _replied(shell, command, started, finished=None):
+    # command got its reply (or timed out) between started and finished,
+    # _now() readings
+    if finished is None:
+        finished = _now()
+    if shell.timings is not None:
+        shell.timings.command(command, started, finished)
+    if shell.latency is not None:
+        shell.latency.observe(command, finished - started)
+
+
+class LatencyModel(object):
+    """Reply times of the commands run on one switch, by command class."""
+
+    def __init__(self, login):
+        self._path = _state_path('latency', login)
+        self.classes = _load_state(self._path)
+        self._new = []
+
+    def timeout(self, command):
+        stats = self.classes.get(command_class(command))
+        if not stats:
+            return DEFAULT_COMMAND_TIMEOUT
+        samples = sorted(stats['samples'])
+        p99 = samples[int(math.ceil(0.99 * len(samples))) - 1]
+        timeout = max(TIMEOUT_P99_FACTOR * p99, TIMEOUT_EWMA_FACTOR * stats['ewma'], MIN_COMMAND_TIMEOUT)
+        if stats['count'] < LATENCY_MIN_SAMPLES or SLOW_COMMAND_RE.match(command):
+            # Too few replies to shorten the deadline on, enough to know
+            # it is too short
+            timeout = max(timeout, DEFAULT_COMMAND_TIMEOUT)
+        return min(MAX_COMMAND_TIMEOUT, round(timeout, 3))
+
+    def observe(self, command, seconds):
+        self._new.append((command_class(command), seconds))
+        _add_sample(self.classes, self._new[-1][0], seconds)
+
+    def save(self):
+        """Merge the reply times observed into those on disk, which other
+        tasks may have added to meanwhile.  Errors are ignored."""
+        if not self._new:
+            return
+        new, self._new = self._new, []
+        try:
+            lock = _lock_state(self._path)
+            try:
+                classes = _load_state(self._path)
+                for name, seconds in new:
+                    _add_sample(classes, name, seconds)
+                _save_state(self._path, classes)
+            finally:
+                _unlock_state(lock)
+        except EnvironmentError:
+            pass
+
+
+def _add_sample(classes, name, seconds):
+    stats = classes.setdefault(name, dict(count=0, ewma=seconds, samples=[]))
+    stats['count'] += 1
+    stats['ewma'] += LATENCY_EWMA_WEIGHT * (seconds - stats['ewma'])
+    stats['samples'] = (stats['samples'] + [round(seconds, 6)])[-LATENCY_SAMPLES:]
+
+
+#####
+# Task timings
+#
+# get_shell() hangs a Timings on the shell; the reader adds the time spent
+# logging in, entering enable mode, waiting for each command's reply and
+# writing the output file.  The modules return it as "timings" and, when
+# metricsSink is set, it is also sent to a statsd server
+# ("udp://host:8125") or appended to a JSON-lines file.  Without a sink it
+# costs a clock read per command.
+#####
+
+class Timings(object):
+    """Monotonic durations of the phases of a task, in seconds."""
+
+    def __init__(self):
+        self.started = _now()
+        self.phases = {}
+        self.commands = []
+
+    def add(self, phase, started, finished=None):
+        """Add the time from started to finished (_now() readings, finished
+        defaulting to now) to phase."""
+        if finished is None:
+            finished = _now()
+        self.phases[phase] = self.phases.get(phase, 0.0) + finished - started
+
+    def merge(self, phases):
+        """Add phases, a dict of durations in seconds measured elsewhere
+        (by a persistent session broker)."""
+        for phase, seconds in phases.items():
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def command(self, command, started, finished=None):
+        if finished is None:
+            finished = _now()
+        self.commands.append((command, finished - started))
+
+    def result(self):
+        result = dict((phase, round(seconds, 6)) for phase, seconds in self.phases.items())
+        result['commands'] = [dict(command=command, seconds=round(seconds, 6))
+                              for command, seconds in self.commands]
+        result['total'] = round(_now() - self.started, 6)
+        return result
+
+
+def emit_timings(sink, name, host, timings, failed=False):
+    """Send the result() of a Timings to sink, a "udp://host:port" statsd
+    server or a JSON-lines file path.  Errors are ignored: metrics never
+    fail a task."""
+    try:
+        if sink.startswith('udp://'):
+            address, _, port = sink[len('udp://'):].rpartition(':')
+            prefix = 'enos.%s.%s' % (name, re.sub(r'[^\w\-]', '_', host))
+            lines = ['%s.%s:%.3f|ms' % (prefix, phase, seconds * 1000)
+                     for phase, seconds in timings.items() if phase != 'commands']
+            lines.append('%s.%s:1|c' % (prefix, 'failed' if failed else 'ok'))
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.sendto(to_bytes('\n'.join(lines)), (address or 'localhost', int(port or 8125)))
+            finally:
+                sock.close()
+        else:
+            record = dict(time=time.time(), module=name, host=host, failed=failed, timings=timings)
+            with open(os.path.expanduser(sink), 'a') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+    except (EnvironmentError, ValueError, socket.error):
+        pass
+
+
+def report_timings(module, timings):
+    """Add timings to whatever module exits with, and send them to
+    metricsSink.  get_shell() does this, call it once per task."""
+    exit_json, fail_json = module.exit_json, module.fail_json
+    name = getattr(module, '_name', None) or 'enos'
+
+    def report(method, failed):
+        def wrapper(**kwargs):
+            kwargs.setdefault('timings', timings.result())
+            sink = module.params.get('metricsSink')
+            if sink:
+                emit_timings(sink, name, module.params['host'], kwargs['timings'], failed)
+            method(**kwargs)
+        return wrapper
+
+    module.exit_json = report(exit_json, False)
+    module.fail_json = report(fail_json, True)
+
+
+#####
+# Persistent shell pool
+#
+# Logging in to a switch (TCP connect, key exchange, authentication and
+# invoke_shell) costs far more than running a short command.  Rather than
+# throwing the shell away when a module exits, a small broker process is
+# forked that owns the paramiko session and relays bytes between its CLI
+# channels and a Unix socket.  Later tasks against the same (host, user)
+# attach to that socket and get an already authenticated shell, each
+# attached socket being given a channel of its own: an idle one, or a new
+# one on the same transport while there are fewer than MAX_CHANNELS.  The
+# broker exits on its own once nobody has attached for persistTimeout
+# seconds, or as soon as the switch drops the session.
+#####
+
+PERSIST_DIR = os.path.expanduser(os.environ.get('ANSIBLE_ENOS_PERSIST_DIR', '~/.ansible/pc'))
+DEFAULT_PERSIST_TIMEOUT = 30
+CONNECT_TIMEOUT = 30
+PROBE_TIMEOUT = 5
+
+
+class Shell(object):
+    """Interactive CLI channel handed to the modules.
+
+    Wraps either a paramiko channel or the Unix socket of a persistent
+    broker, so both look alike to the callers (send/recv/settimeout).
+    Everything received is also written to sink, when one is set (see
+    open_output()).
+    """
+
+    def __init__(self, channel, client=None, reused=False, path=None):
+        self._channel = channel
+        self._client = client
+        self._path = path
+        self.reused = reused
+        # "host:port:username", what bootstrap() learns is kept under
+        self.login = None
+        self.latency = None
+        self.sink = None
+        self.timings = None
+
+    def fileno(self):
+        return self._channel.fileno()
+
+    def settimeout(self, timeout):
+        self._channel.settimeout(timeout)
+
+    def send(self, data):
+        data = to_bytes(data)
+        self._channel.sendall(data)
+        return len(data)
+
+    def recv(self, nbytes):
+        data = self._channel.recv(nbytes)
+        if self.sink is not None and data:
+            if self.timings is not None:
+                started = _now()
+                self.sink.write(data)
+                self.timings.add('file_write', started)
+            else:
+                self.sink.write(data)
+        return data
+
+    def close(self):
+        self._channel.close()
+        if self._client is not None:
+            self._client.close()
+        if self.latency is not None:
+            self.latency.save()
+
+    def open_channel(self):
+        """Return a Shell on another CLI channel of this login, at the
+        user exec prompt.  Closing it leaves this one open."""
+        try:
+            if self._path is not None:
+                sock = _connect_socket(self._path)
+                if sock is None:
+                    raise EnosError('the persistent connection broker went away')
+                shell = Shell(sock, reused=True, path=self._path)
+                if not _reset_shell(shell):
+                    shell.close()
+                    raise EnosError('no free channel on the persistent session')
+            elif self._client is not None:
+                shell = Shell(self._client.invoke_shell())
+                _read(shell, CONNECT_TIMEOUT)
+            else:
+                raise EnosError('only the first channel of a session opens others')
+            shell.login = self.login
+            shell.latency = self.latency
+        except EnosError:
+            raise
+        except Exception as e:
+            raise EnosError('Unable to open another channel: %s' % to_text(e))
+        return shell
+
+
+def get_shell(module):
+    """Return a Shell logged in to module.params['host'], sitting at a prompt.
+
+    A live persistent session is reused when one exists, otherwise a new
+    one is started.  A session that does not answer (switch rebooted,
+    idle-timed out, broker killed) is discarded and rebuilt transparently.
+    From here on the module exits with the timings of the task.
+    """
+    timings = Timings()
+    report_timings(module, timings)
+    try:
+        return open_shell(module.params, timings)
+    except EnosError as e:
+        module.fail_json(msg=str(e))
+
+
+def open_shell(params, timings=None, deadline=None):
+    """Like get_shell() but takes the connection parameters as a dict and
+    raises EnosError instead of failing a module.  The login is added to
+    timings, which the shell then carries.  With deadline (a _now()
+    reading), each step of the login waits at most until then rather than
+    CONNECT_TIMEOUT."""
+    ttl = params.get('persistTimeout')
+    if ttl is None:
+        ttl = DEFAULT_PERSIST_TIMEOUT
+
+    try:
+        if ttl > 0 and HAS_FCNTL:
+            shell = _attach_persistent(params, ttl, timings, deadline)
+        else:
+            shell = _open_direct(params, timings, deadline)
+        shell.timings = timings
+        shell.login = '%s:%s:%s' % (params['host'], params.get('port') or 22, params['username'])
+        shell.latency = LatencyModel('%s:%s' % (params['host'], params.get('port') or 22))
+        return shell
+    except EnosError:
+        raise
+    except Exception as e:
+        raise EnosError('Unable to open a session to %s: %s' % (params['host'], to_text(e)))
+
+
+def _paramiko():
+    global paramiko
+    if paramiko is None:
+        try:
+            import paramiko as module
+        except ImportError:
+            raise EnosError('paramiko is required for this module')
+        paramiko = module
+    return paramiko
+
+
+def _ssh_connect(params, timings=None, deadline=None):
+    _paramiko()
+    client = paramiko.SSHClient()
+
+    # Automatically add untrusted hosts (make sure okay for security policy in your environment)
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+    # The TCP connect is made here so that it is timed apart from the key
+    # exchange and authentication
+    started = _now()
+    sock = socket.create_connection((params['host'], params.get('port') or 22), _time_left(deadline, CONNECT_TIMEOUT))
+    if timings is not None:
+        timings.add('tcp_connect', started)
+        started = _now()
+    try:
+        timeout = _time_left(deadline, CONNECT_TIMEOUT)
+        client.connect(params['host'], port=params.get('port') or 22,
+                       username=params['username'], password=params['password'],
+                       look_for_keys=False, timeout=timeout, banner_timeout=timeout, auth_timeout=timeout, sock=sock)
+    except Exception:
+        client.close()
+        sock.close()
+        raise
+    if timings is not None:
+        timings.add('ssh_auth', started)
+    return client
+
+
+def _open_direct(params, timings=None, deadline=None):
+    client = _ssh_connect(params, timings, deadline)
+    started = _now()
+
+    # Use invoke_shell to establish an 'interactive session'
+    shell = Shell(client.invoke_shell(), client)
+    _read(shell, _time_left(deadline, CONNECT_TIMEOUT))
+    if timings is not None:
+        timings.add('invoke_shell', started)
+    return shell
+
+
+def _socket_path(params):
+    key = '%s:%s:%s' % (params['host'], params.get('port') or 22, params['username'])
+    digest = hashlib.sha1(to_bytes(key, errors='surrogate_or_strict')).hexdigest()
+    return os.path.join(PERSIST_DIR, 'enos-%s' % digest[:20])
+
+
+def _credential(params):
+    # Stands for the password a session was opened with, kept beside its
+    # socket so that a changed password never attaches to it: an HMAC
+    # under a random key of this user's, so nothing on disk can be
+    # checked against guessed passwords without that key
+    return hmac.new(_persist_key(), to_bytes(params['password'], errors='surrogate_or_strict'),
+                    hashlib.sha256).hexdigest()
+
+
+def _persist_key():
+    path = os.path.join(STATE_DIR, 'persist.key')
+    try:
+        with open(path, 'rb') as f:
+            key = f.read()
+        if key:
+            return key
+    except (IOError, OSError):
+        pass
+    # Written in full to a private file, then linked into place: of two
+    # tasks creating it at once, one link fails and takes the other's key
+    if not os.path.isdir(STATE_DIR):
+        os.makedirs(STATE_DIR, 0o700)
+    fd, tmp = tempfile.mkstemp(dir=STATE_DIR)
+    try:
+        os.write(fd, os.urandom(32))
+        os.close(fd)
+        try:
+            os.link(tmp, path)
+        except OSError:
+            pass
+    finally:
+        _unlink(tmp)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _attach_persistent(params, ttl, timings=None, deadline=None):
+    path = _socket_path(params)
+    credential = _credential(params)
+    # Serialise attach/spawn so concurrent tasks never start two brokers
+    lock = _lock_state(path)
+    try:
+        started = _now()
+        sock = None
+        known = _load_state(path + '.auth').get('credential', '')
+        if hmac.compare_digest(to_bytes(known), to_bytes(credential)):
+            sock = _connect_socket(path)
+        if sock is not None:
+            shell = Shell(sock, reused=True, path=path)
+            if _reset_shell(shell):
+                if timings is not None:
+                    timings.add('attach', started)
+                return shell
+            shell.close()
+
+        # No broker, a stale one or one logged in with another password:
+        # start a fresh session, the one it replaces idles out unreached
+        _unlink(path)
+        started = _now()
+        phases = _spawn_broker(params, path, ttl, deadline)
+        sock = _connect_socket(path)
+        if sock is None:
+            raise EnosError('persistent connection broker did not start')
+        _save_state(path + '.auth', dict(credential=credential))
+        if timings is not None:
+            # The login as timed by the broker, the rest is its start
+            timings.merge(phases)
+            timings.add('broker_spawn', started + sum(phases.values()))
+        # The broker has read the login banner, the channel sits at the
+        # first prompt
+        return Shell(sock, path=path)
+    finally:
+        _unlock_state(lock)
+
+
+def _connect_socket(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _reset_shell(shell):
+    # Make sure a reused shell answers and bring it back to the user exec
+    # prompt a freshly logged in session starts from
+    try:
+        shell.send('\n')
+        match = _read(shell, PROBE_TIMEOUT)[1]
+        if match.group(1):
+            shell.send('end\n')
+            match = _read(shell, PROBE_TIMEOUT)[1]
+        if match.group(2) == b'#':
+            shell.send('disable\n')
+            match = _read(shell, PROBE_TIMEOUT)[1]
+    except (EnosError, socket.error):
+        return False
+    return match.group(2) == b'>'
+
+
+def _spawn_broker(params, path, ttl, deadline=None):
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # Detach from the module process and fork again so the broker is
+        # re-parented to init and never left behind as a zombie
+        os.close(rfd)
+        os.setsid()
+        if os.fork() != 0:
+            os._exit(0)
+        try:
+            _redirect_stdio()
+            # deadline reads the same clock in the forked broker
+            _run_broker(params, path, ttl, wfd, deadline)
+        except Exception as e:
+            _notify(wfd, 'error: %s' % e)
+        os._exit(0)
+
+    os.close(wfd)
+    os.waitpid(pid, 0)
+    try:
+        status = b''
+        due = _now() + _time_left(deadline, CONNECT_TIMEOUT + PROBE_TIMEOUT)
+        while not status.endswith(b'\n'):
+            remaining = due - _now()
+            if remaining <= 0 or not select.select([rfd], [], [], remaining)[0]:
+                raise EnosError('timed out waiting for persistent connection broker')
+            data = os.read(rfd, 1024)
+            if not data:
+                break
+            status += data
+    finally:
+        os.close(rfd)
+
+    # "ok" followed by the timings of the login as JSON, or the error
+    status = to_text(status).strip()
+    if status.split(' ', 1)[0] != 'ok':
+        raise EnosError(status or 'persistent connection broker exited')
+    return json.loads(status[len('ok'):] or '{}')
+
+
+def _redirect_stdio():
+    # Ansible waits for the module's stdout to close; the broker must not
+    # hold it open
+    devnull = os.open(os.devnull, os.O_RDWR)
+    for fd in (0, 1, 2):
+        os.dup2(devnull, fd)
+    os.close(devnull)
+
+
+def _notify(fd, msg):
+    try:
+        os.write(fd, to_bytes(msg + '\n'))
+        os.close(fd)
+    except OSError:
+        pass
+
+
+def _run_broker(params, path, ttl, notify_fd, deadline=None):
+    timings = Timings()
+    client = _ssh_connect(params, timings, deadline)
+    started = _now()
+    idle = [_broker_channel(client, _time_left(deadline, CONNECT_TIMEOUT))]
+    timings.add('invoke_shell', started)
+    opened = 1
+    limit = MAX_CHANNELS
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    os.chmod(path, 0o600)
+    inode = os.stat(path).st_ino
+    listener.listen(MAX_CHANNELS)
+    _notify(notify_fd, 'ok %s' % json.dumps(timings.phases))
+
+    # Attached sockets and their channels, both ways round, and sockets
+    # waiting for a channel to come free.  What a waiting socket sends is
+    # relayed once it has a channel; one that gave up by then detaches.
+    peers = {}
+    waiting = []
+    try:
+        while client.get_transport().is_active():
+            ready = select.select([listener] + idle + list(peers), [], [], None if peers else ttl)[0]
+            if not ready:
+                # Idle for ttl seconds
+                break
+            for end in ready:
+                if end is listener:
+                    waiting.append(listener.accept()[0])
+                elif end in idle:
+                    # Unsolicited output between attaches is dropped, an
+                    # empty read means the switch closed the channel
+                    if not end.recv(65535):
+                        idle.remove(end)
+                        end.close()
+                        opened -= 1
+                elif end in peers:
+                    if not _relay(end, peers, idle):
+                        opened -= 1
+            while waiting and (idle or opened < limit):
+                if idle:
+                    channel = idle.pop()
+                else:
+                    try:
+                        channel = _broker_channel(client)
+                    except Exception:
+                        # The switch takes no more channels
+                        limit = opened
+                        continue
+                    opened += 1
+                conn = waiting.pop(0)
+                peers[conn] = channel
+                peers[channel] = conn
+    finally:
+        listener.close()
+        for conn in waiting:
+            conn.close()
+        # A broker started after this one was given up on owns path now
+        try:
+            if os.stat(path).st_ino == inode:
+                _unlink(path)
+                _unlink(path + '.auth')
+        except OSError:
+            pass
+        client.close()
+
+
+def _broker_channel(client, timeout=CONNECT_TIMEOUT):
+    # A new CLI channel, its login banner read up to the first prompt
+    channel = client.invoke_shell()
+    _read(channel, timeout)
+    return channel
+
+
+def _relay(end, peers, idle):
+    # Pass on what end, an attached socket or its channel, has received.
+    # A socket detaching hands its channel back to idle; returns False
+    # when the switch closed the channel
+    other = peers[end]
+    if isinstance(end, socket.socket):
+        conn, channel = end, other
+        try:
+            data = conn.recv(65535)
+        except socket.error:
+            data = b''
+        if data:
+            channel.sendall(data)
+            return True
+    else:
+        conn, channel = other, end
+        data = channel.recv(65535)
+        if not data:
+            del peers[conn], peers[channel]
+            conn.close()
+            channel.close()
+            return False
+        try:
+            conn.sendall(data)
+            return True
+        except socket.error:
+            pass
+    del peers[conn], peers[channel]
+    conn.close()
+    idle.append(channel)
+    return True
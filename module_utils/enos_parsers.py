@@ -0,0 +1,229 @@
+# This code is part of Ansible, but is an independent component.
+# This particular file snippet, and this file snippet only, is BSD licensed.
+# Modules you write using this snippet, which is embedded dynamically by Ansible
+# still belong to the author of the module, and may assign their own license
+# to the complete work.
+#
+# Copyright (c) 2016 Ken Corkins, <kcorkins@lenovo.com>
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#    * Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+#####
+# Parsers for ENOS show commands
+#
+# Each parser takes the output one line at a time (feed()) and hands back
+# rows as tuples, in the order of its fields, as soon as they are
+# complete; close() returns the last one.  The output is read once, line
+# by line, so the parsers work the same on a string already received and
+# on a reply still streaming in (see enos.OutputParser).
+#
+# ENOS prints its tables as columns lined up under a ruler of dashes, the
+# header just above it:
+#
+#   VLAN                Name                Status            Ports
+#   ----  --------------------------------  ------  -------------------------
+#   1     Default VLAN                      ena     1-64
+#
+# The ruler gives the column boundaries, so values holding spaces (VLAN
+# names, descriptions) and empty cells are read right.
+#####
+
+import re
+
+
+class TableParser(object):
+    """Parser for the first ruler-delimited table of an output.
+
+    fields names the columns, a tuple of names standing for one column
+    holding several whitespace separated values ("Flow Ctrl" TX and RX).
+    When the switch prints a different number of columns the names are
+    taken from its header instead.  Lines whose first column is empty
+    continue the value of column merge of the row above (port lists
+    wrapped over several lines).
+    """
+
+    def __init__(self, fields=None, merge=None):
+        self._wanted = fields
+        self._merge = merge
+        self.fields = None
+        self._previous = None
+        self._bounds = None
+        self._split = None
+        self._pending = None
+        self._done = False
+
+    def feed(self, line):
+        if self._done:
+            return None
+        if self._bounds is None:
+            self._find_table(line)
+            return None
+        if not line.strip() or _is_ruler(line):
+            self._done = True
+            return self.close()
+
+        values = [line[start:end].strip(' |') for start, end in self._bounds]
+        if not values[0] and self._merge is not None and self._pending is not None:
+            more = values[self._merge]
+            if more:
+                row = list(self._pending)
+                row[self._merge] = ('%s %s' % (row[self._merge], more)).strip()
+                self._pending = tuple(row)
+            return None
+        row, self._pending = self._pending, self._row(values)
+        return row
+
+    def close(self):
+        row, self._pending = self._pending, None
+        return row
+
+    def _find_table(self, line):
+        previous, self._previous = self._previous, line
+        if not _is_ruler(line) or not previous or not previous.strip() or _is_ruler(previous):
+            return
+        spans = [match.span() for match in re.finditer(r'[^\s|]+', line)]
+        # Each column runs to halfway into the gap before the next one
+        bounds = []
+        for index, (start, end) in enumerate(spans):
+            left = 0 if index == 0 else bounds[-1][1]
+            right = None if index == len(spans) - 1 else (end + spans[index + 1][0] + 1) // 2
+            bounds.append((left, right))
+
+        if self._wanted is not None and len(self._wanted) == len(bounds):
+            names = self._wanted
+        else:
+            names = [_field_name(previous[start:end]) or 'column%d' % index
+                     for index, (start, end) in enumerate(bounds)]
+        self._split = [len(name) if isinstance(name, tuple) else 0 for name in names]
+        self.fields = []
+        for name in names:
+            self.fields.extend(name if isinstance(name, tuple) else (name,))
+        self._bounds = bounds
+
+    def _row(self, values):
+        if not any(self._split):
+            return tuple(values)
+        row = []
+        for value, count in zip(values, self._split):
+            if count:
+                parts = value.split(None, count - 1)
+                row.extend(parts + [''] * (count - len(parts)))
+            else:
+                row.append(value)
+        return tuple(row)
+
+
+class PatternParser(object):
+    """Parser for "key: value" style outputs such as show version,
+    returning one row made of the first match of each pattern."""
+
+    def __init__(self, patterns):
+        self.fields = [name for name, pattern in patterns]
+        self._patterns = [(index, re.compile(pattern)) for index, (name, pattern) in enumerate(patterns)]
+        self._values = [None] * len(patterns)
+
+    def feed(self, line):
+        for index, pattern in self._patterns:
+            if self._values[index] is None:
+                match = pattern.match(line)
+                if match:
+                    self._values[index] = match.group(1).strip()
+        return None
+
+    def close(self):
+        values, self._values = self._values, [None] * len(self._values)
+        return tuple(values)
+
+
+VERSION_PATTERNS = [
+    ('model', r'\s*((?:Lenovo|IBM)\s.*(?:Switch|Flex System).*)$'),
+    ('software_version', r'\s*Software Version\s+(\S+)'),
+    ('image', r'\s*Software Version\s+\S+\s+\((?:FLASH\s+)?([^)]+)\)'),
+    ('uptime', r'\s*Switch has been up for\s+(.+?)\.?\s*$'),
+    ('last_boot', r'\s*Last boot:\s*(.+)$'),
+    ('mac_address', r'\s*MAC address:\s*(\S+)'),
+    ('serial_number', r'\s*(?:Switch\s+)?Serial No:\s*(\S+)'),
+    ('part_number', r'\s*Hardware Part No:\s*(\S+)'),
+    ('hardware_revision', r'\s*Hardware Revision:\s*(\S+)'),
+    ('mtm', r'\s*MTM Value:\s*(\S+)'),
+]
+
+VLAN_FIELDS = ['vlan_id', 'name', 'status', 'ports']
+INTERFACE_STATUS_FIELDS = ['alias', 'port', 'speed', 'duplex', ('flow_control_tx', 'flow_control_rx'),
+                           'link', 'description']
+LLDP_FIELDS = ['local_port', 'index', 'remote_chassis_id', 'remote_port', 'remote_system_name', 'dmac']
+MAC_FIELDS = ['mac_address', 'vlan', 'port', 'trunk', 'state', 'permanent', 'openflow']
+ARP_FIELDS = ['ip_address', 'flags', 'mac_address', 'vlan', 'age', 'port']
+
+# "show" as the CLI takes it ("sh", "sho"); enos.EXEC_COMMAND_RE is built
+# on it too, so every command parsed here is also run as read-only
+SHOW_PATTERN = r'sh(?:ow?)?'
+
+# (command pattern, parser factory), first match wins
+PARSERS = [
+    (r'\s+vlan\s*$', lambda: TableParser(VLAN_FIELDS, merge=3)),
+    (r'\s+int(?:erface)?\s+status\b', lambda: TableParser(INTERFACE_STATUS_FIELDS)),
+    (r'\s+lldp\s+remote-device\s*$', lambda: TableParser(LLDP_FIELDS)),
+    (r'\s+mac-address-table\b', lambda: TableParser(MAC_FIELDS)),
+    (r'\s+(?:ip\s+)?arp\s*$', lambda: TableParser(ARP_FIELDS)),
+    (r'\s+ver(?:sion)?\s*$', lambda: PatternParser(VERSION_PATTERNS)),
+]
+PARSERS = [(re.compile(r'\s*' + SHOW_PATTERN + pattern), factory) for pattern, factory in PARSERS]
+
+
+def get_parser(command):
+    """Return a new parser for the output of command, or None."""
+    for pattern, factory in PARSERS:
+        if pattern.match(command):
+            return factory()
+    return None
+
+
+def parse_output(command, text):
+    """Parse the output of command into a list of dicts, or return None
+    when there is no parser for it."""
+    parser = get_parser(command)
+    if parser is None:
+        return None
+    rows = []
+    for line in text.splitlines():
+        row = parser.feed(line)
+        if row is not None:
+            rows.append(row)
+    return rows_to_dicts(parser, rows, parser.close())
+
+
+def rows_to_dicts(parser, rows, last=None):
+    if last is not None:
+        rows.append(last)
+    fields = parser.fields or []
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def _is_ruler(line):
+    # A line of dashes, possibly split by spaces or "|" and with a few
+    # letters in it ("--TX-----RX--")
+    stripped = line.strip()
+    return stripped.count('-') >= 3 and stripped.count('-') * 2 > len(stripped.replace(' ', ''))
+
+
+def _field_name(text):
+    return re.sub(r'[^a-z0-9]+', '_', text.strip(' |').lower()).strip('_')
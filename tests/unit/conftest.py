@@ -0,0 +1,56 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Serve module_utils/ as ansible.module_utils, as Ansible does for the
+# modules of this repository, so the tests import enos and enos_parsers
+# the way the modules do, and share a running-config captured from
+# benchmarks.simulator, which the tests driving a session import.
+#
+import os
+import sys
+
+import ansible.module_utils
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ansible.module_utils.__path__.append(os.path.join(ROOT, 'module_utils'))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# show running-config of benchmarks.simulator after
+#   vlan 11 / name "servers" / member 1/1-1/4
+#   interface port 1/5-1/6 / mtu 9000 / description "uplink"
+RUNNING_CONFIG = (
+    'version "8.4.8"\r\n'
+    'switch-type "Lenovo RackSwitch G8272"\r\n'
+    '!\r\n'
+    'hostname "G8272"\r\n'
+    '!\r\n'
+    '!\r\n'
+    'vlan 1\r\n'
+    '\tname "Default VLAN"\r\n'
+    '\texit\r\n'
+    '!\r\n'
+    'vlan 11\r\n'
+    '\tname "servers"\r\n'
+    '\tmember 1/1,1/2,1/3,1/4\r\n'
+    '\texit\r\n'
+    '!\r\n'
+    'interface port 1/5\r\n'
+    '\tmtu 9000\r\n'
+    '\tdescription "uplink"\r\n'
+    '\texit\r\n'
+    '!\r\n'
+    'interface port 1/6\r\n'
+    '\tmtu 9000\r\n'
+    '\tdescription "uplink"\r\n'
+    '\texit\r\n'
+)
+
+
+@pytest.fixture
+def config():
+    """RUNNING_CONFIG as a ConfigTree."""
+    from ansible.module_utils import enos
+    return enos.parse_config(RUNNING_CONFIG)
@@ -0,0 +1,84 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Unit tests of send_batch() of module_utils/enos.py, pipelining commands
+# to benchmarks.simulator over SSH
+#
+import pytest
+
+from ansible.module_utils import enos
+
+pytest.importorskip('paramiko')
+
+from benchmarks.simulator import Simulator  # noqa: E402
+
+
+@pytest.fixture
+def sim(tmp_path, monkeypatch):
+    monkeypatch.setattr(enos, 'STATE_DIR', str(tmp_path))
+    with Simulator(errors=['interface port 9/9', 'name "bad"']) as sim:
+        yield sim
+
+
+@pytest.fixture
+def shell(sim):
+    shell = enos.open_shell(dict(host=sim.host, port=sim.port, username=sim.username, password=sim.password,
+                                 persistTimeout=0))
+    enos.bootstrap(shell, None, timeout=10)
+    del sim.commands[:]
+    yield shell
+    shell.close()
+
+
+def test_replies_split_at_prompt_and_echo(shell):
+    commands = ['show version', '  show vlan', 'show interface status', 'show version']
+    responses = enos.send_batch(shell, commands, timeout=10, window=3)
+    assert len(responses) == len(commands)
+    for command, response in zip(commands, responses):
+        assert response.startswith(command.strip() + '\r\n')
+        assert response.endswith('G8272#')
+        assert response.count('G8272#') == 1
+    assert 'Lenovo RackSwitch G8272' in enos.command_output(responses[0])
+    assert 'Default VLAN' in enos.command_output(responses[1])
+    assert responses[0] == responses[3]
+
+
+def test_config_block_runs_in_its_contexts(shell, sim):
+    commands = ['configure t', 'vlan 11', 'name "servers"', 'exit',
+                'interface port 1/5', 'mtu 9000', 'description "uplink"', 'exit', 'end']
+    responses = enos.send_batch(shell, commands, timeout=10)
+    assert [response.splitlines()[0] for response in responses] == commands
+    assert responses[1].endswith('G8272(config-vlan)#')
+    assert responses[5].endswith('G8272(config-if)#')
+    assert responses[-1].endswith('G8272#')
+    assert sim.commands == commands
+    assert 'mtu 9000' in enos.send_command(shell, 'show running-config', timeout=10)
+
+
+def test_rejected_context_line_is_a_barrier(shell, sim):
+    commands = ['configure t', 'interface port 9/9', 'mtu 9000', 'exit', 'vlan 12', 'end']
+    with pytest.raises(enos.EnosCommandError) as error:
+        enos.send_batch(shell, commands, timeout=10)
+    assert error.value.command == 'interface port 9/9'
+    assert error.value.error == "% Invalid input detected at '^' marker."
+    # Nothing follows a context line until its reply is in
+    assert error.value.after == []
+    assert sim.commands == ['configure t', 'interface port 9/9']
+
+
+def test_rejection_stops_the_batch(shell, sim):
+    commands = ['configure t', 'vlan 11', 'name "bad"', 'shutdown', 'exit', 'vlan 12', 'exit', 'end']
+    with pytest.raises(enos.EnosCommandError) as error:
+        enos.send_batch(shell, commands, timeout=10)
+    assert error.value.command == 'name "bad"'
+    # The lines in flight with the rejected one ran; the next context did not
+    assert error.value.after == ['shutdown']
+    assert [response.splitlines()[0] for response in error.value.responses] == commands[:4]
+    assert sim.commands == commands[:4]
+
+
+def test_unchecked_batch_runs_through(shell, sim):
+    commands = ['configure t', 'interface port 9/9', 'exit', 'vlan 12', 'end']
+    responses = enos.send_batch(shell, commands, timeout=10, check=False)
+    assert enos.find_error(responses[1], commands[1])
+    assert sim.commands == commands
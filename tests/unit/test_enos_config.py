@@ -0,0 +1,62 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Unit tests of the running-config tree of module_utils/enos.py
+#
+from ansible.module_utils import enos
+
+# Sections nested two levels deep
+NESTED_CONFIG = '''\
+interface ip 1
+    ip address 10.0.0.1 255.255.255.0
+    enable
+    exit
+!
+router ospf
+    enable
+    area 0 enable
+    interface ip 1
+        enable
+        ip ospf cost  10
+        exit
+    exit
+!
+'''
+
+
+def test_sections_in_config_order(config):
+    assert config.order == ['version "8.4.8"', 'switch-type "Lenovo RackSwitch G8272"', 'hostname "G8272"',
+                            'vlan 1', 'vlan 11', 'interface port 1/5', 'interface port 1/6']
+    assert sorted(config.vlans) == [1, 11]
+    assert sorted(config.interfaces) == ['port 1/5', 'port 1/6']
+
+
+def test_section_lines_skip_exit_and_separators(config):
+    section = config.vlan(11)
+    assert section.lines == ['name "servers"', 'member 1/1,1/2,1/3,1/4']
+    assert config.interface('port 1/5').lines == ['mtu 9000', 'description "uplink"']
+
+
+def test_lookups_normalize_whitespace(config):
+    assert 'interface  port 1/5' in config
+    assert config.section(' vlan   11') is config.vlan('11')
+    assert 'mtu   9000' in config.interface('port   1/6')
+    assert config.has('interface port 1/5', ['mtu 9000', 'description "uplink"'])
+    assert not config.has('interface port 1/5', ['mtu 1500'])
+    assert not config.has('interface port 1/7', [])
+
+
+def test_vlan_ids(config):
+    assert config.vlan_ids() == enos.VlanSet([1, 11])
+
+
+def test_nested_sections():
+    config = enos.parse_config(NESTED_CONFIG)
+    assert config.order == ['interface ip 1', 'router ospf']
+    ospf = config.section('router ospf')
+    assert ospf.lines == ['enable', 'area 0 enable', 'interface ip 1']
+    child = ospf.children['interface ip 1']
+    assert child.lines == ['enable', 'ip ospf cost 10']
+    # The top level "interface ip 1" is a section of its own
+    assert config.interface('ip 1').lines == ['ip address 10.0.0.1 255.255.255.0', 'enable']
+    assert config.interface('ip 1') != child
@@ -0,0 +1,37 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Unit tests of diff_config() of module_utils/enos.py, against the running-config
+# captured in conftest.py
+#
+from ansible.module_utils import enos
+
+
+def test_diff_nothing_when_present(config):
+    assert enos.diff_config([('vlan 11', {'name': '"servers"'})], config) == []
+    assert enos.diff_config({'interface port 1/5': {'mtu': '9000'}}, config) == []
+
+
+def test_diff_replaces_changed_value(config):
+    assert enos.diff_config([('vlan 11', {'name': '"web"'})], config) == ['vlan 11', 'name "web"', 'exit']
+
+
+def test_diff_creates_and_removes(config):
+    want = [('vlan 1', None), ('vlan 12', {}), ('vlan 13', {'name': '"db"'}), ('vlan 14', None)]
+    # Removals come last, VLAN 14 is not there to remove
+    assert enos.diff_config(want, config) == ['vlan 12', 'exit', 'vlan 13', 'name "db"', 'exit', 'no vlan 1']
+
+
+def test_diff_flags(config):
+    want = [('interface port 1/5', {'shutdown': True, 'description': None, 'mtu': False})]
+    assert enos.diff_config(want, config) == ['interface port 1/5', 'shutdown', 'no description', 'no mtu', 'exit']
+    assert enos.diff_config([('interface port 1/6', {'shutdown': None})], config) == []
+
+
+def test_diff_member_ports(config):
+    members = enos.expand_interfaces('1/1-1/2,1/5')
+    assert enos.diff_config([('vlan 11', {'member': members})], config) == [
+        'vlan 11', 'no member 1/3-1/4', 'member 1/5', 'exit']
+    members = enos.expand_interfaces('1/1-1/4')
+    assert enos.diff_config([('vlan 11', {'member': members})], config) == []
+    assert enos.diff_config([('vlan 12', {'member': members})], config) == ['vlan 12', 'member 1/1-1/4', 'exit']
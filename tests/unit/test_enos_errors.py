@@ -0,0 +1,70 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Unit tests of the CLI error scan of module_utils/enos.py, on replies as
+# benchmarks.simulator prints them
+#
+import pytest
+
+from ansible.module_utils import enos
+
+# A show tech reply whose counters and log lines carry the word "error"
+SHOW_TECH = (
+    'show tech-support\r\n'
+    '------------------------------------------------------------------\r\n'
+    '[show interface port 1 counters]\r\n'
+    'In errors:                                0\r\n'
+    'CRC errors:                              12\r\n'
+    'Error frames:                             3\r\n'
+    'Invalid packets:                          0\r\n'
+    '[show log]\r\n'
+    'Jan  1  0:00:01 G8272 ERROR   mgmt: error reading SFP on port 7\r\n'
+    'G8272#'
+)
+
+
+def rejected(command, column):
+    # The reply of the switch to a command it cannot parse
+    return command + '\r\n' + ' ' * column + '^\r\n' + "% Invalid input detected at '^' marker.\r\nG8272#"
+
+
+def test_show_tech_counters_pass():
+    assert enos.find_error(SHOW_TECH, 'show tech-support') is None
+
+
+def test_show_tech_counters_scanned_without_command():
+    # Without the command the whole reply is scanned as CLI feedback
+    assert enos.find_error(SHOW_TECH) == 'Error frames:                             3'
+
+
+@pytest.mark.parametrize('command', ['show vlan foo', 'sh vlan foo', 'sho vlan foo', '  show vlan foo'])
+def test_invalid_input_after_marker(command):
+    error = enos.find_error(rejected(command, command.index('foo')), command)
+    assert error == "% Invalid input detected at '^' marker."
+
+
+def test_invalid_input_of_config_command():
+    assert enos.find_error(rejected('vlan 5000', 5), 'vlan 5000') == "% Invalid input detected at '^' marker."
+
+
+def test_config_reply_scanned_fully():
+    response = 'interface port 1/5\r\nmtu 9000\r\n\r\n\r\n\r\nError: MTU exceeds the maximum\r\nG8272(config-if)#'
+    assert enos.find_error(response, 'interface port 1/5') == 'Error: MTU exceeds the maximum'
+
+
+def test_error_word_inside_a_line_passes():
+    assert enos.find_error('description "no errors here"\r\nG8272(config-if)#', 'description "no errors here"') is None
+
+
+@pytest.mark.parametrize('command, mode', [
+    ('show running-config', 'exec'),
+    ('sh run', 'exec'),
+    ('sho tech', 'exec'),
+    ('  show vlan', 'exec'),
+    ('ping 10.0.0.1', 'exec'),
+    ('shutdown', 'config'),
+    ('showx', 'config'),
+    ('vlan 11', 'config'),
+])
+def test_command_mode(command, mode):
+    assert enos.command_mode(command) == mode
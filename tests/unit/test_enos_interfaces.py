@@ -0,0 +1,41 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Unit tests of the interface range helpers of module_utils/enos.py
+#
+import pytest
+
+from ansible.module_utils import enos
+
+
+def test_expand_interfaces():
+    assert enos.expand_interfaces('1/1-1/4,1/7') == ['1/1', '1/2', '1/3', '1/4', '1/7']
+    assert enos.expand_interfaces('1/46-48') == ['1/46', '1/47', '1/48']
+    assert enos.expand_interfaces('17-19, 22') == ['17', '18', '19', '22']
+
+
+@pytest.mark.parametrize('text', ['1/5-1/3', '1/1-2/3', '1/x', 'a-b'])
+def test_expand_interfaces_rejects(text):
+    with pytest.raises(ValueError):
+        enos.expand_interfaces(text)
+
+
+def test_interface_ranges():
+    names = ['1/3', '1/1', '17', '1/2', '1/7', '18', '1/2']
+    assert enos.interface_ranges(names) == ['17-18', '1/1-1/3', '1/7']
+    assert enos.interface_ranges(enos.expand_interfaces('1/1-1/48')) == ['1/1-1/48']
+
+
+def test_plan_interfaces_groups_ranges(config):
+    want = [('port', name, {'mtu': '9000'}) for name in enos.expand_interfaces('1/1-1/8')]
+    assert enos.plan_interfaces(want, config) == [
+        'interface port 1/1-1/4', 'mtu 9000', 'exit',
+        'interface port 1/7-1/8', 'mtu 9000', 'exit']
+
+
+def test_plan_interfaces_keeps_other_types_single(config):
+    want = [('ip', '1', {'enable': True}), ('port', '1/5', {'description': '"uplink"'}),
+            ('port', '1/6', {'description': '"core"'})]
+    assert enos.plan_interfaces(want, config) == [
+        'interface ip 1', 'enable', 'exit',
+        'interface port 1/6', 'description "core"', 'exit']
@@ -0,0 +1,146 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Unit tests of the show command parsers of module_utils/enos_parsers.py,
+# on output captured from benchmarks.simulator
+#
+import pytest
+
+from ansible.module_utils import enos_parsers
+
+SHOW_VLAN = (
+    'VLAN                Name                Status            Ports\r\n'
+    '----  --------------------------------  ------  -------------------------\r\n'
+    '1     Default VLAN                      ena     1-16 18-24 26-40 42-48\r\n'
+    '                                                49-54\r\n'
+    '11    servers                           ena     17 25\r\n'
+    '12    VLAN 12                           dis     \r\n'
+)
+
+SHOW_INTERFACE_STATUS = (
+    '------------------------------------------------------------------\r\n'
+    'Alias   Port   Speed    Duplex     Flow Ctrl      Link      Description\r\n'
+    '------- ----   -----   --------  --TX-----RX--   ------    -------------\r\n'
+    '1       1      10000    full      no     no       up        \r\n'
+    '2       2      10000    full      yes    no       down      to core 2\r\n'
+)
+
+SHOW_LLDP = (
+    'LLDP Remote Devices Information\r\n'
+    'Legend(possible values in DMAC column) :\r\n'
+    'NB   - Nearest Bridge          - 01-80-C2-00-00-0E\r\n'
+    '\r\n'
+    'Total number of current entries: 2\r\n'
+    '\r\n'
+    'LocalPort | Index | Remote Chassis ID   | Remote Port  | Remote System Name  | DMAC\r\n'
+    '----------|-------|---------------------|--------------|---------------------|---------\r\n'
+    '1         | 1     | 08 17 f4 33 9d 00   | 23           | G8272-peer          | NB\r\n'
+    '2         | 2     | 08 17 f4 33 9d 00   | 24           | G8272-peer          | NB\r\n'
+)
+
+SHOW_MAC = (
+    'Mac address Aging Time: 300\r\n'
+    '\r\n'
+    'Total number of FDB entries : 2\r\n'
+    '     MAC address       VLAN     Port    Trnk  State  Permanent  Openflow\r\n'
+    '  -----------------  --------  -------  ----  -----  ---------  --------\r\n'
+    '  02:00:00:00:00:00       1    1              FWD               No\r\n'
+    '  02:00:00:00:00:01       2    2        3     FWD    P          No\r\n'
+)
+
+SHOW_VERSION = (
+    'System Information at  0:00:00 Mon Jan  2, 2017\r\n'
+    'Time zone: No timezone configured\r\n'
+    '\r\n'
+    'Lenovo RackSwitch G8272\r\n'
+    '\r\n'
+    'Switch has been up for 1 day, 0 hours, 0 minutes and 0 seconds.\r\n'
+    'Last boot: 0:00:00 Sun Jan  1, 2017 (reset from console)\r\n'
+    '\r\n'
+    'MAC address: a4:8c:db:33:bc:00    IP (If 1) address: 10.0.0.1\r\n'
+    'Hardware Revision: 0\r\n'
+    'Hardware Part No: 00CJ066\r\n'
+    'Switch Serial No: Y052MV59Y052\r\n'
+    '\r\n'
+    'MTM Value: 7159-HCV\r\n'
+    '\r\n'
+    'Software Version 8.4.8.0 (FLASH image1), active configuration.\r\n'
+)
+
+
+def test_vlan_columns_and_wrapped_ports():
+    rows = enos_parsers.parse_output('show vlan', SHOW_VLAN)
+    assert rows == [
+        dict(vlan_id='1', name='Default VLAN', status='ena', ports='1-16 18-24 26-40 42-48 49-54'),
+        dict(vlan_id='11', name='servers', status='ena', ports='17 25'),
+        dict(vlan_id='12', name='VLAN 12', status='dis', ports=''),
+    ]
+
+
+def test_interface_status_splits_flow_control():
+    rows = enos_parsers.parse_output('show interface status', SHOW_INTERFACE_STATUS)
+    assert rows[0] == dict(alias='1', port='1', speed='10000', duplex='full', flow_control_tx='no',
+                           flow_control_rx='no', link='up', description='')
+    assert rows[1]['flow_control_tx'] == 'yes'
+    assert rows[1]['description'] == 'to core 2'
+
+
+def test_lldp_pipe_separated_columns():
+    rows = enos_parsers.parse_output('show lldp remote-device', SHOW_LLDP)
+    assert len(rows) == 2
+    assert rows[1] == dict(local_port='2', index='2', remote_chassis_id='08 17 f4 33 9d 00', remote_port='24',
+                           remote_system_name='G8272-peer', dmac='NB')
+
+
+def test_mac_table_empty_cells():
+    rows = enos_parsers.parse_output('show mac-address-table', SHOW_MAC)
+    assert rows[0] == dict(mac_address='02:00:00:00:00:00', vlan='1', port='1', trunk='', state='FWD',
+                           permanent='', openflow='No')
+    assert rows[1]['trunk'] == '3'
+    assert rows[1]['permanent'] == 'P'
+
+
+def test_header_names_when_columns_differ():
+    parser = enos_parsers.TableParser(['a', 'b'])
+    rows = [parser.feed(line) for line in SHOW_VLAN.splitlines()]
+    rows = [row for row in rows if row is not None] + [parser.close()]
+    assert parser.fields == ['vlan', 'name', 'status', 'ports']
+    # Without merge the wrapped ports are a row of their own
+    assert rows[1:3] == [('', '', '', '49-54'), ('11', 'servers', 'ena', '17 25')]
+
+
+def test_table_ends_at_blank_line():
+    text = SHOW_VLAN + '\r\nPrivate-VLAN  Type\r\n------------  ----\r\n100           primary\r\n'
+    assert [row['vlan_id'] for row in enos_parsers.parse_output('show vlan', text)] == ['1', '11', '12']
+
+
+def test_streaming_matches_whole_output():
+    parser = enos_parsers.get_parser('show vlan')
+    rows = []
+    for line in SHOW_VLAN.splitlines():
+        row = parser.feed(line)
+        if row is not None:
+            rows.append(row)
+    assert enos_parsers.rows_to_dicts(parser, rows, parser.close()) == enos_parsers.parse_output('show vlan', SHOW_VLAN)
+
+
+def test_version_patterns():
+    rows = enos_parsers.parse_output('show version', SHOW_VERSION)
+    assert rows == [dict(model='Lenovo RackSwitch G8272', software_version='8.4.8.0', image='image1',
+                         uptime='1 day, 0 hours, 0 minutes and 0 seconds',
+                         last_boot='0:00:00 Sun Jan  1, 2017 (reset from console)',
+                         mac_address='a4:8c:db:33:bc:00', serial_number='Y052MV59Y052', part_number='00CJ066',
+                         hardware_revision='0', mtm='7159-HCV')]
+
+
+@pytest.mark.parametrize('command, parser', [
+    ('show vlan', enos_parsers.TableParser),
+    ('sh vlan', enos_parsers.TableParser),
+    ('sho int status', enos_parsers.TableParser),
+    ('  show ip arp', enos_parsers.TableParser),
+    ('sh ver', enos_parsers.PatternParser),
+    ('show running-config', type(None)),
+    ('shutdown vlan', type(None)),
+])
+def test_get_parser(command, parser):
+    assert isinstance(enos_parsers.get_parser(command), parser)
@@ -0,0 +1,42 @@
+#
+# Copyright (C) 2017 Lenovo, Inc.
+#
+# Unit tests of VlanSet and vlan_range_commands() of module_utils/enos.py
+#
+import pytest
+
+from ansible.module_utils import enos
+
+
+def test_vlan_set_ranges():
+    vlans = enos.VlanSet('10-20, 25,30-40')
+    assert len(vlans) == 23
+    assert 15 in vlans and 21 not in vlans
+    assert vlans.ranges() == [(10, 20), (25, 25), (30, 40)]
+    assert str(vlans) == '10-20,25,30-40'
+    assert list(enos.VlanSet('4093-4094,1')) == [1, 4093, 4094]
+    assert enos.VlanSet([3, 1, 2]) == enos.VlanSet('1-3')
+
+
+def test_vlan_set_operations():
+    vlans = enos.VlanSet('10-20')
+    assert str(vlans | '15-25') == '10-25'
+    assert str(vlans & [5, 10, 11, 30]) == '10-11'
+    assert str(vlans - '12-18') == '10-11,19-20'
+    vlans.add(4094)
+    vlans.discard(10)
+    assert str(vlans) == '11-20,4094'
+    assert not enos.VlanSet()
+
+
+@pytest.mark.parametrize('text', ['0', '4095', '20-10', '1-', 'x', '5-4095'])
+def test_vlan_set_rejects(text):
+    with pytest.raises(ValueError):
+        enos.VlanSet(text)
+
+
+def test_vlan_range_commands():
+    assert enos.vlan_range_commands('vlan', '1-3,5,7-9') == ['vlan 1-3,5,7-9']
+    lines = enos.vlan_range_commands('no vlan', range(2, 4000, 2), width=40)
+    assert all(len(line) - len('no vlan ') <= 40 for line in lines)
+    assert enos.VlanSet(','.join(line.split()[2] for line in lines)) == enos.VlanSet(range(2, 4000, 2))